@@ -0,0 +1,53 @@
+# CPU only evaluation of the BEAM cost model: log the candidate timings of BEAM on a set of kernels, train the model on them, then search held out
+# kernels with every candidate compiled and with only the BEAM_COST_TOPK the model ranks best, comparing search time and the found kernel time
+# CC=gcc python test/external/external_benchmark_beam_costmodel.py
+# BEAM=4 TOPK=16 python test/external/external_benchmark_beam_costmodel.py
+import os, sys, json, time, tempfile
+# the timings go to a scratch cache, set before tinygrad reads it. the compile cache is off, the second search would get the programs for free
+os.environ.setdefault("CACHEDB", tempfile.mktemp(suffix=".db"))
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv, Context
+from tinygrad.codegen import get_program
+from tinygrad.codegen.opt.search import bufs_from_ast, _time_program
+from tinygrad.codegen.opt.costmodel import train_cost_model, timing_groups, evaluate, LinearCostModel
+from test.helpers import run_child
+
+def kernels(dims):
+  ret = {}
+  for d in dims:
+    a, b = Tensor.empty(d, d, device="CPU"), Tensor.empty(d, d, device="CPU")
+    ret.update({f"matmul_{d}": (a@b).schedule()[-1].ast, f"sum0_{d}": a.sum(0).schedule()[-1].ast, f"sum1_{d}": a.sum(1).schedule()[-1].ast,
+                f"mulmax_{d}": (a*b).max(1).schedule()[-1].ast, f"elementwise_{d}": (a*b+1).relu().schedule()[-1].ast})
+  return ret
+
+def child():
+  ret = {}
+  for name, ast in kernels([int(x) for x in getenv("DIMS", "").split(",")]).items():
+    st = time.perf_counter()
+    with Context(BEAM=getenv("BEAM", 2), IGNORE_BEAM_CACHE=1): p = get_program(ast, Device["CPU"].renderer)
+    search_tm = time.perf_counter() - st
+    lib, bufs = Device["CPU"].compiler.compile(p.src), [b.ensure_allocated() for b in bufs_from_ast(ast, "CPU")]
+    ret[name] = (search_tm, min(_time_program(p, lib, {}, bufs, allow_test_size=False, cnt=10)))
+  print(json.dumps(ret))
+
+def run(dims, **env):
+  return run_child(__file__, capture=True, DIMS=",".join(str(d) for d in dims), BEAM_HALVING=0, CCACHE=0, **env)
+
+if __name__ == "__main__":
+  if getenv("CHILD"): sys.exit(child())
+  train_dims, test_dims, topk = [64, 128, 192], [96, 256], getenv("TOPK", 8)
+  st = time.perf_counter()
+  run(train_dims, BEAM_COST_LOG=1)
+  print(f"logged {sum(len(g) for g in timing_groups('CPU'))} timings of {len(timing_groups('CPU'))} kernels in {time.perf_counter()-st:.2f}s")
+  train_cost_model("CPU").save(fn:=tempfile.mktemp(suffix=".json"))
+  hit, slowdown = evaluate(LinearCostModel.load(fn), train_groups:=timing_groups("CPU"), topk)
+  print(f"train: fastest in the top {topk} for {hit*100:5.1f}%, top {topk} is {slowdown:.3f}x slower than the fastest")
+
+  base = run(test_dims, BEAM_COST_LOG=1)
+  hit, slowdown = evaluate(LinearCostModel.load(fn), [g for g in timing_groups("CPU") if g not in train_groups], topk)
+  print(f"test:  fastest in the top {topk} for {hit*100:5.1f}%, top {topk} is {slowdown:.3f}x slower than the fastest")
+  pruned = run(test_dims, BEAM_COST_MODEL=fn, BEAM_COST_TOPK=topk)
+  for name, (base_search, base_tm) in base.items():
+    search, tm = pruned[name]
+    print(f"{name:16s} search {base_search:8.2f}s -> {search:8.2f}s ({search/base_search:5.2f}x)   kernel {base_tm*1e6:9.1f}us -> {tm*1e6:9.1f}us")
+  os.unlink(fn)
@@ -0,0 +1,33 @@
+# BEAM search time and the speed of the kernel it finds, timing every candidate 3 times (BEAM_HALVING=0) vs successive halving
+# python test/external/external_benchmark_beam_halving.py
+# BEAM=4 ETA=2 DIM=512 python test/external/external_benchmark_beam_halving.py
+import sys, json, time
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv, Context
+from tinygrad.codegen.opt.search import bufs_from_ast, _time_program
+from tinygrad.codegen import get_program
+from test.helpers import run_child
+
+def kernels():
+  dim = getenv("DIM", 256)
+  a, b = Tensor.empty(dim, dim, device="CPU"), Tensor.empty(dim, dim, device="CPU")
+  return {"matmul": (a@b).schedule()[-1].ast, "reduce": a.sum(1).schedule()[-1].ast, "elementwise": (a*b+1).relu().schedule()[-1].ast}
+
+def child():
+  ret = {}
+  for name, ast in kernels().items():
+    st = time.perf_counter()
+    with Context(BEAM=getenv("BEAM", 2), IGNORE_BEAM_CACHE=1): p = get_program(ast, Device["CPU"].renderer)
+    search_tm = time.perf_counter() - st
+    lib, bufs = Device["CPU"].compiler.compile(p.src), [b.ensure_allocated() for b in bufs_from_ast(ast, "CPU")]
+    ret[name] = (search_tm, min(_time_program(p, lib, {}, bufs, allow_test_size=False, cnt=10)))
+  print(json.dumps(ret))
+
+if __name__ == "__main__":
+  if getenv("CHILD"): sys.exit(child())
+  res = {}
+  for eta in [0, getenv("ETA", 3)]:
+    res[eta] = run_child(__file__, capture=True, BEAM_HALVING=eta, IGNORE_BEAM_CACHE=1)
+  for name, (base_search, base_tm) in res[0].items():
+    search, tm = res[max(res)][name]
+    print(f"{name:12s} search {base_search:8.2f}s -> {search:8.2f}s ({search/base_search:5.2f}x)   kernel {base_tm*1e6:9.1f}us -> {tm*1e6:9.1f}us")
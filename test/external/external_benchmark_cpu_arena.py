@@ -0,0 +1,34 @@
+# alloc/free throughput and RSS of CPU buffers, one mmap per buffer vs CPU_ARENA
+# python test/external/external_benchmark_cpu_arena.py
+# CNT=100000 MAXSZ=65536 ARENA=64 python test/external/external_benchmark_cpu_arena.py
+import os, time, random
+from tinygrad import Device, dtypes
+from tinygrad.device import Buffer
+from tinygrad.helpers import getenv
+from test.helpers import run_child
+
+def rss_mb() -> float:
+  with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+
+def run():
+  random.seed(0)
+  cnt, live = getenv("CNT", 20000), getenv("LIVE", 256)
+  sizes = [random.randint(1, getenv("MAXSZ", 16384)) for _ in range(cnt)]
+  Device["CPU"]
+  rss = rss_mb()
+  bufs: list[Buffer] = []
+  st = time.perf_counter()
+  for sz in sizes:
+    # keep a window of live buffers, like the intermediates of a model run without the JIT
+    bufs.append(Buffer("CPU", sz, dtypes.uint8).allocate())
+    bufs[-1].as_buffer(allow_zero_copy=True)[0] = 1
+    if len(bufs) > live: bufs.pop(random.randrange(len(bufs))).deallocate()
+  et = time.perf_counter() - st
+  print(f"CPU_ARENA={getenv('CPU_ARENA', 0):3d}: {cnt/et/1e3:8.1f}k alloc+free/s   rss +{rss_mb()-rss:7.2f} MB with {len(bufs)} live buffers")
+
+if __name__ == "__main__":
+  if getenv("CHILD"): run()
+  else:
+    # the LRU cache would hide the allocator, measure the raw path in fresh processes
+    for arena in (0, getenv("ARENA", 16)):
+      run_child(__file__, LRU=0, CPU_ARENA=arena)
@@ -0,0 +1,35 @@
+# per-kernel compile latency on the CPU, the clang subprocess (ClangJITCompiler) vs in-process LLVM (CPULLVMCompiler), on one thread and on THREADS
+# python test/external/external_benchmark_cpu_compile.py
+# NOOPT=1 THREADS=8 python test/external/external_benchmark_cpu_compile.py
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tinygrad import Tensor
+from tinygrad.helpers import getenv
+from tinygrad.codegen import get_program
+from tinygrad.renderer.cstyle import ClangJITRenderer
+from tinygrad.renderer.llvmir import CPULLVMRenderer
+from tinygrad.runtime.support.compiler_cpu import ClangJITCompiler, CPULLVMCompiler
+
+def kernels():
+  dim = getenv("DIM", 256)
+  x, w, b = Tensor.empty(getenv("BS", 16), dim, device="CPU"), Tensor.empty(dim, dim, device="CPU"), Tensor.empty(dim, device="CPU")
+  out = (x@w+b).relu().sum(1) + (x@w*2).mean(1) + (x@w.T).max(1)
+  return [si.ast for si in out.schedule() if si.ast.op.name == "SINK"]
+
+def bench(name, compiler, srcs, threads):
+  compiler.compile(srcs[0])
+  st = time.perf_counter()
+  if threads == 1: list(map(compiler.compile, srcs))
+  else:
+    with ThreadPoolExecutor(threads) as ex: list(ex.map(compiler.compile, srcs))
+  et = time.perf_counter() - st
+  print(f"{name:6s} threads={threads:2d} {len(srcs):4d} kernels {et*1e3:9.2f} ms {et*1e3/len(srcs):8.3f} ms/kernel")
+
+if __name__ == "__main__":
+  asts = kernels()
+  # the clang renderer carries its compiler, a copy without it renders the source only
+  (clang_ren:=ClangJITRenderer()).compiler = None
+  pairs = [("clang", ClangJITCompiler(), [get_program(ast, clang_ren).src for ast in asts]),
+           ("llvm", CPULLVMCompiler(), [get_program(ast, CPULLVMRenderer()).src for ast in asts])]
+  for threads in sorted({1, getenv("THREADS", 4)}):
+    for name, compiler, srcs in pairs: bench(name, compiler, srcs*getenv("REPEAT", 4), threads)
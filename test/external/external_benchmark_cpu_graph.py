@@ -0,0 +1,30 @@
+# decode tokens/s of tinygrad/apps/llm.py on the CPU, replaying the JIT with HCQGraph (CPU_GRAPH=0) vs the native dispatcher (CPU_GRAPH=1)
+# python test/external/external_benchmark_cpu_graph.py                      # small random weights, no download
+# MODEL=qwen3:0.6b python test/external/external_benchmark_cpu_graph.py     # a real model through llm.py --benchmark
+import sys, time
+from tinygrad import Tensor, nn
+from tinygrad.helpers import getenv
+from test.helpers import run_child
+
+def run():
+  from tinygrad.apps.llm import Transformer
+  Tensor.manual_seed(0)
+  dim, blocks = getenv("DIM", 256), getenv("BLOCKS", 4)
+  model = Transformer(num_blocks=blocks, dim=dim, hidden_dim=dim*4, n_heads=8, n_kv_heads=4, norm_eps=1e-5, vocab_size=getenv("VOCAB", 1024),
+                      head_dim=dim//8, rope_theta=10000.0, max_context=getenv("CTX", 512))
+  Tensor.realize(*nn.state.get_parameters(model))
+  gen = model.generate([0], 0)
+  # the first tokens capture the JIT
+  for _ in range(3): next(gen)
+  st, cnt = time.perf_counter(), getenv("CNT", 50)
+  for _ in range(cnt): next(gen)
+  print(f"CPU_GRAPH={getenv('CPU_GRAPH', 0)}: {cnt/(time.perf_counter()-st):8.2f} tok/s")
+
+if __name__ == "__main__":
+  if getenv("CHILD"): run()
+  else:
+    for graph in (0, 1):
+      if (model:=getenv("MODEL", "")):
+        print(f"CPU_GRAPH={graph}", flush=True)
+        run_child([sys.executable, "-m", "tinygrad.apps.llm", "--model", model, "--benchmark", str(getenv("CNT", 20))], CPU=1, CPU_GRAPH=graph)
+      else: run_child(__file__, CPU=1, CPU_GRAPH=graph)
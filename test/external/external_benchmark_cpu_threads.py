@@ -0,0 +1,33 @@
+# elementwise, reduce and matmul kernels on the CPU device across 1..N cores
+# CPU=1 python test/external/external_benchmark_cpu_threads.py
+# CPU=1 N=4096 MAX_CORES=16 CPU_PIN=0 python test/external/external_benchmark_cpu_threads.py
+import os, time
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv, CPU_COUNT
+from test.helpers import run_child
+
+def bench(name, fxn, cnt=getenv("CNT", 10)):
+  fxn().realize()
+  Device["CPU"].synchronize()
+  tms = []
+  for _ in range(cnt):
+    st = time.perf_counter()
+    fxn().realize()
+    Device["CPU"].synchronize()
+    tms.append(time.perf_counter() - st)
+  print(f"CPU_COUNT={CPU_COUNT.value:3d} {name:12s} {min(tms)*1e3:9.3f} ms")
+
+def run():
+  n = getenv("N", 2048)
+  a, b = Tensor.rand(n, n, device="CPU").realize(), Tensor.rand(n, n, device="CPU").realize()
+  bench("elementwise", lambda: (a*b+1).contiguous())
+  bench("reduce", lambda: a.sum(1))
+  bench("matmul", lambda: a[:n//4]@b)
+
+if __name__ == "__main__":
+  if getenv("CHILD"): run()
+  else:
+    cores = 1
+    while cores <= getenv("MAX_CORES", len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1):
+      run_child(__file__, CPU_COUNT=cores)
+      cores *= 2
@@ -0,0 +1,21 @@
+# run_schedule of a whole model with the method_cache empty, lowering item by item vs PIPELINE_LOWER, with and without a warm PROGRAM_CACHE
+# CPU=1 python test/external/external_benchmark_pipeline_lower.py
+# CPU=1 MODEL=llama PIPELINE_LOWER=8 PRECOMPILE_WORKERS=16 python test/external/external_benchmark_pipeline_lower.py
+from tinygrad import Context
+from tinygrad.helpers import Timing, getenv, CPU_COUNT
+from tinygrad.engine.realize import method_cache, run_schedule, _precompile_pool
+from test.external.external_benchmark_precompile import get_schedule
+
+if __name__ == "__main__":
+  sched = get_schedule()
+  print(f"{len(sched)} schedule items")
+  # the workers are spawned once per process, that isn't part of the lowering
+  _precompile_pool(getenv("PRECOMPILE_WORKERS", CPU_COUNT.value)).apply(int)
+  ahead = getenv("PIPELINE_LOWER", 4)
+  for cache in ["cold", "warm"]:
+    with Context(PROGRAM_CACHE=int(cache == "warm"), CACHELEVEL=int(cache == "warm")):
+      if cache == "warm": run_schedule(list(sched))
+      for name, pl in [("serial", 0), (f"pipelined {ahead:2d}", ahead)]:
+        method_cache.clear()
+        for ei in sched: ei.prg = None
+        with Timing(f"{cache} {name:12s} "), Context(PIPELINE_LOWER=pl, PIPELINE_LOWER_MIN=0): run_schedule(list(sched))
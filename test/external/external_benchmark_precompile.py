@@ -0,0 +1,30 @@
+# cold start lowering of a whole schedule, serial vs PRECOMPILE
+# CPU=1 CACHELEVEL=0 python test/external/external_benchmark_precompile.py
+# CPU=1 CACHELEVEL=0 MODEL=llama PRECOMPILE_WORKERS=16 python test/external/external_benchmark_precompile.py
+from tinygrad import Tensor, nn, Context
+from tinygrad.helpers import Timing, getenv, CPU_COUNT
+from tinygrad.engine.realize import method_cache, precompile_schedule
+
+def get_schedule():
+  if getenv("MODEL", "resnet") == "llama":
+    from extra.models.llama import Transformer
+    model = Transformer(dim=512, hidden_dim=1536, n_heads=8, n_layers=getenv("LAYERS", 4), norm_eps=1e-5, vocab_size=1024, max_context=128, jit=False)
+    for p in nn.state.get_parameters(model): p.replace(Tensor.empty(p.shape, dtype=p.dtype))
+    return model(Tensor([[1,2,3,4]]), 0).schedule()
+  from extra.models.resnet import ResNet50
+  mdl = ResNet50()
+  for p in nn.state.get_parameters(mdl): p.replace(Tensor.empty(p.shape))
+  return mdl(Tensor.empty(getenv("BS", 1), 3, 224, 224)).schedule()
+
+if __name__ == "__main__":
+  sched = get_schedule()
+  print(f"{len(sched)} schedule items")
+  with Context(CACHELEVEL=0):
+    with Timing("serial lower      "):
+      for ei in sched: ei.lower()
+    method_cache.clear()
+    for ei in sched: ei.prg = None
+    workers = getenv("PRECOMPILE_WORKERS", CPU_COUNT.value)
+    with Timing(f"precompile {workers:3d}w   "): precompile_schedule(sched, workers)
+    with Timing("lower after       "):
+      for ei in sched: ei.lower()
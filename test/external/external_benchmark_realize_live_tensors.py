@@ -0,0 +1,17 @@
+# latency of realizing a small tensor with more and more realized tensors (like model weights and optimizer states) alive
+# python test/external/external_benchmark_realize_live_tensors.py
+# COUNTS=1000,100000 python test/external/external_benchmark_realize_live_tensors.py
+import time
+from tinygrad import Tensor, Device
+from tinygrad.helpers import getenv
+
+if __name__ == "__main__":
+  Device.DEFAULT = "NULL"
+  live: list[Tensor] = []
+  x = Tensor.empty(16).realize()
+  for n in [int(c) for c in getenv("COUNTS", "100,1000,10000,50000").split(",")]:
+    live += [Tensor.empty(16, 16).contiguous().realize() if i % 2 else Tensor.empty(4, 4).reshape(16).realize() for i in range(n - len(live))]
+    for _ in range(3): (x+1).realize()
+    st = time.perf_counter()
+    for _ in range(steps:=getenv("STEPS", 100)): (x+1).realize()
+    print(f"{n:7d} live tensors: realize in {(time.perf_counter()-st)/steps*1e6:9.2f} us")
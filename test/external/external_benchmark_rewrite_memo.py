@@ -0,0 +1,37 @@
+# total get_program time of the kernels of a llama training step schedule, with and without REWRITE_MEMO
+# python test/external/external_benchmark_rewrite_memo.py
+# MODEL=8B BACKWARD=0 python test/external/external_benchmark_rewrite_memo.py
+import sys, json, time
+from tinygrad import nn, Tensor, Device, dtypes
+from tinygrad.helpers import getenv
+from tinygrad.uop.ops import Ops
+from tinygrad.codegen import get_program
+from test.helpers import run_child
+
+def child():
+  from extra.models.llama import Transformer
+  from examples.llama3 import MODEL_PARAMS
+  Device.DEFAULT = "NULL"
+  Tensor.training = True
+  model = Transformer(**MODEL_PARAMS[getenv("MODEL", "1B")]["args"], linear=nn.Linear, embedding=nn.Embedding, max_context=256, jit=False,
+                      disable_kv_cache=True)
+  for p in nn.state.get_parameters(model): p.replace(Tensor.empty(*p.shape, dtype=p.dtype))
+  out = model(Tensor.empty(1, 256, dtype=dtypes.int), 0, temperature=float('nan'))
+  outs = [out]
+  if getenv("BACKWARD", 1):
+    (loss:=out.float().mean()).backward()
+    outs = [loss] + [p.grad for p in nn.state.get_parameters(model) if p.grad is not None]
+  # the method cache lowers each ast once, the second pass is lowering them again like BEAM does with every candidate
+  asts = list({si.ast.key:si.ast for si in Tensor.schedule(*outs) if si.ast.op is Ops.SINK}.values())
+  tms = []
+  for _ in range(2):
+    st = time.perf_counter()
+    for ast in asts: get_program(ast, Device["NULL"].renderer)
+    tms.append(time.perf_counter() - st)
+  print(json.dumps({"kernels": len(asts), "time": tms}))
+
+if __name__ == "__main__":
+  if getenv("CHILD"): sys.exit(child())
+  for memo in [0, 1]:
+    res = run_child(__file__, capture=True, REWRITE_MEMO=memo)
+    print(f"REWRITE_MEMO={memo}: get_program of {res['kernels']} kernels in {res['time'][0]:8.2f}s, again in {res['time'][1]:8.2f}s")
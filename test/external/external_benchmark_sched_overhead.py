@@ -0,0 +1,42 @@
+# python time per step of a training loop without TinyJit on the NULL device, every step after the first is a schedule cache hit
+# python test/external/external_benchmark_sched_overhead.py
+# LAYERS=32 DIM=512 STEPS=50 python test/external/external_benchmark_sched_overhead.py
+import time, functools
+from tinygrad import Tensor, nn, Device
+from tinygrad.helpers import getenv
+import tinygrad.tensor
+
+tms: dict[str, float] = {}
+def timed(name, fxn):
+  @functools.wraps(fxn)
+  def wrapper(*args, **kwargs):
+    st = time.perf_counter()
+    try: return fxn(*args, **kwargs)
+    finally: tms[name] = tms.get(name, 0.0) + time.perf_counter() - st
+  return wrapper
+tinygrad.tensor.complete_create_schedule_with_vars = timed("schedule", tinygrad.tensor.complete_create_schedule_with_vars)
+tinygrad.tensor._apply_map_to_tensors = timed("apply map", tinygrad.tensor._apply_map_to_tensors)
+
+class MLP:
+  def __init__(self, dim:int, layers:int): self.layers = [nn.Linear(dim, dim) for _ in range(layers)]
+  def __call__(self, x:Tensor) -> Tensor: return x.sequential([lambda x,l=l: l(x).relu() for l in self.layers])
+
+if __name__ == "__main__":
+  Device.DEFAULT = "NULL"
+  dim, steps = getenv("DIM", 256), getenv("STEPS", 20)
+  model = MLP(dim, getenv("LAYERS", 8))
+  opt = nn.optim.Adam(nn.state.get_parameters(model))
+
+  @Tensor.train()
+  def step():
+    opt.zero_grad()
+    loss = model(Tensor.empty(getenv("BS", 32), dim)).mean()
+    loss.backward()
+    opt.step()
+    return loss.realize()
+
+  for _ in range(3): step()
+  tms.clear()
+  st = time.perf_counter()
+  for _ in range(steps): step()
+  print(f"step {(time.perf_counter()-st)/steps*1e3:8.2f} ms, " + ", ".join(f"{k} {v/steps*1e3:8.2f} ms" for k,v in tms.items()))
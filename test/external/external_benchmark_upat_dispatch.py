@@ -0,0 +1,41 @@
+# schedule and get_program time of a llama training step with the PatternMatcher dispatch on (op, dtype, src ops) and without it (UPAT_DISPATCH=0),
+# and with TRACK_MATCH_STATS the number of patterns tried and the number that matched
+# python test/external/external_benchmark_upat_dispatch.py
+# MODEL=8B BACKWARD=0 python test/external/external_benchmark_upat_dispatch.py
+import sys, json, time
+from tinygrad import nn, Tensor, Device, dtypes
+from tinygrad.helpers import getenv
+from tinygrad.uop.ops import Ops, match_stats
+from tinygrad.codegen import get_program
+from test.helpers import run_child
+
+def child():
+  from extra.models.llama import Transformer
+  from examples.llama3 import MODEL_PARAMS
+  Device.DEFAULT = "NULL"
+  Tensor.training = True
+  model = Transformer(**MODEL_PARAMS[getenv("MODEL", "1B")]["args"], linear=nn.Linear, embedding=nn.Embedding, max_context=256, jit=False,
+                      disable_kv_cache=True)
+  for p in nn.state.get_parameters(model): p.replace(Tensor.empty(*p.shape, dtype=p.dtype))
+  out = model(Tensor.empty(1, 256, dtype=dtypes.int), 0, temperature=float('nan'))
+  outs = [out]
+  if getenv("BACKWARD", 1):
+    (loss:=out.float().mean()).backward()
+    outs = [loss] + [p.grad for p in nn.state.get_parameters(model) if p.grad is not None]
+  st = time.perf_counter()
+  sched = Tensor.schedule(*outs)
+  sched_tm = time.perf_counter() - st
+  asts = list({si.ast.key:si.ast for si in sched if si.ast.op is Ops.SINK}.values())
+  st = time.perf_counter()
+  for ast in asts: get_program(ast, Device["NULL"].renderer)
+  print(json.dumps({"kernels": len(asts), "schedule": sched_tm, "lower": time.perf_counter() - st,
+                    "tried": sum(v[1] for v in match_stats.values()), "matched": sum(v[0] for v in match_stats.values())}))
+
+if __name__ == "__main__":
+  if getenv("CHILD"): sys.exit(child())
+  for dispatch in [0, 1]:
+    # TRACK_MATCH_STATS prints the stats of every pattern at exit, after the json
+    res = run_child(__file__, capture=True, UPAT_DISPATCH=dispatch)
+    stats = run_child(__file__, capture=True, UPAT_DISPATCH=dispatch, TRACK_MATCH_STATS=1)
+    print(f"UPAT_DISPATCH={dispatch}: schedule {res['schedule']:6.2f}s, get_program of {res['kernels']} kernels {res['lower']:6.2f}s, "
+          f"{stats['tried']:9d} patterns tried, {stats['matched']:7d} matched")
@@ -1,4 +1,4 @@
-import os, time, struct, functools, unittest
+import os, sys, json, time, struct, functools, unittest, subprocess
 from typing import Any, Callable
 import numpy as np
 from tinygrad import Tensor, dtypes, Device
@@ -23,6 +23,13 @@ def get_uops(sink:UOp, ren:Renderer|None=None) -> list[UOp]:
   full_sink = full_rewrite_to_sink(sink, ren, optimize=sink.tag is None)
   return line_rewrite(linearize(full_sink), pm_linearize_cleanups)
 
+def run_child(cmd:str|list[str], capture=False, **env) -> Any:
+  """Run a benchmark script (or a command) in a fresh process with CHILD=1 and env set, for the ContextVars read at import and a clean device.
+  With capture, returns the last json line the child printed, else its output goes to the terminal."""
+  cmd, env = [sys.executable, cmd] if isinstance(cmd, str) else cmd, {**os.environ, "CHILD": "1", **{k:str(v) for k,v in env.items()}}
+  if not capture: return subprocess.run(cmd, check=True, env=env)
+  return json.loads([l for l in subprocess.check_output(cmd, env=env).decode().splitlines() if l.startswith("{")][-1])
+
 def derandomize_model(model):
   for p in get_parameters(model):
     p.replace(Tensor.empty(p.shape, device=p.device, dtype=p.dtype))
@@ -1,7 +1,8 @@
 import unittest
+from unittest.mock import patch
 from tinygrad import dtypes, Device
 from tinygrad.device import Buffer
-from tinygrad.engine.memory import _internal_memory_planner
+from tinygrad.engine.memory import _internal_memory_planner, _greedy_by_size
 
 global_map = {}
 def b(i, base=None, offset=0, pin=False, size=16):
@@ -134,5 +135,36 @@ class TestMemoryPlanner(unittest.TestCase):
     ]
     check_assign(bs)
 
+  def test_mixed_sizes(self):
+    bs = [
+      [b(0, size=4096), b(1, size=8192)],
+      [b(2, size=12288), b(0)],
+      [b(3, size=4096), b(2), b(1)],
+      [b(4, size=16384), b(3)],
+      [b(5, size=4096), b(4), b(2)],
+    ]
+    check_assign(bs)
+
+  def test_greedy_by_size(self):
+    x, y, z = b(0), b(1), b(2)
+    offsets, peak = _greedy_by_size({x:(0, 2, 8192), y:(1, 3, 4096), z:(2, 4, 8192)})
+    # x and z don't overlap in time and share offset 0, y goes above them. peak is the lower bound at t=1
+    self.assertEqual((offsets[x], offsets[z], offsets[y]), (0, 0, 8192))
+    self.assertEqual(peak, 12288)
+
+  def test_planned_not_worse(self):
+    # needs a device that can suballocate
+    bufs = [Buffer("CPU", 4096*(1+i%3), dtypes.int8) for i in range(13)]
+    assigned = _internal_memory_planner([[bufs[i], bufs[i+1]] for i in range(12)], noopt_buffers=None, offline=True)
+    sizes = {v.base.nbytes for v in assigned.values()}
+    self.assertEqual(len(sizes), 1)
+    # at most two 12K buffers are live at any time
+    self.assertLessEqual(sizes.pop(), 2*12288)
+
+  def test_offline_only_when_asked(self):
+    bufs = [Buffer("CPU", 4096*(1+i%3), dtypes.int8) for i in range(5)]
+    with patch("tinygrad.engine.memory._greedy_by_size", side_effect=RuntimeError("greedy planner ran")):
+      self.assertEqual(len(_internal_memory_planner([[bufs[i], bufs[i+1]] for i in range(4)], noopt_buffers=None)), 5)
+
 if __name__ == "__main__":
   unittest.main()
@@ -1,5 +1,7 @@
 import unittest
+from unittest.mock import patch
 from tinygrad import Tensor, Device, Variable
+from tinygrad.engine.realize import precompile_schedule, run_schedule
 from examples.gpt2 import Transformer
 from tinygrad.nn.state import get_state_dict
 
@@ -30,6 +32,19 @@ class TestMethodCache(unittest.TestCase):
     Device[Device.DEFAULT].compiler.compile_cached = None
     ((c+d)+(a+b)).realize()
 
+  def test_precompile_schedule(self):
+    a = Tensor([1.,2,3,4]).contiguous().realize()
+    b = (a*1337.5).contiguous()
+    c = (a+b+1337.25).sum()
+    d = (a*1337.5).contiguous()  # same kernel as b, only compiled once
+    sched = Tensor.schedule(c, d)
+    self.assertEqual(precompile_schedule(sched, workers=1), 2)
+    # everything is in the method_cache now, nothing is lowered during run_schedule
+    with patch("tinygrad.engine.realize.get_program", side_effect=RuntimeError("get_program called")):
+      Device[Device.DEFAULT].compiler.compile_cached = None
+      run_schedule(sched)
+    self.assertEqual(c.item(), 1337.5*10+10+1337.25*4)
+
   @unittest.skip("incorrect use of transformer")
   def test_small_transformer(self):
     args_tiny = {"dim": 16, "n_heads": 8, "n_layers": 8, "norm_eps": 1e-05, "vocab_size": 10}
@@ -0,0 +1,74 @@
+import unittest, json, tempfile, os, random
+from unittest.mock import patch
+from tinygrad import Tensor, Device
+from tinygrad.helpers import Context, GlobalCounters
+from tinygrad.engine.realize import ExecItem
+from tinygrad.codegen.opt.search import export_beam_db, import_beam_db, beam_coverage, beam_schedule
+
+class TestBeamDB(unittest.TestCase):
+  def setUp(self):
+    self.fn = tempfile.mktemp(suffix=".json")
+    self.a = Tensor.ones(13, 7).contiguous().realize()
+    # the tuning DB outlives the test, a new constant makes a new kernel
+    self.k = random.randint(2, 1<<20)
+  def tearDown(self):
+    if os.path.exists(self.fn): os.unlink(self.fn)
+  def out(self): return (self.a * self.k).sum(1)
+
+  def test_coverage(self):
+    self.assertEqual(beam_coverage(self.out().schedule()), (0, ["r_13_7"]))
+    with Context(BEAM=1, IGNORE_BEAM_CACHE=1): self.out().realize()
+    self.assertEqual(beam_coverage(self.out().schedule()), (1, []))
+    hits = GlobalCounters.beam_db_hits
+    with Context(BEAM_DB=1): self.assertEqual(self.out().tolist(), [7.0*self.k]*13)
+    self.assertEqual(GlobalCounters.beam_db_hits, hits+1)
+
+  def test_other_arch_opts(self):
+    # opts tuned for another arch that don't apply here fall back to the hand-coded opts
+    from tinygrad.codegen.opt import Opt, OptOps
+    from tinygrad.codegen.opt.postrange import Scheduler, beam_db_key, apply_opts
+    from tinygrad.codegen.opt.search import beam_db_put
+    ast, ren = self.out().schedule()[-1].ast, Device[Device.DEFAULT].renderer
+    (k:=Scheduler(ast, ren)).convert_loop_to_global()
+    beam_db_put(beam_db_key(k), [Opt(OptOps.UPCAST, 7, 3)], 1e-6)
+    misses = GlobalCounters.beam_db_misses
+    with Context(BEAM_DB=1): apply_opts(ast, ren)
+    self.assertEqual(GlobalCounters.beam_db_misses, misses+1)
+
+  def test_export_import(self):
+    with Context(BEAM=1, IGNORE_BEAM_CACHE=1): (self.a + self.k).sum(0).realize()
+    self.assertGreaterEqual(export_beam_db(self.fn, Device.DEFAULT), 1)
+    self.assertEqual(import_beam_db(self.fn), (0, 0))
+    with open(self.fn) as f: data = json.load(f)
+    # a faster entry replaces the one in the DB, a slower one doesn't
+    for e in data["entries"]: e["tm"] /= 2
+    with open(self.fn, "w") as f: json.dump(data, f)
+    self.assertEqual(import_beam_db(self.fn), (0, len(data["entries"])))
+    for e in data["entries"]: e["tm"] *= 4
+    with open(self.fn, "w") as f: json.dump(data, f)
+    self.assertEqual(import_beam_db(self.fn), (0, 0))
+
+  def test_beam_schedule(self):
+    # the matmul has most of the runtime, the small sum gets no share of the budget
+    b = Tensor.ones(16, 16).contiguous().realize()
+    def outs(): return [(b@b*self.k).sum(1), (self.a[:1, :2]*self.k).sum()]
+    # the launch overhead dominates the wall time of kernels this small, the profiled time is the op count
+    def run(ei, *args, **kwargs): return int(ei.prg.p.estimates.ops)*1e-9
+    with patch.object(ExecItem, "run", run): ret = beam_schedule(Tensor.schedule(*outs()), budget=1.0, amt=2, min_share=0.05)
+    self.assertEqual(len(ret), 1)
+    self.assertRegex(ret[0][0], r"^r_16_16_16(n\d+)?$")
+    tuned, missing = beam_coverage(Tensor.schedule(*outs()))
+    self.assertEqual((tuned, len(missing)), (1, 1))
+    self.assertRegex(missing[0], r"^r_2(n\d+)?$")
+    with Context(BEAM=2, BEAM_BUDGET=1): Tensor.realize(*(out:=outs()))
+    self.assertEqual(out[0].tolist(), [16.0*16*self.k]*16)
+    # the kernels were seen, they are not run again
+    with patch.object(ExecItem, "run", side_effect=RuntimeError("profiled again")):
+      self.assertEqual(beam_schedule(Tensor.schedule(*outs()), budget=1.0, amt=2, min_share=0.05), [])
+
+  def test_beam_budget_needs_cache(self):
+    with Context(BEAM=1, BEAM_BUDGET=1, CACHELEVEL=0):
+      with self.assertRaises(RuntimeError): self.out().realize()
+
+if __name__ == '__main__':
+  unittest.main()
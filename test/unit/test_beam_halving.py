@@ -0,0 +1,35 @@
+import unittest
+from unittest.mock import patch
+from tinygrad.codegen.opt.search import _successive_halving
+
+class TestSuccessiveHalving(unittest.TestCase):
+  def _run(self, n:int, amt:int, eta:int, slow:set[int]=set()):
+    # candidate i takes i+1 us. a reduced global size gives the same ranking, except for the candidates in slow that only lose on the full size
+    calls: list[tuple[int, int]] = []
+    def time_program(p, lib, var_vals, rawbufs, early_stop=None, allow_test_size=True, max_global_size=65536, clear_l2=False, cnt=3):
+      calls.append((lib[0], max_global_size))
+      return [(lib[0]+1 + (100 if lib[0] in slow and max_global_size == 65536 else 0))*1e-6]*cnt
+    with patch("tinygrad.codegen.opt.search._time_program", time_program):
+      ret = _successive_halving([(i, None, bytes([i])) for i in range(n)], {}, [], amt, eta, True, False, 1.0)
+    return ret, calls
+
+  def test_rungs(self):
+    ret, calls = self._run(40, amt=2, eta=3)
+    # 40 > 2*3**2 so there are two reduced rungs: 40 candidates on 1/9 of the global size, the fastest 14 on 1/3, the fastest 5 on all of it
+    self.assertEqual({sz:sum(1 for _,s in calls if s == sz) for _,sz in calls}, {65536//9: 40, 65536//3: 14, 65536: 5})
+    self.assertEqual([i for i,_ in ret], [0, 1, 2, 3, 4])
+    self.assertEqual(ret[0][1], 1e-6)
+
+  def test_few_candidates(self):
+    # with no more than amt*eta candidates every one is timed on the full size, like without halving
+    ret, calls = self._run(6, amt=2, eta=3)
+    self.assertEqual(calls, [(i, 65536) for i in range(6)])
+    self.assertEqual(len(ret), 6)
+
+  def test_final_rung_ranks(self):
+    # the survivors are ranked by their time on the full size
+    ret, _ = self._run(20, amt=2, eta=3, slow={0})
+    self.assertEqual([i for i,_ in ret], [1, 2, 0])
+
+if __name__ == '__main__':
+  unittest.main()
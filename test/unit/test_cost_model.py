@@ -0,0 +1,37 @@
+import unittest, os, random, tempfile
+from tinygrad import Tensor, Device, Context
+from tinygrad.codegen.opt.postrange import Scheduler, bufs_from_ast
+from tinygrad.codegen.opt.search import beam_search
+from tinygrad.codegen.opt.costmodel import CostModel, LinearCostModel, evaluate, load_cost_model
+
+class CountingModel(CostModel):
+  calls: list[int] = []
+  def predict(self, feats):
+    CountingModel.calls.append(len(feats))
+    return [random.random() for _ in feats]
+
+class TestCostModel(unittest.TestCase):
+  def test_fit(self):
+    # each kernel has its own offset, the model only learns the order within a kernel
+    w = [1.0, -2.0, 0.5]
+    groups = [[(f:=[random.uniform(0, 4) for _ in w], 2**(sum(a*b for a,b in zip(w, f)) + k)) for _ in range(20)] for k in range(5)]
+    model = LinearCostModel.fit(groups, l2=1e-6)
+    for a,b in zip(model.weights, w): self.assertAlmostEqual(a, b, places=3)
+    self.assertEqual(evaluate(model, groups, 1), (1.0, 1.0))
+
+  def test_save_load(self):
+    fn = tempfile.mktemp(suffix=".json")
+    try:
+      LinearCostModel([1.0, 2.0]).save(fn)
+      self.assertEqual(load_cost_model(fn).weights, [1.0, 2.0])
+    finally: os.unlink(fn)
+
+  def test_beam_topk(self):
+    ast = (Tensor.empty(16, 16)@Tensor.empty(16, 16)).schedule()[-1].ast
+    with Context(BEAM_COST_MODEL=f"{__name__}:CountingModel", BEAM_COST_TOPK=3):
+      s = beam_search(Scheduler(ast, Device[Device.DEFAULT].renderer), bufs_from_ast(ast, Device.DEFAULT), 2, disable_cache=True)
+    self.assertGreater(len(CountingModel.calls), 0)
+    self.assertGreater(len(s.applied_opts), 0)
+
+if __name__ == '__main__':
+  unittest.main()
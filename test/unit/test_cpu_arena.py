@@ -0,0 +1,38 @@
+import unittest
+from tinygrad import Device
+from tinygrad.device import BufferSpec
+from tinygrad.helpers import Context
+from tinygrad.runtime.ops_cpu import CPUAllocator
+
+class TestCPUArena(unittest.TestCase):
+  def setUp(self):
+    with Context(CPU_ARENA=1): self.alloc = CPUAllocator(Device["CPU"])
+
+  def test_small_from_arena(self):
+    bufs = [self.alloc.alloc(sz, BufferSpec()) for sz in (1, 100, 4096, 65536)]
+    self.assertEqual(len(self.alloc.arenas), 1)
+    arena_buf, tlsf = self.alloc.arenas[0]
+    for b in bufs:
+      self.assertIs(b._base, arena_buf)
+      self.assertEqual(b.va_addr % 64, 0)
+    with Context(LRU=0):
+      for b,sz in zip(bufs, (1, 100, 4096, 65536)): self.alloc.free(b, sz, BufferSpec())
+    # all blocks merged back into one free block
+    self.assertEqual(list(tlsf.blocks.values()), [(1 << 20, 1 << 20, None, True)])
+
+  def test_new_arena_when_full(self):
+    bufs = [self.alloc.alloc(65536, BufferSpec()) for _ in range(20)]
+    self.assertEqual(len(self.alloc.arenas), 2)
+    self.assertEqual(len({b.va_addr for b in bufs}), 20)
+
+  def test_large_and_host_bypass(self):
+    self.assertIsNone(self.alloc.alloc(1 << 20, BufferSpec())._base)
+    self.assertIsNone(self.alloc.alloc(64, BufferSpec(host=True))._base)
+
+  def test_contents(self):
+    bufs = [self.alloc.alloc(10+i, BufferSpec()) for i in range(8)]
+    for i,b in enumerate(bufs): self.alloc._copyin(b, memoryview(bytearray([i]*(10+i))))
+    self.assertEqual([bytes(self.alloc._as_buffer(b)) for b in bufs], [bytes([i]*(10+i)) for i in range(8)])
+
+if __name__ == '__main__':
+  unittest.main()
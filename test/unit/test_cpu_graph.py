@@ -0,0 +1,34 @@
+import unittest, shutil
+from tinygrad import Tensor, TinyJit, Device, Variable
+from tinygrad.helpers import getenv
+from tinygrad.renderer.cstyle import ClangJITRenderer
+from tinygrad.runtime.graph.cpu import CPUGraph
+
+@unittest.skipUnless(shutil.which(getenv("CC", "clang")) and isinstance(Device["CPU"].renderer, ClangJITRenderer), "needs the clang CPU backend")
+class TestCPUGraph(unittest.TestCase):
+  def setUp(self): self.graph, Device["CPU"].graph = Device["CPU"].graph, CPUGraph
+  def tearDown(self): Device["CPU"].graph = self.graph
+
+  def _graph(self, jit):
+    graphs = [ji.prg for ji in jit.captured._jit_cache if isinstance(ji.prg, CPUGraph)]
+    self.assertEqual(len(graphs), 1)
+    return graphs[0]
+
+  def test_replay(self):
+    @TinyJit
+    def f(a, b): return ((a+b)*2).contiguous().sum(0).contiguous() + 1
+    for i in range(4):
+      a, b = Tensor([[float(i+j+k) for j in range(8)] for k in range(4)], device="CPU"), Tensor.full((4, 8), float(i), device="CPU").contiguous()
+      self.assertEqual(f(a, b).tolist(), (((a+b)*2).sum(0)+1).tolist())
+    self.assertTrue(self._graph(f).native)
+
+  def test_symbolic(self):
+    @TinyJit
+    def f(a, v): return (a[:, :v].sum(1).contiguous() * 2).contiguous() + 1
+    vv = Variable("v", 1, 8)
+    a = Tensor([[float(j*4+k) for j in range(8)] for k in range(4)], device="CPU").realize()
+    for n in range(1, 6): self.assertEqual(f(a, vv.bind(n)).tolist(), (a[:, :n].sum(1)*2+1).tolist())
+    self.assertTrue(self._graph(f).native)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,43 @@
+import unittest, threading, time
+from tinygrad.runtime.ops_cpu import CPUWorkerPool
+
+class TestCPUWorkerPool(unittest.TestCase):
+  def test_every_chunk_once(self):
+    pool = CPUWorkerPool(3)
+    for n in (2, 4, 7, 32):
+      ran: list[int] = []
+      pool.run(lambda tid, out: out.append(tid), [ran], n)
+      self.assertEqual(sorted(ran), list(range(n)))
+
+  def test_chunks_on_workers(self):
+    pool = CPUWorkerPool(3)
+    threads: set[int] = set()
+    def cmd(tid):
+      threads.add(threading.get_ident())
+      time.sleep(0.01)
+    pool.run(cmd, [], 8)
+    # the caller takes part, the workers pick up the rest
+    self.assertGreater(len(threads), 1)
+    self.assertIn(threading.get_ident(), threads)
+
+  def test_many_jobs(self):
+    pool = CPUWorkerPool(2)
+    total = [0]
+    lock = threading.Lock()
+    def cmd(tid):
+      with lock: total[0] += tid
+    for _ in range(200): pool.run(cmd, [], 3)
+    self.assertEqual(total[0], 200*3)
+
+  def test_error_keeps_workers(self):
+    pool = CPUWorkerPool(3)
+    def cmd(tid):
+      time.sleep(0.01)
+      if tid == 3: raise RuntimeError("kernel failed")
+    with self.assertRaises(RuntimeError): pool.run(cmd, [], 8)
+    # every chunk waits for the others, so this only finishes if all 3 workers are still there
+    barrier = threading.Barrier(4, timeout=10)
+    pool.run(lambda tid: barrier.wait(), [], 4)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -100,6 +100,22 @@ class TestCompiler(unittest.TestCase):
       a = Tensor([0.,1.], device=Device.DEFAULT).realize()
       (a + 1).realize()
 
+  def test_llvm_compile_threads(self):
+    from concurrent.futures import ThreadPoolExecutor
+    from tinygrad.codegen import get_program
+    from tinygrad.renderer.llvmir import CPULLVMRenderer
+    from tinygrad.runtime.support.compiler_cpu import CPULLVMCompiler
+    try: compiler = CPULLVMCompiler()
+    except Exception as e: self.skipTest(f"skipping compiler test: no llvm: {e}")
+    with Context(NOOPT=1):
+      srcs = [get_program((Tensor.empty(64, device="CPU")*i+1).contiguous().schedule()[-1].ast, CPULLVMRenderer()).src for i in range(2, 10)]
+    ref = [compiler.compile(src) for src in srcs]
+    with ThreadPoolExecutor(4) as ex:
+      self.assertEqual(list(ex.map(compiler.compile, srcs*4)), ref*4)
+      self.assertGreater(len(compiler.thread_states), 1)
+    # the states of the pool threads are freed when they exit
+    self.assertEqual(len(compiler.thread_states), 1)
+
 class TestRunAsModule(unittest.TestCase):
   def test_module_runs(self):
     out = '\n'.join(enumerate_devices_str())
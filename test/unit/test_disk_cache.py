@@ -1,9 +1,25 @@
 import unittest
-import pickle
-from tinygrad.helpers import diskcache_get, diskcache_put, diskcache, diskcache_clear
+import pickle, os, sys, subprocess, tempfile, hashlib, random, multiprocessing
+from tinygrad.helpers import diskcache_get, diskcache_put, diskcache, diskcache_clear, diskcache_flush, filecache_get, filecache_put, filecache_path
+from tinygrad.helpers import Context, getenv
+from tinygrad.device import Compiler
 
 def remote_get(table,q,k): q.put(diskcache_get(table, k))
 def remote_put(table,k,v): diskcache_put(table, k, v)
+class SlowCompiler(Compiler):
+  def __init__(self): super().__init__("test_filecache_stress")
+  def compile(self, src:str) -> bytes: return hashlib.sha256(src.encode()).digest() * 4096
+
+def compile_many(x):
+  d, seed = x
+  # every process compiles the same sources in a different order, so the writers of a key race each other
+  srcs = [f"kernel {i}" for i in range(64)]
+  random.Random(seed).shuffle(srcs)
+  with Context(CCACHE_DIR=d): return all(SlowCompiler().compile_cached(src) == SlowCompiler().compile(src) for src in srcs)
+
+def sqlite_get(table,k):
+  from tinygrad.helpers import db_connection, VERSION
+  return db_connection().execute(f"SELECT val FROM '{table}_{VERSION}' WHERE key=?", (k,)).fetchone()[0]
 
 class DiskCache(unittest.TestCase):
   def test_putget(self):
@@ -81,6 +97,48 @@ class DiskCache(unittest.TestCase):
     diskcache_put(table, "key", "test")
     self.assertEqual(diskcache_get(table, "key"), "test")
 
+  def test_flush_on_exit(self):
+    # the put is only in the write-behind queue when the process exits
+    with tempfile.TemporaryDirectory() as d:
+      env = {**os.environ, "CACHEDB": os.path.join(d, "cache.db"), "CACHE_FLUSH_INTERVAL": "100"}
+      subprocess.run([sys.executable, "-c", "from tinygrad.helpers import diskcache_put; diskcache_put('test_exit', 'k', 'v')"], env=env, check=True)
+      out = subprocess.run([sys.executable, "-c", "from tinygrad.helpers import diskcache_get; print(diskcache_get('test_exit', 'k'))"], env=env,
+                           check=True, capture_output=True).stdout
+      self.assertEqual(out.strip(), b"v")
+
+  def test_evict(self):
+    with tempfile.TemporaryDirectory() as d:
+      code = """
+from tinygrad.helpers import diskcache_put, diskcache_get, diskcache_flush, diskcache_size, _db_mem
+for i in range(64):
+  diskcache_put('test_evict', i, bytes(16384))
+  diskcache_flush()
+  # keep the first entry hot
+  _db_mem.clear()
+  assert diskcache_get('test_evict', 0) is not None
+assert diskcache_size() < 512*1024, diskcache_size()
+_db_mem.clear()
+assert diskcache_get('test_evict', 0) is not None and diskcache_get('test_evict', 1) is None and diskcache_get('test_evict', 63) is not None
+"""
+      subprocess.run([sys.executable, "-c", code], env={**os.environ, "CACHEDB": os.path.join(d, "cache.db"), "CACHE_MAX_BYTES": str(512*1024),
+                                                       "CACHE_TOUCH_INTERVAL": "0"},
+                     check=True)
+
+  def test_hit_touch_coarse(self):
+    from tinygrad.helpers import _db_mem, _db_touched, _db_key
+    diskcache_put(table:="test_hit_touch", "k", "v")
+    diskcache_flush()
+    _db_mem.clear()
+    # the access time written with the put is recent, the hit doesn't write it again
+    self.assertEqual(diskcache_get(table, "k"), "v")
+    self.assertNotIn(_db_key(table, {"key": "k"}), _db_touched)
+
+  def test_flush(self):
+    table = "test_flush"
+    diskcache_put(table, "k", "flushed")
+    diskcache_flush()
+    self.assertEqual(pickle.loads(sqlite_get(table, "k")), "flushed")
+
   @unittest.skip("disabled by default because this drops cache table")
   def test_clear_cache(self):
     # clear cache to start
@@ -104,5 +162,33 @@ class DiskCache(unittest.TestCase):
     diskcache_clear()
     diskcache_clear()
 
+class FileCache(unittest.TestCase):
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.ctx = Context(CCACHE_DIR=self.tmp.name)
+    self.ctx.__enter__()
+  def tearDown(self):
+    self.ctx.__exit__()
+    self.tmp.cleanup()
+
+  def test_putget(self):
+    self.assertIsNone(filecache_get("test_putget", "hello"))
+    filecache_put("test_putget", "hello", b"world")
+    self.assertEqual(filecache_get("test_putget", "hello"), b"world")
+    filecache_put("test_putget", "hello", b"world2")
+    self.assertEqual(filecache_get("test_putget", "hello"), b"world2")
+    self.assertEqual(os.listdir(filecache_path("test_putget", "hello").parent), [filecache_path("test_putget", "hello").name])
+
+  def test_compiler_uses_files(self):
+    self.assertEqual(SlowCompiler().compile_cached("kernel"), SlowCompiler().compile("kernel"))
+    self.assertTrue(filecache_path("test_filecache_stress", "kernel").is_file())
+    self.assertIsNone(diskcache_get("test_filecache_stress", "kernel"))
+
+  def test_stress(self):
+    n = getenv("STRESS_PROCS", 8)
+    with multiprocessing.get_context("spawn").Pool(n) as pool: self.assertTrue(all(pool.map(compile_many, [(self.tmp.name, i) for i in range(n*2)])))
+    # no temp file is left behind
+    self.assertEqual(sum(len(files) for _,_,files in os.walk(self.tmp.name)), 64)
+
 if __name__ == "__main__":
   unittest.main()
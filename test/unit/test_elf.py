@@ -1,6 +1,8 @@
-import unittest, subprocess, platform
+import unittest, subprocess, platform, ctypes
+from tinygrad import Device
 from tinygrad.runtime.support.compiler_cpu import ClangJITCompiler
 from tinygrad.runtime.support.elf import elf_loader
+from tinygrad.runtime.ops_cpu import CPUProgram
 
 class TestElfLoader(unittest.TestCase):
   def test_load_clang_jit_strtab(self):
@@ -24,6 +26,15 @@ class TestElfLoader(unittest.TestCase):
     '''
     with self.assertRaisesRegex(RuntimeError, 'evil_external_function'):
       ClangJITCompiler().compile(src)
+  def test_clang_jit_compile_batch(self):
+    # same function names in every source, a static helper and a constant from .rodata
+    srcs = [f"static float helper(float x) {{ return x*{i}.5f; }}\nvoid test(float* restrict out, int x) {{ *out = helper(x)+{i}; }}"
+            for i in range(3)]
+    srcs.append("void other(float* restrict out, int x) { *out = x; }")
+    for i,lib in enumerate(ClangJITCompiler().compile_batch(srcs)):
+      prg, out = CPUProgram(Device["CPU"], "test", lib), ctypes.c_float()
+      prg.fxn(ctypes.c_uint64(ctypes.addressof(out)), ctypes.c_int32(4))
+      self.assertEqual(out.value, 4*(i+0.5)+i if i < 3 else 4)
   def test_link(self):
     src = '''
       float powf(float, float); // from libm
@@ -0,0 +1,38 @@
+import unittest, os, subprocess, sys, tempfile, struct
+from tinygrad import Tensor, TinyJit, nn
+from tinygrad.engine.jit import JitError, JIT_ARTIFACT_VERSION
+
+class TestJitSave(unittest.TestCase):
+  def setUp(self):
+    self.path = os.path.join(tempfile.mkdtemp(), "model.jit")
+
+  def test_save_load(self):
+    layer = nn.Linear(16, 4)
+    jf = TinyJit(lambda x: layer(x).relu().realize())
+    for i in range(3): jf(Tensor.full((2, 16), float(i)).contiguous().realize())
+    expected = [jf(Tensor.full((2, 16), float(i)).contiguous().realize()).tolist() for i in range(3)]
+    jf.save(self.path)
+    # the weights are in the data region, not in the pickle
+    with open(self.path, "rb") as f: _, version, meta_size, data_offset = struct.unpack("<8sIQQ", f.read(28))
+    self.assertEqual(version, JIT_ARTIFACT_VERSION)
+    self.assertGreaterEqual(os.path.getsize(self.path) - data_offset, layer.weight.nbytes())
+    # load in a new process, like a cold start
+    code = f"from tinygrad import Tensor, TinyJit; jf = TinyJit.load({self.path!r}); " \
+           "print([jf(Tensor.full((2, 16), float(i)).contiguous().realize()).tolist() for i in range(3)])"
+    out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True, env={**os.environ, "DEBUG": "0"}).stdout
+    self.assertEqual(out.strip(), str(expected))
+
+  def test_bad_version(self):
+    jf = TinyJit(lambda x: (x*2).realize())
+    for _ in range(2): jf(Tensor.ones(4).contiguous().realize())
+    jf.save(self.path)
+    with open(self.path, "r+b") as f:
+      f.seek(8)
+      f.write(struct.pack("<I", JIT_ARTIFACT_VERSION+1))
+    with self.assertRaises(JitError): TinyJit.load(self.path)
+
+  def test_save_uncaptured(self):
+    with self.assertRaises(AssertionError): TinyJit(lambda x: x*2).save(self.path)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from tinygrad import Tensor, TinyJit
+from tinygrad.engine.jit import JitError
+
+def _f(x:Tensor) -> Tensor: return (x*2+1).contiguous()
+
+class TestJitVariants(unittest.TestCase):
+  def test_single_variant_raises(self):
+    jf = TinyJit(_f)
+    for _ in range(3): jf(Tensor.ones(4).contiguous().realize())
+    with self.assertRaises(JitError): jf(Tensor.ones(5).contiguous().realize())
+
+  def test_capture_per_shape(self):
+    jf = TinyJit(_f, max_variants=2)
+    for _ in range(4):
+      for n in (4, 5): self.assertEqual(jf(Tensor.ones(n).contiguous().realize()).tolist(), [3.0]*n)
+    self.assertEqual(len(jf.variants), 2)
+    # each shape warms up once, captures once and then hits
+    self.assertEqual((jf.stats.captures, jf.stats.hits, jf.stats.evictions), (2, 4, 0))
+
+  def test_lru_eviction(self):
+    jf = TinyJit(_f, max_variants=2)
+    def run(n): self.assertEqual(jf(Tensor.full((n,), n).contiguous().realize()).tolist(), [n*2.0+1]*n)
+    for n in (4, 5, 4, 5): run(n)
+    run(4)  # 4 is now the most recently used
+    for _ in range(2): run(6)
+    self.assertEqual(jf.stats.evictions, 1)
+    self.assertEqual(len(jf.variants), 2)
+    # 5 was evicted and needs a warmup again, 4 still hits
+    hits = jf.stats.hits
+    run(4)
+    self.assertEqual(jf.stats.hits, hits+1)
+    run(5)
+    self.assertEqual(jf.stats.hits, hits+1)
+    self.assertEqual(jf.stats.captures, 3)
+
+  def test_evicted_intermediates_freed(self):
+    def f(x:Tensor) -> Tensor: return ((x+1).contiguous()*2).contiguous()
+    jf = TinyJit(f, max_variants=1)
+    for _ in range(2): jf(Tensor.ones(8).contiguous().realize())
+    captured = next(iter(jf.variants.values()))
+    bufs = [b for ei in captured.jit_cache for b in ei.bufs if b is not None]
+    out = captured.ret.uop.buffer
+    self.assertTrue(any(b is not out for b in bufs))
+    for _ in range(2): jf(Tensor.ones(9).contiguous().realize())
+    self.assertEqual(jf.stats.evictions, 1)
+    self.assertTrue(all(not b.is_allocated() for b in bufs if b is not out))
+
+  def test_warmups_bounded(self):
+    jf = TinyJit(_f, max_variants=2)
+    for n in range(4, 12): jf(Tensor.ones(n).contiguous().realize())
+    self.assertEqual(len(jf.variant_cnt), 2)
+    self.assertEqual(jf.stats.captures, 0)
+    # the most recent one shot shapes are still warm
+    jf(Tensor.ones(11).contiguous().realize())
+    self.assertEqual(jf.stats.captures, 1)
+
+  def test_reset(self):
+    jf = TinyJit(_f, max_variants=2)
+    for _ in range(2): jf(Tensor.ones(4).contiguous().realize())
+    jf.reset()
+    self.assertEqual(len(jf.variants), 0)
+    self.assertIsNone(jf.captured)
+
+class TestJitBuckets(unittest.TestCase):
+  def test_buckets_bound_captures(self):
+    jf = TinyJit(lambda x,y: ((x*y).sum(1)+1).contiguous(), buckets=[2, 4, 8])
+    self.assertEqual(jf.max_variants, 3)
+    for _ in range(2):
+      for n in range(1, 9):
+        x, y = Tensor.full((n, 3), 2.0).contiguous().realize(), Tensor.ones(n, 3).contiguous().realize()
+        self.assertEqual(jf(x, y).tolist(), [7.0]*n)
+    self.assertEqual(jf.stats.captures, 3)
+    self.assertEqual(jf.stats.evictions, 0)
+
+  def test_bucket_axis(self):
+    jf = TinyJit(lambda x: (x+1).contiguous(), buckets=[4], bucket_axis=-1)
+    for _ in range(3): self.assertEqual(jf(Tensor.zeros(2, 3).contiguous().realize()).shape, (2, 3))
+    self.assertEqual(jf.stats.captures, 1)
+
+  def test_too_large(self):
+    jf = TinyJit(_f, buckets=[2, 4])
+    with self.assertRaises(JitError): jf(Tensor.ones(5).contiguous().realize())
+
+if __name__ == '__main__':
+  unittest.main()
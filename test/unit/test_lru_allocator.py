@@ -0,0 +1,68 @@
+import unittest
+from tinygrad.device import LRUAllocator, BufferSpec
+from tinygrad.helpers import Context, GlobalCounters
+
+class FakeAllocator(LRUAllocator):
+  def __init__(self):
+    self.allocated: list[int] = []
+    self.freed: list[int] = []
+    super().__init__(None)
+  def _alloc(self, size, options):
+    self.allocated.append(size)
+    return object()
+  def _free(self, opaque, options): self.freed.append(id(opaque))
+
+class TestLRUAllocator(unittest.TestCase):
+  def test_reuse(self):
+    a = FakeAllocator()
+    hits, misses = GlobalCounters.lru_hits, GlobalCounters.lru_misses
+    x = a.alloc(100)
+    a.free(x, 100)
+    self.assertIs(a.alloc(100), x)
+    self.assertIsNot(a.alloc(100), x)
+    self.assertEqual((GlobalCounters.lru_hits-hits, GlobalCounters.lru_misses-misses), (1, 2))
+
+  def test_budget_evicts_least_recent(self):
+    a = FakeAllocator()
+    bufs = [(a.alloc(sz), sz) for sz in (100, 200, 300)]
+    evictions = GlobalCounters.lru_evictions
+    with Context(LRU_BUDGET=550):
+      for opaque, sz in bufs: a.free(opaque, sz)
+    # 100 and 200 were freed first, 100 alone brings the cache under budget
+    self.assertEqual(a.freed, [id(bufs[0][0])])
+    self.assertEqual(a.cached_bytes, 500)
+    self.assertEqual(GlobalCounters.lru_evictions-evictions, 1)
+    # reusing takes the buffer out of the lru order
+    self.assertIs(a.alloc(200), bufs[1][0])
+    with Context(LRU_BUDGET=300):
+      a.free(y:=a.alloc(50), 50)
+    self.assertEqual(a.freed, [id(bufs[0][0]), id(bufs[2][0])])
+    self.assertIs(a.alloc(50), y)
+
+  def test_size_classes(self):
+    with Context(LRU_SIZE_CLASSES=4): a = FakeAllocator()
+    self.assertEqual([a.size_class(s) for s in (1, 7, 64, 65, 100, 1000)], [1, 7, 64, 80, 112, 1024])
+    x = a.alloc(100)
+    self.assertEqual(a.allocated, [112])
+    a.free(x, 100)
+    # 97..112 all share the class
+    self.assertIs(a.alloc(105), x)
+    # external buffers keep their exact size
+    self.assertEqual(a.size_class(100, BufferSpec(external_ptr=1)), 100)
+
+  def test_free_cache(self):
+    a = FakeAllocator()
+    cached = GlobalCounters.lru_cached_bytes
+    for opaque, sz in [(a.alloc(sz), sz) for sz in (10, 20, 20)]: a.free(opaque, sz)
+    self.assertEqual(GlobalCounters.lru_cached_bytes-cached, 50)
+    a.free_cache()
+    self.assertEqual(GlobalCounters.lru_cached_bytes, cached)
+    self.assertEqual((len(a.freed), a.cached_bytes, len(a.lru)), (3, 0, 0))
+
+  def test_nolru(self):
+    a = FakeAllocator()
+    a.free(x:=a.alloc(10, BufferSpec(nolru=True)), 10, BufferSpec(nolru=True))
+    self.assertEqual(a.freed, [id(x)])
+
+if __name__ == '__main__':
+  unittest.main()
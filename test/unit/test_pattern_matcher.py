@@ -1,7 +1,8 @@
-import unittest, itertools
-from tinygrad.dtype import dtypes
+import unittest, itertools, gc, weakref
+from tinygrad.dtype import dtypes, AddrSpace
+from tinygrad.helpers import Context, IMAGE
 from tinygrad.uop.ops import Ops, UOp, GroupOp # noqa: F401
-from tinygrad.uop.ops import PatternMatcher, UPat
+from tinygrad.uop.ops import PatternMatcher, UPat, graph_rewrite, TRACK_MATCH_STATS
 
 class TestPatternMatcher(unittest.TestCase):
   def test_simple_match(self):
@@ -201,6 +202,37 @@ class TestPatternMatcher(unittest.TestCase):
     self.assertIsNotNone(matcher.rewrite(u1))
     self.assertIsNotNone(matcher.rewrite(u2))
 
+  def test_dispatch(self):
+    matcher = PatternMatcher([
+      (UPat(Ops.ADD, dtypes.float, name="x"), lambda x: x),
+      (UPat(Ops.ADD, src=(UPat(Ops.CONST), UPat())), lambda: None),
+      (UPat(Ops.ADD, src=[UPat(Ops.CONST), UPat(Ops.DEFINE_VAR)]), lambda: None),
+      (UPat(GroupOp.ALU, src=UPat(Ops.CONST)), lambda: None),
+    ])
+    c1, v = UOp.const(dtypes.int, 1), UOp.variable("a", 0, 10)
+    self.assertEqual([e[0] for e in matcher.candidates(v+c1)], [matcher.patterns[2][0]])
+    self.assertEqual([e[0] for e in matcher.candidates(c1+v)], [p for p,_ in matcher.patterns[1:3]])
+    self.assertEqual(len(matcher.candidates(UOp.const(dtypes.float, 1.0)+1.0)), 3)
+    self.assertEqual(matcher.candidates(v*c1), [])
+
+  def test_dispatch_ptr_key(self):
+    matcher = PatternMatcher([(UPat(Ops.DEFINE_GLOBAL, dtypes.float, name="x"), lambda x: x), (UPat(Ops.DEFINE_GLOBAL), lambda: None)])
+    for i in range(10): matcher.rewrite(UOp(Ops.DEFINE_GLOBAL, dtypes.float.ptr(i+1), arg=i))
+    matcher.rewrite(UOp(Ops.DEFINE_GLOBAL, dtypes.float.ptr(4, AddrSpace.LOCAL), arg=0))
+    self.assertEqual(len(matcher.dispatch), 1)
+    self.assertEqual(len(matcher.candidates(UOp(Ops.DEFINE_GLOBAL, dtypes.float.ptr(100), arg=0))), 1)
+    # a pattern on a pointer dtype keys on the full dtype
+    ptr = dtypes.float.ptr(16)
+    matcher = PatternMatcher([(UPat(Ops.DEFINE_GLOBAL, ptr, name="x"), lambda x: x)])
+    self.assertEqual(len(matcher.candidates(UOp(Ops.DEFINE_GLOBAL, ptr, arg=0))), 1)
+    self.assertEqual(len(matcher.candidates(UOp(Ops.DEFINE_GLOBAL, dtypes.float.ptr(32), arg=0))), 0)
+
+  def test_dispatch_same(self):
+    from tinygrad.uop.symbolic import symbolic
+    a, b = UOp.variable("a", 0, 10), UOp.variable("b", 0, 10)
+    for e in [(a+2)*3-a*3, (a*4+b*4)//4, (a+b*2+1)%2, ((a+0)*1).maximum(a), (a<5).where(a, b)+0]:
+      self.assertIs(graph_rewrite(e, PatternMatcher(symbolic.patterns, dispatch=False)), graph_rewrite(e, symbolic))
+
   def _assert_eq_upat(self, a:UPat, b:UPat):
     assert (sorted(map(str,a.op)) if a.op else [] == (sorted(map(str,b.op)) if b.op else []))
     assert (sorted(a.dtype) if a.dtype else [] == (sorted(b.dtype) if b.dtype else []))
@@ -211,5 +243,67 @@ class TestPatternMatcher(unittest.TestCase):
       return u.src[0]
     for a,b in zip(simple_src(a), simple_src(b)): self._assert_eq_upat(a, b)
 
+fold_calls = [0]
+def fold(x, y):
+  fold_calls[0] += 1
+  return UOp.const(x.dtype, x.arg+y.arg)
+
+@unittest.skipIf(TRACK_MATCH_STATS, "the memo is off when tracking matches")
+class TestRewriteMemo(unittest.TestCase):
+  def setUp(self):
+    fold_calls[0] = 0
+    self.pm = PatternMatcher([(UPat.cvar("x")+UPat.cvar("y"), fold)]).memoize()
+  def expr(self): return (UOp.const(dtypes.int, 1)+2)*UOp.variable("a", 0, 10) + (UOp.const(dtypes.int, 3)+4)
+
+  def test_memo(self):
+    with Context(REWRITE_MEMO=1):
+      ret = graph_rewrite(e:=self.expr(), self.pm)
+      self.assertEqual(fold_calls[0], 2)
+      self.assertIs(graph_rewrite(e, self.pm), ret)
+      # a new graph that shares the subexpression only rewrites the rest
+      graph_rewrite(e*(UOp.const(dtypes.int, 5)+6), self.pm)
+    self.assertEqual(fold_calls[0], 3)
+
+  def test_memo_off(self):
+    for memo,ctx in [(0, None), (1, {})]:
+      with Context(REWRITE_MEMO=memo):
+        graph_rewrite(e:=self.expr(), self.pm, ctx=ctx)
+        graph_rewrite(e, self.pm, ctx=ctx)
+    self.assertEqual(fold_calls[0], 8)
+    self.assertNotIn("_rewrite_memo", e.__dict__)
+
+  def test_memo_deps(self):
+    pm = PatternMatcher([(UPat.cvar("x")+UPat.cvar("y"), fold)]).memoize(IMAGE)
+    with Context(REWRITE_MEMO=1):
+      for image in [0, 1, 0]:
+        with Context(IMAGE=image): graph_rewrite(e:=self.expr(), pm)
+    self.assertEqual(fold_calls[0], 4)
+    self.assertIs((pm+self.pm).memo_deps[0], IMAGE)
+    self.assertIsNone((pm+PatternMatcher([])).memo_deps)
+    del e
+
+  def test_memo_deps_found(self):
+    # the ContextVars the rewrites read are part of the key, also through the functions they call
+    from tinygrad.uop.symbolic import sym
+    self.assertLessEqual({"IMAGE", "CORRECT_DIVMOD_FOLDING"}, {v.key for v in sym.memo_deps})
+    self.assertEqual(self.pm.memo_deps, ())
+    pm = PatternMatcher([(UPat.cvar("x")+UPat.cvar("y"), lambda x,y: fold(x, y) if IMAGE else None)]).memoize()
+    self.assertEqual([v.key for v in pm.memo_deps], ["IMAGE"])
+
+  def test_memo_factory_same_matcher(self):
+    from tinygrad.uop.decompositions import get_late_rewrite_patterns
+    from tinygrad.uop.symbolic import symbolic_simple
+    pm = symbolic_simple+get_late_rewrite_patterns((Ops.ADD, Ops.MUL), False)
+    self.assertIsNotNone(pm.memo_deps)
+    self.assertIs(symbolic_simple+get_late_rewrite_patterns((Ops.ADD, Ops.MUL), False), pm)
+
+  def test_memo_collected(self):
+    with Context(REWRITE_MEMO=1): ret = graph_rewrite(e:=self.expr(), self.pm)
+    self.assertIn("_rewrite_memo", e.__dict__)
+    ref = weakref.ref(e)
+    del e, ret
+    gc.collect()
+    self.assertIsNone(ref())
+
 if __name__ == '__main__':
   unittest.main(verbosity=2)
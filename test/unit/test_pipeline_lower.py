@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import patch
+from tinygrad import Tensor, Context
+from tinygrad.engine.realize import run_schedule, ExecItem
+
+class TestPipelineLower(unittest.TestCase):
+  def _sched(self, n=6):
+    a = Tensor([1.,2,3,4]).contiguous().realize()
+    outs = [(a*(i+0.5)).contiguous() for i in range(n)]
+    return outs, Tensor.schedule(*outs)
+
+  def test_pipelined_matches(self):
+    outs, sched = self._sched()
+    with Context(PIPELINE_LOWER=2, PIPELINE_LOWER_MIN=1): run_schedule(sched)
+    self.assertEqual(len(sched), 0)
+    for i,o in enumerate(outs): self.assertEqual(o.tolist(), [x*(i+0.5) for x in [1.,2,3,4]])
+
+  def test_pipelined_order(self):
+    _, sched = self._sched()
+    expected, ran = list(sched), []
+    orig_run = ExecItem.run
+    def run(self, *args, **kwargs):
+      ran.append(self)
+      return orig_run(self, *args, **kwargs)
+    with patch.object(ExecItem, "run", run), Context(PIPELINE_LOWER=1, PIPELINE_LOWER_MIN=1): run_schedule(sched)
+    self.assertEqual([id(x) for x in ran], [id(x) for x in expected])
+
+  def test_pipelined_lower_error(self):
+    _, sched = self._sched()
+    orig_lower, calls = ExecItem.lower, 0
+    def lower(self):
+      nonlocal calls
+      if (calls:=calls+1) == 3: raise RuntimeError("lower failed")
+      return orig_lower(self)
+    with patch.object(ExecItem, "lower", lower), Context(PIPELINE_LOWER=4, PIPELINE_LOWER_MIN=1):
+      with self.assertRaises(RuntimeError): run_schedule(sched)
+    # the items before the failure ran, the rest are still in the schedule
+    self.assertEqual(len(sched), 4)
+
+  def test_small_schedule_not_pipelined(self):
+    outs, sched = self._sched()
+    with patch("tinygrad.engine.realize._precompile_pool", side_effect=RuntimeError("pool used")), Context(PIPELINE_LOWER=2, PIPELINE_LOWER_MIN=7):
+      run_schedule(sched)
+    self.assertEqual(outs[-1].tolist(), [x*5.5 for x in [1.,2,3,4]])
+
+if __name__ == '__main__':
+  unittest.main()
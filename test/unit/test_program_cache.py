@@ -0,0 +1,81 @@
+import unittest, random
+from dataclasses import replace
+from unittest.mock import patch
+from tinygrad import Tensor, Device, Context, GlobalCounters
+from tinygrad.engine.realize import method_cache, CompiledRunner, _program_cache_key
+from tinygrad.codegen.opt.postrange import bufs_from_ast
+from tinygrad.codegen import get_program
+
+class TestProgramCache(unittest.TestCase):
+  def setUp(self):
+    self.a = Tensor([1.,2,3,4]).contiguous().realize()
+    # the cache is on disk, use a new kernel every time
+    self.c = float(random.randint(1, 1<<20))
+
+  @Context(PROGRAM_CACHE=1)
+  def test_warm_start_skips_codegen(self):
+    # cold: codegen runs and the ProgramSpec is stored
+    misses = GlobalCounters.program_cache_misses
+    with patch("tinygrad.engine.realize.get_program", wraps=get_program) as gp:
+      self.assertEqual((self.a*self.c+7.5).tolist(), [x*self.c+7.5 for x in [1.,2,3,4]])
+    self.assertEqual(gp.call_count, 1)
+    self.assertEqual(GlobalCounters.program_cache_misses, misses+1)
+
+    # warm (a new process has an empty method_cache): no rewrite runs at all
+    method_cache.clear()
+    hits = GlobalCounters.program_cache_hits
+    with patch("tinygrad.engine.realize.get_program", side_effect=RuntimeError("get_program called")), \
+         patch("tinygrad.codegen.full_rewrite_to_sink", side_effect=RuntimeError("rewrite called")):
+      self.assertEqual((self.a*self.c+7.5).tolist(), [x*self.c+7.5 for x in [1.,2,3,4]])
+    self.assertEqual(GlobalCounters.program_cache_hits, hits+1)
+
+  def test_context_in_key(self):
+    with Context(PROGRAM_CACHE=1, NOOPT=0): (self.a*self.c).realize()
+    method_cache.clear()
+    misses = GlobalCounters.program_cache_misses
+    with Context(PROGRAM_CACHE=1, NOOPT=1): (self.a*self.c).realize()
+    self.assertEqual(GlobalCounters.program_cache_misses, misses+1)
+
+  def test_codegen_context_in_key(self):
+    ast, ren = (self.a*self.c).schedule()[-1].ast, Device[Device.DEFAULT].renderer
+    with Context(PROGRAM_CACHE=1): key = _program_cache_key(ast, ren)
+    for ctx in [{"IMAGE": 1}, {"TC": 0}, {"ALLOW_TF32": 1}, {"TRANSCENDENTAL": 2}]:
+      with Context(PROGRAM_CACHE=1, **ctx): self.assertNotEqual(_program_cache_key(ast, ren), key, ctx)
+    # the worker lowers with ALLOW_DEVICE_USAGE=0 and DEBUG isn't passed to it, they don't change the program
+    with Context(PROGRAM_CACHE=1, DEBUG=2, ALLOW_DEVICE_USAGE=0): self.assertEqual(_program_cache_key(ast, ren), key)
+
+class TestLocalSizeCache(unittest.TestCase):
+  @unittest.skipUnless(Device[Device.DEFAULT].renderer.has_local, "needs local sizes")
+  def test_sweep_once(self):
+    ast = (Tensor.empty(64, 16)*float(random.randint(1, 1<<20))).contiguous().schedule()[-1].ast
+    p = replace(get_program(ast, Device[Device.DEFAULT].renderer), global_size=[64, 16, 1], local_size=None)
+    bufs = [b.ensure_allocated() for b in bufs_from_ast(ast, Device.DEFAULT)]
+    calls = []
+    def prg(*bufs, global_size, local_size, vals=(), wait=False):
+      calls.append(local_size)
+      return 1e-3
+    with Context(LOCAL_SIZE_CACHE=1): (r0:=CompiledRunner(p, prg=prg))(bufs)
+    self.assertGreater(len(calls), 2)
+    # a new runner of the same program (another process, a sibling device) runs it once with the size from the diskcache
+    calls.clear()
+    with Context(LOCAL_SIZE_CACHE=1): (r1:=CompiledRunner(p, prg=prg))(bufs)
+    self.assertEqual(len(calls), 1)
+    self.assertEqual(r1.p.local_size, r0.p.local_size)
+    self.assertEqual(r1.p.global_size, r0.p.global_size)
+
+  @unittest.skipUnless(Device[Device.DEFAULT].renderer.has_local, "needs local sizes")
+  def test_sweep_without_cache(self):
+    ast = (Tensor.empty(64, 16)*float(random.randint(1, 1<<20))).contiguous().schedule()[-1].ast
+    p = replace(get_program(ast, Device[Device.DEFAULT].renderer), global_size=[64, 16, 1], local_size=None)
+    bufs = [b.ensure_allocated() for b in bufs_from_ast(ast, Device.DEFAULT)]
+    calls = []
+    def prg(*bufs, global_size, local_size, vals=(), wait=False):
+      calls.append(local_size)
+      return 1e-3
+    for _ in range(2):
+      calls.clear()
+      CompiledRunner(p, prg=prg)(bufs)
+      self.assertGreater(len(calls), 2)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,8 +1,9 @@
 import unittest
 import functools
+from unittest.mock import patch
 from tinygrad import Tensor, Variable, UOp, Context
-from tinygrad.uop.ops import KernelInfo
-from tinygrad.engine.schedule import schedule_cache
+from tinygrad.uop.ops import KernelInfo, graph_rewrite
+from tinygrad.engine.schedule import schedule_cache, rewrite_leaves, pm_pre_sched_cache, pm_post_sched_cache
 
 def custom_set0_kernel(A:UOp, num:int) -> UOp:
   return A[0].set(num).sink(arg=KernelInfo(f"custom_set0_{num}"))
@@ -58,6 +59,28 @@ class TestScheduleCache(unittest.TestCase):
     self.assertEqual(b.item(), 10)
     self.assertEqual(len(schedule_cache), cache_size_after_first)
 
+  @Context(SCHEDULE_DISKCACHE=1)
+  def test_disk_cache(self):
+    x = Tensor.ones(10).contiguous().realize()
+    self.assertEqual(((x*3).contiguous().sum() + 2).item(), 32.0)
+    # a new process has an empty schedule_cache, it's loaded from disk without scheduling
+    schedule_cache.clear()
+    with patch("tinygrad.engine.schedule.get_rangeify_map", side_effect=RuntimeError("scheduled")):
+      self.assertEqual(((x*3).contiguous().sum() + 2).item(), 32.0)
+    self.assertEqual(len(schedule_cache), 1)
+
+  def test_rewrite_leaves(self):
+    x = Tensor.ones(10).contiguous().realize()
+    sink = UOp.sink(((x + Tensor(Variable('v', 1, 100).bind(5))).sum() + x.max()).uop, Tensor.full((4,), 3.0).uop)
+    ctx, graph_ctx = ({}, {}), ({}, {})
+    normalized = rewrite_leaves(sink, pm_pre_sched_cache, ctx, {})
+    self.assertIs(normalized[sink], graph_rewrite(sink, pm_pre_sched_cache, ctx=graph_ctx))
+    self.assertEqual(ctx, graph_ctx)
+    # the unrewrite is the inverse, with or without the known UOps
+    reverse = {v:k for k,v in ctx[0].items()}
+    self.assertIs(rewrite_leaves(normalized[sink], pm_post_sched_cache, reverse, {})[normalized[sink]], sink)
+    self.assertIs(rewrite_leaves(normalized[sink], pm_post_sched_cache, reverse, {v:k for k,v in normalized.items()})[normalized[sink]], sink)
+
   def test_simple(self):
     a = Tensor.ones(10).contiguous()
     b = Tensor.ones(10).contiguous()
@@ -1,5 +1,6 @@
-import unittest
+import unittest, weakref
 from tinygrad import Tensor
+from tinygrad.tensor import lazy_tensors
 from tinygrad.uop.ops import UPat, Ops, UOp
 
 # NOTE: unlike before base for a realized tensor is always a BUFFER
@@ -55,5 +56,28 @@ class TestTensorUopRepresentation(unittest.TestCase):
     is_pattern(c, UPat(Ops.ADD))
     for s in c.uop.src: is_pattern_uop(s.base, realized_pattern)
 
+class TestLazyTensors(unittest.TestCase):
+  def test_realized_settles(self):
+    a = Tensor([1.,2,3]).realize()
+    b = a.reshape(3, 1)
+    c = a+1
+    self.assertIn(weakref.ref(c), lazy_tensors)
+    (a*2).realize()
+    self.assertNotIn(weakref.ref(a), lazy_tensors)
+    self.assertNotIn(weakref.ref(b), lazy_tensors)
+    self.assertIn(weakref.ref(c), lazy_tensors)
+    c.realize()
+    is_pattern_uop(c.uop.base, realized_pattern)
+    self.assertEqual(c.tolist(), [2., 3., 4.])
+
+  def test_assign_settled(self):
+    a = Tensor([1.,2,3]).realize()
+    (a*2).realize()
+    self.assertNotIn(weakref.ref(a), lazy_tensors)
+    a.assign(a+1)
+    self.assertIn(weakref.ref(a), lazy_tensors)
+    self.assertEqual(a.tolist(), [2., 3., 4.])
+    is_pattern_uop(a.uop.base, realized_pattern)
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,15 @@
+import argparse, time
+from tinygrad.helpers import CACHEDB, CACHE_MAX_BYTES, diskcache_stats, diskcache_size, diskcache_prune
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=f"inspect or trim the disk cache at {CACHEDB}")
+  parser.add_argument("cmd", choices=["stats", "prune"])
+  parser.add_argument("--max-bytes", type=int, default=CACHE_MAX_BYTES.value, help="prune down to this size, defaults to CACHE_MAX_BYTES")
+  args = parser.parse_args()
+  if args.cmd == "stats":
+    stats = diskcache_stats()
+    for t,(cnt, sz, acc) in sorted(stats.items(), key=lambda x: -x[1][1]):
+      oldest = f"oldest access {time.strftime('%Y-%m-%d %H:%M', time.localtime(acc/1e9))}" if acc else "stale"
+      print(f"{t:40s} {cnt:8d} entries {sz/1e6:10.2f} MB  {oldest}")
+    print(f"{CACHEDB}: {diskcache_size()/1e6:.2f} MB used, {sum(x[0] for x in stats.values())} entries")
+  else: print(f"pruned {CACHEDB}, freed {diskcache_prune(args.max_bytes)/1e6:.2f} MB")
@@ -99,7 +99,7 @@ expander = PatternMatcher([
   (UPat(Ops.CONTRACT, name="con"), do_contract),
   # empty UNROLL is NOOP
   (UPat(Ops.UNROLL, src=(UPat.var('x'),), arg=()), lambda x: x),
-])
+]).memoize()
 
 # ****
 
@@ -142,9 +142,9 @@ pm_pre_expander = PatternMatcher([
   # fix REDUCEs with UNROLLs
   (UPat(Ops.REDUCE, name="x"), fix_reduce_unroll),
   (UPat(Ops.STORE, name="x"), fix_store_unroll),
-])
+]).memoize()
 
 pm_group_for_reduce = PatternMatcher([
   # fix group for reduce
   (UPat(Ops.REDUCE, name="x"), fix_group_for_reduce),
-])
+]).memoize()
@@ -0,0 +1,140 @@
+# a cost model ranks the candidates of a BEAM step before they are compiled, with BEAM_COST_TOPK only the best ranked get compiled and timed
+import math, json, functools, importlib
+from tinygrad.uop.ops import UOp, Ops, AxisType, GroupOp
+from tinygrad.helpers import prod, diskcache_put, diskcache_items, BEAM_COST_MODEL
+from tinygrad.codegen.opt.postrange import Scheduler
+
+# bump this when sched_feats changes, the timings logged with other features are skipped by the trainer
+FEATURE_VERSION = 1
+feature_axis_types = [AxisType.GLOBAL, AxisType.THREAD, AxisType.LOCAL, AxisType.WARP, AxisType.LOOP, AxisType.GROUP_REDUCE, AxisType.REDUCE,
+                      AxisType.UPCAST, AxisType.UNROLL]
+
+def _kernel_feats(ast:UOp) -> tuple[float, float, float]:
+  # the estimates of the kernel from the ast: log2 of the ops, of the bytes of the buffers and of the number of loads and stores
+  glbls = [x for x in ast.backward_slice if x.op is Ops.DEFINE_GLOBAL]
+  full = prod(int(r.vmax)+1 for r in ast.backward_slice if r.op is Ops.RANGE)
+  ops = full * max(len([x for x in ast.toposort() if x.op in GroupOp.ALU]), 1)
+  mem = sum(x.ptrdtype.size * x.dtype.itemsize for x in glbls)
+  return math.log2(ops), math.log2(max(mem, 1)), math.log2(len([x for x in ast.toposort() if x.op is Ops.INDEX])+1)
+
+def sched_feats(s:Scheduler) -> list[float]:
+  """
+  Features of a candidate that don't need it lowered: the log2 size and number of the axes of each type, the upcast and local sizes, if it uses
+  tensor cores and the kernel estimates (ops, memory, loads) times the upcast and local sizes, the kernel alone is the same for all candidates.
+  """
+  shape = [int(x.vmax) if isinstance(x, UOp) else x for x in s.full_shape]
+  ret: list[float] = []
+  for at in feature_axis_types:
+    axes = s.axes_of(at)
+    ret += [math.log2(prod(shape[a] for a in axes)), len(axes)]
+  up = math.log2(prod(shape[a] for a in s.axes_of(AxisType.UPCAST, AxisType.UNROLL)))
+  lcl = math.log2(prod(shape[a] for a in s.axes_of(AxisType.WARP, AxisType.LOCAL, AxisType.GROUP_REDUCE)))
+  ops, mem, lds = _kernel_feats(s.ast)
+  return ret + [up*up, lcl*lcl, up*lcl, float(hasattr(s, "tensor_core")), len(s.applied_opts), up*(ops-mem), lcl*(ops-mem), up*lds, lcl*lds]
+
+class CostModel:
+  """Predicts a score per candidate that orders them like their runtime, a lower score is faster."""
+  def predict(self, feats:list[list[float]]) -> list[float]: raise NotImplementedError("a CostModel has to implement predict")
+  def rank(self, cands:list[Scheduler]) -> list[int]:
+    """The indexes of the candidates, best first."""
+    preds = self.predict([sched_feats(c) for c in cands])
+    return sorted(range(len(cands)), key=lambda i: preds[i])
+
+class LinearCostModel(CostModel):
+  """Ridge regression of log2 of the runtime on the features, fit on the difference to the other candidates of the same kernel."""
+  def __init__(self, weights:list[float]): self.weights = weights
+  def predict(self, feats:list[list[float]]) -> list[float]: return [sum(w*x for w,x in zip(self.weights, f)) for f in feats]
+
+  def save(self, fn:str):
+    with open(fn, "w") as f: json.dump({"version": FEATURE_VERSION, "weights": self.weights}, f)
+  @staticmethod
+  def load(fn:str) -> "LinearCostModel":
+    with open(fn) as f: data = json.load(f)
+    assert data["version"] == FEATURE_VERSION, f"cost model has features version {data['version']}, this is {FEATURE_VERSION}"
+    return LinearCostModel(data["weights"])
+
+  @staticmethod
+  def fit(groups:list[list[tuple[list[float], float]]], l2:float=1e-2) -> "LinearCostModel":
+    """Fit on (features, runtime) of the candidates, one group per kernel. Only the order within a group has to be right, each is centered."""
+    xs, ys = [], []
+    for g in groups:
+      if len(g) < 2: continue
+      mx, my = [sum(col)/len(g) for col in zip(*[f for f,_ in g])], sum(math.log2(tm) for _,tm in g)/len(g)
+      xs += [[x-m for x,m in zip(f, mx)] for f,_ in g]
+      ys += [math.log2(tm)-my for _,tm in g]
+    if not xs: return LinearCostModel([])
+    # scaled features make the regularization the same for all, the weights are scaled back after
+    n = len(xs[0])
+    scale = [math.sqrt(sum(x[j]**2 for x in xs)/len(xs)) or 1.0 for j in range(n)]
+    xs = [[v/sc for v,sc in zip(x, scale)] for x in xs]
+    a = [[sum(x[i]*x[j] for x in xs) + (l2*len(xs) if i == j else 0.0) for j in range(n)] + [sum(x[i]*y for x,y in zip(xs, ys))] for i in range(n)]
+    return LinearCostModel([w/sc for w,sc in zip(_solve(a), scale)])
+
+def _solve(a:list[list[float]]) -> list[float]:
+  # gaussian elimination with partial pivoting of the augmented matrix a
+  n = len(a)
+  for c in range(n):
+    p = max(range(c, n), key=lambda r: abs(a[r][c]))
+    a[c], a[p] = a[p], a[c]
+    for r in range(c+1, n):
+      f = a[r][c] / a[c][c]
+      a[r] = [x-f*y for x,y in zip(a[r], a[c])]
+  w = [0.0]*n
+  for r in range(n-1, -1, -1): w[r] = (a[r][n] - sum(a[r][k]*w[k] for k in range(r+1, n))) / a[r][r]
+  return w
+
+@functools.cache
+def load_cost_model(spec:str) -> CostModel|None:
+  """A json file written by LinearCostModel.save, or module:name of a CostModel class or function returning one. Nothing for an empty spec."""
+  if not spec: return None
+  if spec.endswith(".json"): return LinearCostModel.load(spec)
+  mod, name = spec.split(":")
+  return getattr(importlib.import_module(mod), name)()
+
+def get_cost_model() -> CostModel|None: return load_cost_model(BEAM_COST_MODEL.value)
+
+# **************** training ****************
+
+def log_timings(s:Scheduler, timed:list[tuple[Scheduler, float]]):
+  """Keep the features and runtime of the timed candidates of a kernel in the diskcache for train_cost_model."""
+  for c,tm in timed:
+    if math.isfinite(tm) and tm > 0:
+      key = {"ast": s.ast.key, "device": s.ren.device, "suffix": s.ren.suffix, "opts": repr(c.applied_opts)}
+      diskcache_put("beam_timing", key, (FEATURE_VERSION, sched_feats(c), tm))
+
+def timing_groups(device:str|None=None) -> list[list[tuple[list[float], float]]]:
+  """The logged (features, runtime) of the candidates, grouped by kernel."""
+  groups: dict[tuple, list[tuple[list[float], float]]] = {}
+  for k,(ver,feats,tm) in diskcache_items("beam_timing"):
+    if ver != FEATURE_VERSION or (device is not None and k["device"] != device): continue
+    groups.setdefault((k["ast"], k["device"], k["suffix"]), []).append((feats, tm))
+  return list(groups.values())
+
+def train_cost_model(device:str|None=None, l2:float=1e-2) -> LinearCostModel: return LinearCostModel.fit(timing_groups(device), l2)
+
+def evaluate(model:CostModel, groups:list[list[tuple[list[float], float]]], topk:int) -> tuple[float, float]:
+  """
+  How well the model ranks the candidates of each kernel: the fraction of kernels whose fastest candidate is in the top k of the model and the mean
+  slowdown of the fastest candidate in the top k to the fastest of all.
+  """
+  hits, slowdown, n = 0, 0.0, 0
+  for g in groups:
+    if len(g) <= topk: continue
+    preds, best = model.predict([f for f,_ in g]), min(tm for _,tm in g)
+    top = sorted(range(len(g)), key=lambda i: preds[i])[:topk]
+    hits, slowdown, n = hits + any(g[i][1] == best for i in top), slowdown + min(g[i][1] for i in top)/best, n+1
+  return (hits/n, slowdown/n) if n else (math.nan, math.nan)
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description="train the BEAM cost model on the timings logged with BEAM_COST_LOG=1")
+  parser.add_argument("cmd", choices=["train", "eval"])
+  parser.add_argument("file", help="the model json to write (train) or read (eval)")
+  parser.add_argument("--device", default=None, help="only use the timings of this device")
+  parser.add_argument("--l2", type=float, default=1e-2)
+  parser.add_argument("--topk", type=int, default=8)
+  args = parser.parse_args()
+  if args.cmd == "train": train_cost_model(args.device, args.l2).save(args.file)
+  groups = timing_groups(args.device)
+  hit, slowdown = evaluate(LinearCostModel.load(args.file), groups, args.topk)
+  print(f"{len(groups)} kernels: fastest in the top {args.topk} for {hit*100:.1f}%, top {args.topk} is {slowdown:.3f}x slower than the fastest")
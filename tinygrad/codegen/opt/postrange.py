@@ -6,7 +6,7 @@ from tinygrad.uop.ops import axis_letters, axis_colors, axis_to_pos
 from tinygrad.device import Buffer
 from tinygrad.dtype import dtypes, ImageDType
 from tinygrad.helpers import colored, BEAM, getenv, DEBUG, to_function_name, NOOPT, argsort, round_up, prod, merge_dicts, get_single_element, flatten
-from tinygrad.helpers import IMAGE, ALLOW_TF32, count, Context
+from tinygrad.helpers import IMAGE, ALLOW_TF32, BEAM_DB, GlobalCounters, CACHELEVEL, count, Context, diskcache_get
 from tinygrad.codegen.opt import Opt, OptOps, KernelOptError, check
 from tinygrad.codegen.simplify import pm_flatten_range
 from tinygrad.renderer import Renderer
@@ -333,6 +333,20 @@ def bufs_from_ast(ast:UOp, dname:str) -> list[Buffer]:
   glbls = sorted([x for x in ast.backward_slice if x.op is Ops.DEFINE_GLOBAL], key=lambda x: x.arg)
   return [Buffer(dname, x.ptrdtype.size, x.dtype.base if not isinstance(x.dtype, ImageDType) else x.dtype) for x in glbls]
 
+def beam_db_key(k:Scheduler) -> dict: return {"ast": k.ast.key, "device": k.ren.device, "suffix": k.ren.suffix}
+def beam_db_apply(k:Scheduler) -> Scheduler|None:
+  # the tuning DB has the fastest opts any BEAM run (or import) found for the AST, on top of the opts it already has
+  # opts imported from another arch of the same backend may not apply here, that is a miss
+  if CACHELEVEL >= 1 and (val:=diskcache_get("beam_db", beam_db_key(k))) is not None:
+    ret = k.copy()
+    try:
+      for opt in val[0][len(k.applied_opts):]: ret.apply_opt(opt)
+      GlobalCounters.beam_db_hits += 1
+      return ret
+    except KernelOptError: pass
+  GlobalCounters.beam_db_misses += 1
+  return None
+
 def apply_opts(ast:UOp, ren:Renderer) -> UOp:
   if ast.tag is not None: return ast
   k = Scheduler(ast, ren)
@@ -345,6 +359,7 @@ def apply_opts(ast:UOp, ren:Renderer) -> UOp:
     # beam search may open devices
     with Context(ALLOW_DEVICE_USAGE=1):
       k = beam_search(k, rawbufs, BEAM.value, bool(getenv("BEAM_ESTIMATE", 1)))
+  elif BEAM_DB and (kdb:=beam_db_apply(k)) is not None: k = kdb
   elif not NOOPT and (ast.arg is None or ast.arg.applied_opts == ()):
     from tinygrad.codegen.opt.heuristic import hand_coded_optimizations
     # NOTE: hand_coded_optimizations doesn't support multiblock opts yet
@@ -1,15 +1,17 @@
-import functools, math, time, multiprocessing, traceback, signal, atexit
+import functools, math, time, multiprocessing, traceback, signal, atexit, json
+from typing import Generator, cast
 from dataclasses import replace
-from tinygrad.uop.ops import sym_infer, AxisType, pyrender
+from tinygrad.uop.ops import UOp, sym_infer, AxisType, Ops, pyrender
 from tinygrad.device import Device, Buffer, Compiler
 from tinygrad.helpers import prod, flatten, DEBUG, CACHELEVEL, diskcache_get, diskcache_put, getenv, Context, colored, time_to_str, unwrap
-from tinygrad.helpers import IGNORE_BEAM_CACHE
+from tinygrad.helpers import IGNORE_BEAM_CACHE, COMPILE_BATCH, GlobalCounters, diskcache_items, dedup, BEAM_COST_TOPK, BEAM_COST_LOG
 from tinygrad.codegen.opt import Opt, OptOps, KernelOptError
 from tinygrad.tensor import Tensor
-from tinygrad.engine.realize import CompiledRunner
+from tinygrad.engine.realize import CompiledRunner, ExecItem, render_only
 from tinygrad.codegen import get_program
 from tinygrad.renderer import ProgramSpec
-from tinygrad.codegen.opt.postrange import Scheduler
+from tinygrad.codegen.opt.postrange import Scheduler, beam_db_key, bufs_from_ast
+from tinygrad.codegen.opt.costmodel import get_cost_model, log_timings
 
 actions = [Opt(op=OptOps.UPCAST, axis=axis, arg=amt) for amt in [0,2,3,4,5,7] for axis in range(8)]
 actions += [Opt(op=OptOps.UNROLL, axis=axis, arg=amt) for amt in [0,4,7] for axis in range(5)]
@@ -51,7 +53,7 @@ def _time_program(p:ProgramSpec, lib:bytes, var_vals:dict[str, int], rawbufs:lis
       else:
         with Context(DEBUG=0, BEAM=0, CAPTURING=0, TRACK_MATCH_STATS=0): Tensor.ones(1024,1024).contiguous().realize(do_update_stats=False)
     tms.append(unwrap(car(input_bufs, var_vals, wait=True))*factor)
-    if early_stop is not None and early_stop < min(tms): break
+    if (early_stop is not None and early_stop < min(tms)) or (beam_deadline is not None and time.perf_counter() > beam_deadline): break
   return tms
 
 class TimeoutException(Exception): pass
@@ -59,20 +61,20 @@ def timeout_handler(signum, frame):
   if DEBUG >= 2: print("*** BEAM COMPILE TIMEOUT")
   raise TimeoutException()
 
-def _try_compile(x:tuple[int,Scheduler], compiler:Compiler) -> tuple[int, tuple[ProgramSpec, bytes, float]|None]:
+def _try_compile(x:tuple[int,Scheduler], compiler:Compiler, batch=False) -> tuple[int, tuple[ProgramSpec, bytes|None, float]|None]:
   if hasattr(signal, "alarm"):
     signal.signal(getattr(signal, 'SIGALRM'), timeout_handler)
     # set timeout
     signal.alarm(getenv("BEAM_TIMEOUT_SEC", 10))
   ret = None
   try:
-    p = get_program(x[1].copy().get_optimized_ast(name_override="test"), x[1].ren)
+    p = get_program(x[1].copy().get_optimized_ast(name_override="test"), render_only(x[1].ren) if batch else x[1].ren)
     assert p.uops is not None, "uop list wasn't generated?"
     if len(p.uops) >= (uops_max:=getenv("BEAM_UOPS_MAX", 3000)) > 0:
       if getenv("BEAM_LOG_SURPASS_MAX"): print(f"too many uops. {len(p.uops)=}, {uops_max=}")
       raise RuntimeError("too many uops")
     st = time.perf_counter()
-    prog = p.lib if p.lib is not None else compiler.compile(p.src)
+    prog = p.lib if p.lib is not None or batch else compiler.compile(p.src)
     et = time.perf_counter() - st
     ret = (p, prog, et)
   except RuntimeError:
@@ -83,6 +85,22 @@ def _try_compile(x:tuple[int,Scheduler], compiler:Compiler) -> tuple[int, tuple[
     if hasattr(signal, "alarm"): signal.alarm(0)
   return x[0], ret
 
+def _compile_batches(results, compiler:Compiler) -> Generator[tuple[int, tuple[ProgramSpec, bytes, float]|None], None, None]:
+  # the rendered candidates are compiled COMPILE_BATCH at a time, if a batch fails its candidates are compiled one by one to drop the broken ones
+  rendered = [(i, ret[0]) for i,ret in results if ret is not None]
+  for b in range(0, len(rendered), COMPILE_BATCH.value):
+    st, part = time.perf_counter(), rendered[b:b+COMPILE_BATCH.value]
+    try: libs: list[bytes|None] = list(compiler.compile_batch([p.src for _,p in part]))
+    except Exception:
+      libs = []
+      for _,p in part:
+        try: libs.append(compiler.compile(p.src))
+        except Exception as e:
+          if getenv("BEAM_STRICT_MODE"): raise e
+          libs.append(None)
+    et = (time.perf_counter() - st) / len(part)
+    for (i,p),lib in zip(part, libs): yield i, None if lib is None else (p, lib, et)
+
 # workers should not open devices and should ignore ctrl c and should not launch VIZ
 def _init_worker():
   Context(ALLOW_DEVICE_USAGE=0, VIZ=0, TRACK_MATCH_STATS=0).__enter__()
@@ -116,7 +134,43 @@ def get_kernel_actions(s:Scheduler, include_0=True, max_up:int|None=None) -> dic
     except KernelOptError: pass
   return acted
 
+def _successive_halving(progs:list[tuple[int, ProgramSpec, bytes]], var_vals:dict[str, int], rawbufs:list[Buffer], amt:int, eta:int,
+                        allow_test_size:bool, clear_l2:bool, early_stop:float) -> list[tuple[int, float]]:
+  """
+  Successive halving: time the candidates once on a global size reduced by eta per rung left, keep the fastest 1/eta (at least amt) and
+  time them again on eta times more of the global size, the last rung times the survivors like without halving. Returns [(index, time)].
+  """
+  rungs = 0
+  while rungs < getenv("BEAM_HALVING_RUNGS", 2) and len(progs) > amt * eta**(rungs+1): rungs += 1
+  for r in range(rungs, -1, -1):
+    timed: list[tuple[float, tuple[int, ProgramSpec, bytes]]] = []
+    for x in progs:
+      if beam_deadline is not None and time.perf_counter() > beam_deadline: break
+      # lower rungs run once without early stop, the reduced global size scales the time back up
+      try: tms = _time_program(x[1], x[2], var_vals, rawbufs, early_stop=early_stop if r == 0 else None, allow_test_size=allow_test_size,
+                               max_global_size=max(65536//eta**r, 1), clear_l2=clear_l2, cnt=3 if r == 0 else 1)
+      except Exception as e:
+        if BEAM_DEBUG: print(f"BEAM failed for program {x[0]}\n{e}")
+        if isinstance(e, RuntimeError): continue
+        raise
+      timed.append((min(tms), x))
+    timed = sorted(timed, key=lambda t: t[0])
+    if BEAM_DEBUG > 1: print(f"BEAM rung {r}: {len(progs):4d} candidates, fastest {time_to_str(timed[0][0], w=12) if timed else '-'}")
+    if r == 0: return [(x[0], tm) for tm,x in timed]
+    progs = [x for _,x in timed[:max(amt, math.ceil(len(timed)/eta))]]
+  return []
+
+def _time_hand_coded(s:Scheduler, rawbufs:list[Buffer], var_vals:dict[str, int], allow_test_size:bool) -> tuple[Scheduler, float]|None:
+  from tinygrad.codegen.opt.heuristic import hand_coded_optimizations
+  try:
+    hc = hand_coded_optimizations(s.copy())
+    p = get_program(hc.copy().get_optimized_ast(name_override="test"), s.ren)
+    return hc, min(_time_program(p, p.lib or Device[s.ren.device].compiler.compile(p.src), var_vals, rawbufs, allow_test_size=allow_test_size))
+  except (KernelOptError, RuntimeError): return None
+
 beam_pool, BEAM_DEBUG = None, getenv("BEAM_DEBUG")
+# perf_counter time at which beam_search stops and keeps the best opts it timed so far, set by beam_schedule
+beam_deadline: float|None = None
 def beam_search(s:Scheduler, rawbufs:list[Buffer], amt:int, allow_test_size=True, disable_cache=IGNORE_BEAM_CACHE.value):
   global beam_pool
   key = {"ast": s.ast.key, "amt": amt, "allow_test_size": allow_test_size, "device": s.ren.device, "suffix": s.ren.suffix}
@@ -145,14 +199,22 @@ def beam_search(s:Scheduler, rawbufs:list[Buffer], amt:int, allow_test_size=True
     var_vals: dict[str, int] = {k.expr:int(k.vmax+k.vmin)//2 for k in s.ast.variables()}
     exiting, st = False, time.perf_counter()
     dev = Device[s.ren.device]
+    halving, cost_model, topk = getenv("BEAM_HALVING", 0), get_cost_model(), BEAM_COST_TOPK.value
     while not exiting:
       candidates: list[Scheduler] = flatten([get_kernel_actions(si, include_0=False).values() for si,_ in beam])
+      # only the candidates the cost model ranks best get compiled and timed
+      if cost_model is not None and topk and len(candidates) > max(topk, amt):
+        candidates = [candidates[i] for i in cost_model.rank(candidates)[:max(topk, amt)]]
       timed: list[tuple[Scheduler, float]] = []
-      _compile_fn = functools.partial(_try_compile, compiler=dev.compiler)
-      least_compute_ops = math.inf
-      for i,proc in (map(_compile_fn, enumerate(candidates)) if beam_pool is None else beam_pool.imap_unordered(_compile_fn, enumerate(candidates))):
-        if proc is None: continue
-        p, lib, compile_et = proc
+      # compilers with a high fixed cost per call (clang) get the rendered candidates in batches
+      batch = COMPILE_BATCH.value > 1 and dev.compiler.supports_batch
+      _compile_fn = functools.partial(_try_compile, compiler=dev.compiler, batch=batch)
+      results = map(_compile_fn, enumerate(candidates)) if beam_pool is None else beam_pool.imap_unordered(_compile_fn, enumerate(candidates))
+      least_compute_ops, compiled = math.inf, []
+      for i,proc in (_compile_batches(results, dev.compiler) if batch else results):
+        if beam_deadline is not None and time.perf_counter() > beam_deadline: break
+        if proc is None or (lib:=proc[1]) is None: continue
+        p, compile_et = proc[0], proc[2]
         if lib in seen_libs: continue
         # filter out kernels that use 1000x more compute than the smallest
         least_compute_ops = min(this_compute_ops:=sym_infer(p.estimates.ops, var_vals), least_compute_ops)
@@ -160,6 +222,9 @@ def beam_search(s:Scheduler, rawbufs:list[Buffer], amt:int, allow_test_size=True
           if getenv("BEAM_LOG_SURPASS_MAX"): print(f"too much compute. {this_compute_ops} when least is {least_compute_ops}")
           continue
         seen_libs.add(lib)
+        if halving > 1:
+          compiled.append((i, p, lib))
+          continue
         try: tms = _time_program(p, lib, var_vals, rawbufs, early_stop=beam[0][1]*3 if len(beam) else 1.0,
                                  allow_test_size=allow_test_size, clear_l2=hasattr(dev, 'invalidate_caches'))
         except Exception as e:
@@ -175,9 +240,18 @@ def beam_search(s:Scheduler, rawbufs:list[Buffer], amt:int, allow_test_size=True
           print(f"\r{time.perf_counter() - st:7.2f}s: {time_to_str(timed[-1][1], w=12)}",
                 f"      {len(timed):4d}/{len(candidates):4d}         {timed[-1][0].colored_shape()}\033[K", end="")
 
+      if halving > 1:
+        timed = [(candidates[i], tm) for i,tm in _successive_halving(compiled, var_vals, rawbufs, amt, halving, allow_test_size,
+                                                                    hasattr(dev, 'invalidate_caches'), beam[0][1]*3 if len(beam) else 1.0)]
+        if DEBUG >= 2 and timed: print(f"\r{time.perf_counter() - st:7.2f}s: {time_to_str(min(x[1] for x in timed), w=12)}",
+                                       f"      {len(timed):4d}/{len(candidates):4d}\033[K", end="")
+
+      if BEAM_COST_LOG: log_timings(s, timed)
+
       # done
       opts = sorted(timed, key=lambda x: x[1])
-      exiting = len(opts) == 0 or (opts[0][1] < min_progress) or (len(beam) > 0 and ((beam[0][1]-opts[0][1]) < min_progress))
+      exiting = len(opts) == 0 or (opts[0][1] < min_progress) or (len(beam) > 0 and ((beam[0][1]-opts[0][1]) < min_progress)) or \
+        (beam_deadline is not None and time.perf_counter() > beam_deadline)
       if not exiting: beam = opts[:amt]
       elif len(opts) > 0 and opts[0][1] < beam[0][1]: beam = opts[:1]
       if DEBUG >= 2:
@@ -187,6 +261,111 @@ def beam_search(s:Scheduler, rawbufs:list[Buffer], amt:int, allow_test_size=True
     if beam_pool is not None: beam_pool.terminate()
     raise e
 
-  if CACHELEVEL >= 1: diskcache_put("beam_search", key, beam[0][0].applied_opts)
+  # a search cut short by the deadline may not have gotten to what the heuristic does, it's the floor
+  if beam_deadline is not None and time.perf_counter() > beam_deadline and (hc:=_time_hand_coded(s, rawbufs, var_vals, allow_test_size)) is not None:
+    if hc[1] < beam[0][1]: beam = [hc]
+
+  if CACHELEVEL >= 1:
+    diskcache_put("beam_search", key, beam[0][0].applied_opts)
+    if beam[0][1] != float("inf"): beam_db_put(beam_db_key(s), beam[0][0].applied_opts, beam[0][1])
   if BEAM_DEBUG: print(f"BEAM_SEARCH: final tm={time_to_str(beam[0][1], w=0)}, applied_opts={beam[0][0].applied_opts}")
   return beam[0][0]
+
+# **************** profile-guided BEAM ****************
+
+def _schedule_kernels(schedule:list[ExecItem]) -> list[tuple[UOp, str]]:
+  return [(ei.ast, ei.bufs[0].device) for ei in schedule if ei.ast.op is Ops.SINK and len(ei.bufs) and ei.bufs[0] is not None]
+
+beam_budget_used = 0.0
+# the (ast key, device) of the kernels beam_schedule has profiled or found in the tuning DB, they are not profiled again
+beam_scheduled: set[tuple[bytes, str]] = set()
+def beam_schedule(schedule:list[ExecItem], budget:float, amt:int, min_share:float=0.01) -> list[tuple[str, float, float]]:
+  """
+  Profile-guided BEAM. The kernels of the schedule run with hand-coded opts on scratch buffers, then beam_search runs on the kernels with the
+  largest share of the runtime, each for a slice of the budget (in seconds) in proportion to its share. The time a kernel doesn't use (cached or
+  done early) goes to the next ones. Kernels under min_share are skipped. The results go to the beam caches and the tuning DB.
+  Kernels already in the tuning DB and the ones an earlier call has seen are skipped without running them.
+  Returns (name, share, search time) of the searched kernels.
+  """
+  global beam_deadline, beam_budget_used
+  if budget <= 0: return []
+  kernels: dict[tuple[UOp, str], int] = {}
+  for ast, device in _schedule_kernels(schedule):
+    if (ast.key, device) not in beam_scheduled: kernels[(ast, device)] = kernels.get((ast, device), 0)+1
+  timed: list[tuple[float, UOp, str, str]] = []
+  for (ast, device), cnt in kernels.items():
+    beam_scheduled.add((ast.key, device))
+    # without the tuning DB entry this is the hand-coded program. it's not put in the method_cache, that gets the searched one
+    hits = GlobalCounters.beam_db_hits
+    with Context(BEAM=0, BEAM_DB=1): p = get_program(ast, Device[device].renderer)
+    if GlobalCounters.beam_db_hits > hits: continue
+    var_vals = {k.expr:int(k.vmax+k.vmin)//2 for k in ast.variables()}
+    ei = ExecItem(ast, cast(list[Buffer|None], _ensure_buffer_alloc(bufs_from_ast(ast, device))), prg=CompiledRunner(replace(p, device=device)))
+    tm = min(unwrap(ei.run(var_vals, wait=True, do_update_stats=False)) for _ in range(getenv("BEAM_PROFILE_CNT", 3)))
+    timed.append((tm*cnt, ast, device, p.function_name))
+  if not timed or (total:=sum(t for t,*_ in timed)) <= 0: return []
+  ret, left, rest = [], budget, 1.0
+  for tm, ast, device, name in sorted(timed, key=lambda x: -x[0]):
+    if (share:=tm/total) < min_share or left <= 0: break
+    st = time.perf_counter()
+    beam_deadline = st + left*share/rest
+    try:
+      with Context(BEAM=amt): get_program(ast, Device[device].renderer)
+    finally: beam_deadline = None
+    et = time.perf_counter() - st
+    left, rest, beam_budget_used = left-et, rest-share, beam_budget_used+et
+    ret.append((name, share, et))
+    if DEBUG >= 1: print(f"BEAM {name} with {share*100:5.1f}% of the runtime in {et:7.2f}s, {max(left, 0):7.2f}s of the budget left")
+  return ret
+
+# **************** tuning DB ****************
+
+def beam_db_put(key:dict, opts:list[Opt], tm:float) -> bool:
+  """Keep the opts in the tuning DB if there is no entry for the key or they are faster. Returns if they were kept."""
+  if (old:=diskcache_get("beam_db", key)) is not None and old[1] <= tm: return False
+  diskcache_put("beam_db", key, (tuple(opts), tm))
+  return True
+
+def export_beam_db(fn:str, device:str|None=None) -> int:
+  """Write the tuning DB (of one device) to a json file that import_beam_db reads on another machine. Returns the number of entries."""
+  entries = [{"ast": k["ast"].hex(), "device": k["device"], "suffix": k["suffix"], "tm": tm,
+              "opts": [[o.op.name, o.axis, list(o.arg) if isinstance(o.arg, tuple) else o.arg] for o in opts]}
+             for k,(opts,tm) in diskcache_items("beam_db") if device is None or k["device"] == device]
+  with open(fn, "w") as f: json.dump({"version": 1, "entries": entries}, f)
+  return len(entries)
+
+def import_beam_db(fn:str) -> tuple[int, int]:
+  """Merge a file written by export_beam_db into the tuning DB, an entry replaces a slower one. Returns the entries added and replaced."""
+  with open(fn) as f: data = json.load(f)
+  assert data["version"] == 1, f"unknown tuning DB version {data['version']}"
+  added = replaced = 0
+  for e in data["entries"]:
+    key = {"ast": bytes.fromhex(e["ast"]), "device": e["device"], "suffix": e["suffix"]}
+    existed = diskcache_get("beam_db", key) is not None
+    opts = [Opt(OptOps[op], axis, tuple(arg) if isinstance(arg, list) else arg) for op,axis,arg in e["opts"]]
+    if beam_db_put(key, opts, e["tm"]):
+      if existed: replaced += 1
+      else: added += 1
+  return added, replaced
+
+def beam_coverage(schedule:list[ExecItem]) -> tuple[int, list[str]]:
+  """
+  Lower the kernels of a schedule with BEAM=0 BEAM_DB=1, without compiling them. Returns how many are in the tuning DB and the names of the rest.
+  """
+  tuned, missing = 0, []
+  for ast, device in dedup(_schedule_kernels(schedule)):
+    hits = GlobalCounters.beam_db_hits
+    with Context(BEAM=0, BEAM_DB=1): p = get_program(ast, render_only(Device[device].renderer))
+    if GlobalCounters.beam_db_hits > hits: tuned += 1
+    else: missing.append(p.function_name)
+  return tuned, missing
+
+if __name__ == "__main__":
+  import argparse
+  parser = argparse.ArgumentParser(description="ship the BEAM tuning DB to machines that run with BEAM=0 BEAM_DB=1")
+  parser.add_argument("cmd", choices=["export", "import"])
+  parser.add_argument("file")
+  parser.add_argument("--device", default=None, help="only export the entries of this device")
+  args = parser.parse_args()
+  if args.cmd == "export": print(f"exported {export_beam_db(args.file, args.device)} entries to {args.file}")
+  else: print("imported {} new entries, replaced {} slower ones".format(*import_beam_db(args.file)))
@@ -1,10 +1,11 @@
 from __future__ import annotations
 from dataclasses import dataclass, replace
-from collections import defaultdict
-from typing import Any, Generic, TypeVar, Iterator, Generator
+from collections import defaultdict, deque, OrderedDict
+from typing import Any, Generic, TypeVar, Iterator, Generator, cast
 import importlib, inspect, functools, pathlib, os, platform, contextlib, sys, re, atexit, pickle, decimal
 from tinygrad.helpers import CI, OSX, LRU, getenv, diskcache_get, diskcache_put, DEBUG, GlobalCounters, flat_mv, PROFILE, temp, colored
 from tinygrad.helpers import Context, CCACHE, ALLOW_DEVICE_USAGE, MAX_BUFFER_SIZE, cpu_events, ProfileEvent, ProfilePointEvent, dedup, ContextVar
+from tinygrad.helpers import LRU_BUDGET, LRU_SIZE_CLASSES, round_up, CCACHE_DIR, filecache_get, filecache_put
 from tinygrad.helpers import unwrap_class_type, suppress_finalizing, select_first_inited, VIZ, CPU_LLVM, CPU_LVP, NV_PTX, CUDA_PTX, NV_NAK
 from tinygrad.dtype import DType, ImageDType, PtrDType, dtypes, _to_np_dtype
 from tinygrad.renderer import Renderer
@@ -178,7 +179,7 @@ class Buffer:
   def as_buffer(self, allow_zero_copy=False, force_zero_copy=False) -> memoryview:
     # zero copy with as_buffer (disabled by default due to use after free)
     if (force_zero_copy or allow_zero_copy) and hasattr(self.allocator, '_as_buffer') and (self.options is None or self.options.image is None):
-      return self.allocator._as_buffer(self._buf)
+      return self.allocator._as_buffer(self._buf)[:self.nbytes]  # the allocation can be rounded up to a size class
     assert not force_zero_copy, "force zero copy was passed, but copy is required"
     return self.copyout(memoryview(bytearray(self.nbytes)))
   def as_typed_buffer(self, shape=None, allow_zero_copy=False, force_zero_copy=False) -> memoryview:
@@ -247,23 +248,53 @@ class LRUAllocator(Allocator, Generic[DeviceType]):
   """
   The LRU Allocator is responsible for caching buffers.
   It ensures that buffers are not freed until it is absolutely necessary, optimizing performance.
+  Freed buffers are kept per (size class, options) and released least recently freed first once the cache is over LRU_BUDGET bytes.
   """
   def __init__(self, dev:DeviceType, **kwargs):
-    self.cache: dict[tuple[int, BufferSpec|None], Any] = defaultdict(list)
+    self.cache: dict[tuple[int, BufferSpec|None], deque[tuple[int, Any]]] = defaultdict(deque)
+    self.lru: OrderedDict[int, tuple[int, BufferSpec|None]] = OrderedDict()  # seq -> key, least recently freed first
+    self.seq, self.cached_bytes = 0, 0
+    # NOTE: fixed at init, alloc and free have to agree on the size that was really allocated
+    self.size_classes = LRU_SIZE_CLASSES.value
     super().__init__(dev, **kwargs)
+  def size_class(self, size:int, options:BufferSpec|None=None) -> int:
+    if self.size_classes <= 0 or (options is not None and (options.image is not None or options.external_ptr is not None)): return size
+    return round_up(size, max(1, (1 << (size.bit_length()-1)) // self.size_classes))
   def alloc(self, size:int, options:BufferSpec|None=None):
-    if len(c := self.cache[(size, options)]): return c.pop()
-    try: return super().alloc(size, options)
+    if len(c := self.cache[key:=(self.size_class(size, options), options)]):
+      seq, opaque = c.pop()
+      del self.lru[seq]
+      self._uncache(key[0])
+      GlobalCounters.lru_hits += 1
+      return opaque
+    GlobalCounters.lru_misses += 1
+    try: return super().alloc(key[0], options)
     except (RuntimeError, MemoryError):
       self.free_cache()
-      return super().alloc(size, options)
+      return super().alloc(key[0], options)
+  def _uncache(self, size:int):
+    self.cached_bytes -= size
+    GlobalCounters.lru_cached_bytes -= size
   def free_cache(self):
     for (sz,options),opaques in self.cache.items():
-      for opaque in opaques: super().free(opaque, sz, options)
+      for _,opaque in opaques: super().free(opaque, sz, options)
+      self._uncache(sz*len(opaques))
       opaques.clear()
+    self.lru.clear()
   def free(self, opaque:Any, size:int, options:BufferSpec|None=None):
-    if LRU and (options is None or not options.nolru): self.cache[(size, options)].append(opaque)
-    else: super().free(opaque, size, options)
+    size = self.size_class(size, options)
+    if not LRU or (options is not None and options.nolru): return super().free(opaque, size, options)
+    self.cache[key:=(size, options)].append((self.seq, opaque))
+    self.lru[self.seq] = key
+    self.seq += 1
+    self.cached_bytes += size
+    GlobalCounters.lru_cached_bytes += size
+    while LRU_BUDGET.value > 0 and self.cached_bytes > LRU_BUDGET.value:
+      _, (sz, opts) = self.lru.popitem(last=False)
+      _, evicted = self.cache[(sz, opts)].popleft()
+      super().free(evicted, sz, opts)
+      self._uncache(sz)
+      GlobalCounters.lru_evictions += 1
 
 # **************** for Compiled Devices ****************
 
@@ -272,12 +303,27 @@ class CompileError(Exception): pass
 class Compiler:
   def __init__(self, cachekey:str|None=None): self.cachekey = cachekey if CCACHE else None
   def compile(self, src:str) -> bytes: return src.encode()   # NOTE: empty compiler is the default
+  def _cache_get(self, src:str) -> bytes|None:
+    if self.cachekey is None: return None
+    return filecache_get(self.cachekey, src) if CCACHE_DIR else diskcache_get(self.cachekey, src)
+  def _cache_put(self, src:str, lib:bytes):
+    if self.cachekey is not None: (filecache_put if CCACHE_DIR else diskcache_put)(self.cachekey, src, lib)
   def compile_cached(self, src:str) -> bytes:
-    if self.cachekey is None or (lib := diskcache_get(self.cachekey, src)) is None:
+    if (lib := self._cache_get(src)) is None:
       assert not getenv("ASSERT_COMPILE"), f"tried to compile with ASSERT_COMPILE set\n{src}"
-      lib = self.compile(src)
-      if self.cachekey is not None: diskcache_put(self.cachekey, src, lib)
+      self._cache_put(src, lib:=self.compile(src))
     return lib
+  # set on compilers with a high fixed cost per call that override compile_batch
+  supports_batch: bool = False
+  def compile_batch(self, srcs:list[str]) -> list[bytes]: return [self.compile(src) for src in srcs]
+  def compile_cached_batch(self, srcs:list[str]) -> list[bytes]:
+    libs: list[bytes|None] = [self._cache_get(src) for src in srcs]
+    if (todo:=[i for i,lib in enumerate(libs) if lib is None]):
+      assert not getenv("ASSERT_COMPILE"), f"tried to compile with ASSERT_COMPILE set\n{srcs[todo[0]]}"
+      for i,lib in zip(todo, self.compile_batch([srcs[i] for i in todo])):
+        libs[i] = lib
+        self._cache_put(srcs[i], lib)
+    return cast(list[bytes], libs)
   def disassemble(self, lib:bytes): pass
 
 @dataclass(frozen=True)
@@ -1,9 +1,9 @@
-from typing import TypeVar, Generic, Callable, cast, Any
-import functools, collections
+from typing import TypeVar, Generic, Callable, Sequence, cast, Any
+import functools, collections, bisect, pickle, struct, io, os
 from tinygrad.tensor import Tensor
-from tinygrad.helpers import flatten, merge_dicts, DEBUG, Context, BEAM, getenv, colored, JIT, JIT_BATCH_SIZE, dedup, partition, unwrap
+from tinygrad.helpers import flatten, merge_dicts, DEBUG, Context, BEAM, getenv, colored, JIT, JIT_BATCH_SIZE, dedup, partition, unwrap, round_up
 from tinygrad.device import Buffer, Compiled, Device, MultiBuffer
-from tinygrad.dtype import DType
+from tinygrad.dtype import DType, dtypes
 from tinygrad.uop.ops import UOp, Variable, sym_infer, Ops
 from tinygrad.engine.realize import ExecItem, capturing, ViewOp, BufferCopy, BufferXfer, EncDec, CompiledRunner, Runner, Estimates
 from tinygrad.engine.memory import _internal_memory_planner
@@ -266,14 +266,76 @@ def _prepare_jit_inputs(args, kwargs):
   expected_input_info = [(x[0], tuple(sorted(x[1].keys(), key=lambda v: v.expr)), x[2], x[3]) for x in inputs]
   return input_buffers, var_vals, names, expected_input_info
 
+# **************** on disk artifact ****************
+# header | pickled CapturedJit (programs with their libs, exec items, planned buffers) | page aligned data region with the buffer contents
+# base Buffers are pickled by reference. only the ones held by a Tensor (weights, state, outputs) have their contents stored, intermediates
+# are allocated again on the first run. the contents are copied to the device straight from an mmap of the file (DISK device).
+
+JIT_ARTIFACT_MAGIC, JIT_ARTIFACT_VERSION = b"TINYJIT\0", 1
+_jit_artifact_header = struct.Struct("<8sIQQ")  # magic, version, pickle size, data region offset
+
+class _ArtifactPickler(pickle.Pickler):
+  def __init__(self, f):
+    super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+    self.ids: dict[Buffer, tuple] = {}
+    self.data: list[tuple[int, Buffer]] = []
+    self.data_size = 0
+  def persistent_id(self, obj):
+    if not isinstance(obj, Buffer) or obj._base is not None: return None
+    if (pid:=self.ids.get(obj)) is None:
+      off = None
+      if obj.is_allocated() and obj.uop_refcount > 0:
+        self.data.append((off:=self.data_size, obj))
+        self.data_size = round_up(off + obj.nbytes, 64)
+      self.ids[obj] = pid = (len(self.ids), obj.device, obj.size, obj.dtype, obj.options, obj.uop_refcount, off)
+    return pid
+
+class _ArtifactUnpickler(pickle.Unpickler):
+  def __init__(self, f, data:memoryview):
+    super().__init__(f)
+    self.bufs: dict[int, Buffer] = {}
+    self.data = data
+  def persistent_load(self, pid):
+    idx, device, size, dtype, options, uop_refcount, off = pid
+    if (b:=self.bufs.get(idx)) is None:
+      b = self.bufs[idx] = Buffer(device, size, dtype, options=options, uop_refcount=uop_refcount)
+      if off is not None: b.allocate().copyin(self.data[off:off+b.nbytes])
+    return b
+
+@dataclass
+class JitStats:
+  captures: int = 0
+  hits: int = 0
+  evictions: int = 0
+
 class TinyJit(Generic[ReturnType]):
-  def __init__(self, fxn:Callable[..., ReturnType]|None, captured:CapturedJit|None=None, prune=False, optimize=False):
+  """
+  Captures the kernels run by `fxn` and replays them on later calls.
+
+  With `max_variants=0` (the default) a single input signature is captured and calling with different shapes/dtypes raises JitError.
+  With `max_variants=K` a CapturedJit is kept per input signature, each captured after the usual warmup call, and at most K of them are
+  kept. The least recently used one is evicted and its intermediate buffers are freed. `stats` counts captures, hits and evictions.
+
+  With `buckets` (sorted sizes, e.g. powers of two) the size `n` of `bucket_axis` of the first Tensor argument is padded with zeros up to
+  the smallest bucket >= n, in every Tensor argument that has size n there. Returned Tensors with the bucket size on that axis are shrunk
+  back to n. This bounds the captures to len(buckets), which is the default for max_variants. The padding rows must not change the
+  result, so the axis has to be a batch-like axis that `fxn` doesn't reduce over.
+  """
+  def __init__(self, fxn:Callable[..., ReturnType]|None, captured:CapturedJit|None=None, prune=False, optimize=False, max_variants=0,
+               buckets:Sequence[int]|None=None, bucket_axis=0):
     assert fxn or captured, "need either a function or a CapturedJit"
     self.fxn = fxn
     self.captured: CapturedJit|None = captured
     self.cnt: int = 2 if self.fxn is None else 0
     self.prune = prune
     self.optimize = optimize
+    self.buckets = sorted(buckets) if buckets is not None else None
+    self.bucket_axis = bucket_axis
+    self.max_variants = len(self.buckets) if self.buckets is not None and max_variants == 0 else max_variants
+    self.variants: collections.OrderedDict[tuple, CapturedJit] = collections.OrderedDict()
+    # the signatures seen once and not captured yet, as many as there are variants
+    self.variant_cnt: collections.OrderedDict[tuple, int] = collections.OrderedDict()
+    self.stats = JitStats()
 
   def add_buffer(self, b:Buffer) -> Buffer:
     if found:=self._buffer_replace.get(b, None): return found
@@ -291,11 +353,46 @@ class TinyJit(Generic[ReturnType]):
     assert self.fxn is not None, "can't reset without function"
     self.cnt = 0
     self.captured = None
+    self.variants.clear()
+    self.variant_cnt.clear()
 
   def __reduce__(self):
     assert self.captured is not None, "can't pickle an uncaptured JIT"
     return self.__class__, (None, self.captured)
 
+  def save(self, path:str):
+    """Writes the captured JIT to a versioned artifact that `TinyJit.load` can run without the function."""
+    assert self.captured is not None, "can't save an uncaptured JIT"
+    pickler = _ArtifactPickler(pkl:=io.BytesIO())
+    pickler.dump(self.captured)
+    data_offset = round_up(_jit_artifact_header.size + len(meta:=pkl.getvalue()), 4096)
+    with open(path, "wb") as f:
+      f.write(_jit_artifact_header.pack(JIT_ARTIFACT_MAGIC, JIT_ARTIFACT_VERSION, len(meta), data_offset))
+      f.write(meta)
+      for off, b in pickler.data:
+        f.seek(data_offset + off)
+        f.write(b.as_buffer(allow_zero_copy=True))
+      f.truncate(data_offset + pickler.data_size)
+    if DEBUG >= 1:
+      print(f"JIT saved {len(self.captured.jit_cache)} kernels, {len(meta)/1e6:.2f} MB graph, {pickler.data_size/1e6:.2f} MB data to {path}")
+
+  @classmethod
+  def load(cls, path:str) -> 'TinyJit[Any]':
+    """Loads an artifact written by `TinyJit.save`. It replays the captured kernels only, there is no function to capture again."""
+    with open(path, "rb") as f:
+      magic, version, meta_size, data_offset = _jit_artifact_header.unpack(f.read(_jit_artifact_header.size))
+      if magic != JIT_ARTIFACT_MAGIC: raise JitError(f"{path} is not a TinyJit artifact")
+      if version != JIT_ARTIFACT_VERSION: raise JitError(f"{path} has artifact version {version}, expected {JIT_ARTIFACT_VERSION}")
+      meta = f.read(meta_size)
+      size = f.seek(0, os.SEEK_END)
+    if size == data_offset: return cls(None, _ArtifactUnpickler(io.BytesIO(meta), memoryview(b"")).load())
+    disk = Buffer(f"DISK:{os.path.abspath(path)}", size, dtypes.uint8).ensure_allocated()
+    data = disk.as_buffer(allow_zero_copy=True)[data_offset:]
+    try: return cls(None, _ArtifactUnpickler(io.BytesIO(meta), data).load())
+    finally:
+      data.release()
+      disk.deallocate()
+
   # keep legacy code working
   @property
   def jit_cache(self) -> list[ExecItem]: return self.captured._jit_cache if self.captured is not None else []
@@ -304,66 +401,132 @@ class TinyJit(Generic[ReturnType]):
 
   def __get__(self, obj, objtype): return functools.partial(self.__call__, obj) # add support for instance methods
 
+  def _run_uncaptured(self, *args, **kwargs) -> ReturnType:
+    assert self.fxn is not None
+    with Context(BEAM=0 if getenv("IGNORE_JIT_FIRST_BEAM") else BEAM.value):
+      ret = self.fxn(*args, **kwargs)
+      if len(params:=get_parameters(ret)): Tensor.realize(params[0], *params[1:])
+    return ret
+
+  def _capture(self, args, kwargs, input_buffers:list[Buffer], var_vals:dict[str, int], names:list[int|str],
+               expected_input_info:list[tuple[UOp, tuple[Variable, ...], DType, str]]) -> tuple[ReturnType, CapturedJit]:
+    assert self.fxn is not None
+    if capturing: raise RuntimeError(f"having TinyJit inside another TinyJit is not supported {len(capturing)=} {capturing=}")
+    self._jit_cache: list[ExecItem] = []
+    self._buffer_replace: WeakKeyDictionary[Buffer, Buffer] = WeakKeyDictionary()
+    # TODO: should we always disable the memory planner here? it must be off for prune
+    with Context(BEAM=getenv("JITBEAM", BEAM.value), NO_MEMORY_PLANNER=int(self.prune)):
+      capturing.append(self)
+      try:
+        ret = self.fxn(*args, **kwargs)
+        if len(params:=get_parameters(ret)): Tensor.realize(params[0], *params[1:])
+      finally: capturing.clear()
+    jit_cache = self._jit_cache
+    del self._buffer_replace, self._jit_cache
+    if not len(jit_cache): raise JitError("didn't JIT anything!")
+    _check_no_non_tensor_return(ret)
+    if DEBUG >= 1: print(f"JIT captured {len(jit_cache)} kernels with {len(input_buffers)} inputs")
+
+    # track inputs that are views of buffers
+    # TODO: eventually expected_buffers should live in ExecItem
+    extra_view_inputs: list[tuple[int, int, str, int, DType]] = []
+    for item in jit_cache:
+      for b in item.bufs:
+        if b is not None and b._base is not None and b._base in input_buffers:
+          input_buffers.append(b)
+          extra_view_inputs.append((input_buffers.index(b.base), b.offset, b.device, b.size, b.dtype))
+
+    # prune independent kernels (optional)
+    if self.prune:
+      depends: set[Buffer|None] = set(input_buffers)
+      update_depends(depends, jit_cache)
+      pruned, onetime = partition(jit_cache, lambda ei: any(b in depends for b in get_out_buffers_for_ei(ei)))
+      if DEBUG >= 1: print(f"pruned from {len(jit_cache)} -> {len(pruned)} kernels")
+      # run the onetime kernels here
+      for ei in onetime:
+        for b in ei.bufs: cast(Buffer, b).ensure_allocated()
+        ei.run(var_vals, jit=True)
+      jit_cache = pruned
+
+    # memory planning (optional)
+    # Exclude buffers involved in transfer ops to preserve parallelism.
+    noopt_buffers = {b for ji in jit_cache if isinstance(ji.prg, (BufferXfer, BufferCopy, EncDec)) for b in ji.bufs}
+    assigned = _internal_memory_planner([cast(list[Buffer], item.bufs) for item in jit_cache], noopt_buffers, debug_prefix="JIT ", offline=True)
+    jit_cache = [replace(item, bufs=[assigned.get(b,b).ensure_allocated() for b in item.bufs if b is not None]) for item in jit_cache]
+
+    input_replace = get_input_replace(jit_cache, input_buffers)
+    if DEBUG >= 1 and len(set(input_replace.values())) != len(input_buffers): print("WARNING: some input tensors not found")
+
+    captured: CapturedJit = CapturedJit(ret, jit_cache, input_replace, extra_view_inputs, names, expected_input_info)
+    if self.optimize: captured.replan_buffers_memory_layout()
+    self.stats.captures += 1
+    return ret, captured
+
+  def _evict(self):
+    _, evicted = self.variants.popitem(last=False)
+    # free the intermediates only, buffers still referenced by a Tensor (outputs, state) or by another variant stay alive
+    live = {b for c in self.variants.values() for ei in c.jit_cache for b in ei.bufs if b is not None}
+    for b in dedup([b for ei in evicted.jit_cache for b in ei.bufs if b is not None]):
+      if b in live or b.uop_refcount > 0: continue
+      if b.is_allocated(): b.deallocate()
+      if (base:=b._base) is not None and base not in live and base.uop_refcount == 0 and base.allocated_views == 0 and base.is_allocated():
+        base.deallocate()
+    self.stats.evictions += 1
+    if DEBUG >= 1: print(f"JIT evicted a variant with {len(evicted.jit_cache)} kernels, {len(self.variants)} variants left")
+
+  def _call_variants(self, args, kwargs, input_buffers:list[Buffer], var_vals:dict[str, int], names:list[int|str],
+                     expected_input_info:list[tuple[UOp, tuple[Variable, ...], DType, str]]) -> ReturnType:
+    key = (tuple(names), tuple(expected_input_info))
+    if (captured:=self.variants.get(key)) is not None:
+      # jit exec
+      self.variants.move_to_end(key)
+      self.stats.hits += 1
+      self.captured = captured
+      return captured(input_buffers, var_vals)
+    if (cnt:=self.variant_cnt.get(key, 0)) == 0: ret = self._run_uncaptured(*args, **kwargs)
+    else:
+      # jit capture, evicting the least recently used variant if full
+      ret, self.captured = self._capture(args, kwargs, input_buffers, var_vals, names, expected_input_info)
+      self.variants[key] = self.captured
+      self.variant_cnt.pop(key)
+      while len(self.variants) > self.max_variants: self._evict()
+      return ret
+    self.variant_cnt[key] = cnt + 1
+    while len(self.variant_cnt) > self.max_variants: self.variant_cnt.popitem(last=False)
+    return ret
+
+  def _call_bucketed(self, args, kwargs) -> ReturnType:
+    assert self.buckets is not None
+    tensors = [t for t in list(args)+list(kwargs.values()) if t.__class__ is Tensor]
+    if not tensors: return self._call(*args, **kwargs)
+    ax = tensors[0]._resolve_dim(self.bucket_axis)
+    if not isinstance(n:=tensors[0].shape[ax], int): raise JitError(f"can't bucket symbolic size {n}")
+    if (i:=bisect.bisect_left(self.buckets, n)) == len(self.buckets): raise JitError(f"size {n} is larger than the largest bucket {self.buckets[-1]}")
+    if (b:=self.buckets[i]) == n: return self._call(*args, **kwargs)
+    def pad(x):
+      if x.__class__ is not Tensor or x.ndim <= ax or x.shape[ax] != n: return x
+      # contiguous so the input is a new bucket sized buffer and not a PAD view, whose signature would depend on n
+      return x.pad(tuple((0, b-n) if j == ax else None for j in range(x.ndim))).contiguous()
+    def shrink(x):
+      if isinstance(x, (tuple, list)): return type(x)(shrink(y) for y in x)
+      if isinstance(x, dict): return {k:shrink(v) for k,v in x.items()}
+      if not isinstance(x, Tensor) or x.ndim <= ax or x.shape[ax] != b: return x
+      return x.shrink(tuple((0, n) if j == ax else None for j in range(x.ndim)))
+    return shrink(self._call(*[pad(x) for x in args], **{k:pad(v) for k,v in kwargs.items()}))
+
   def __call__(self, *args, **kwargs) -> ReturnType:
+    return self._call_bucketed(args, kwargs) if self.buckets is not None else self._call(*args, **kwargs)
+
+  def _call(self, *args, **kwargs) -> ReturnType:
     input_buffers, var_vals, names, expected_input_info = _prepare_jit_inputs(args, kwargs)
-    if not JIT or self.cnt == 0:
+    if JIT and self.max_variants > 0 and self.fxn is not None:
+      ret = self._call_variants(args, kwargs, input_buffers, var_vals, names, expected_input_info)
+    elif not JIT or self.cnt == 0:
       # jit ignore
-      assert self.fxn is not None
-      with Context(BEAM=0 if getenv("IGNORE_JIT_FIRST_BEAM") else BEAM.value):
-        ret = self.fxn(*args, **kwargs)
-        if len(params:=get_parameters(ret)): Tensor.realize(params[0], *params[1:])
+      ret = self._run_uncaptured(*args, **kwargs)
     elif self.cnt == 1:
       # jit capture
-      assert self.fxn is not None
-      if capturing: raise RuntimeError(f"having TinyJit inside another TinyJit is not supported {len(capturing)=} {capturing=}")
-      self._jit_cache: list[ExecItem] = []
-      self._buffer_replace: WeakKeyDictionary[Buffer, Buffer] = WeakKeyDictionary()
-      # TODO: should we always disable the memory planner here? it must be off for prune
-      with Context(BEAM=getenv("JITBEAM", BEAM.value), NO_MEMORY_PLANNER=int(self.prune)):
-        capturing.append(self)
-        try:
-          ret = self.fxn(*args, **kwargs)
-          if len(params:=get_parameters(ret)): Tensor.realize(params[0], *params[1:])
-        finally: capturing.clear()
-      jit_cache = self._jit_cache
-      del self._buffer_replace, self._jit_cache
-      if not len(jit_cache): raise JitError("didn't JIT anything!")
-      _check_no_non_tensor_return(ret)
-      if DEBUG >= 1: print(f"JIT captured {len(jit_cache)} kernels with {len(input_buffers)} inputs")
-
-      # track inputs that are views of buffers
-      # TODO: eventually expected_buffers should live in ExecItem
-      extra_view_inputs: list[tuple[int, int, str, int, DType]] = []
-      for item in jit_cache:
-        for b in item.bufs:
-          if b is not None and b._base is not None and b._base in input_buffers:
-            input_buffers.append(b)
-            extra_view_inputs.append((input_buffers.index(b.base), b.offset, b.device, b.size, b.dtype))
-
-      # prune independent kernels (optional)
-      if self.prune:
-        depends = set(input_buffers)
-        update_depends(depends, jit_cache)
-        pruned, onetime = partition(jit_cache, lambda ei: any(b in depends for b in get_out_buffers_for_ei(ei)))
-        if DEBUG >= 1: print(f"pruned from {len(jit_cache)} -> {len(pruned)} kernels")
-        # run the onetime kernels here
-        for ei in onetime:
-          for b in ei.bufs: cast(Buffer, b).ensure_allocated()
-          ei.run(var_vals, jit=True)
-        jit_cache = pruned
-
-      # memory planning (optional)
-      # Exclude buffers involved in transfer ops to preserve parallelism.
-      noopt_buffers = {b for ji in jit_cache if isinstance(ji.prg, (BufferXfer, BufferCopy, EncDec)) for b in ji.bufs}
-      assigned = _internal_memory_planner([cast(list[Buffer], item.bufs) for item in jit_cache], noopt_buffers, debug_prefix="JIT ")
-      jit_cache = [replace(item, bufs=[assigned.get(b,b).ensure_allocated() for b in item.bufs if b is not None]) for item in jit_cache]
-
-      input_replace = get_input_replace(jit_cache, input_buffers)
-      if DEBUG >= 1 and len(set(input_replace.values())) != len(input_buffers): print("WARNING: some input tensors not found")
-
-      # set this for next run
-      self.captured = CapturedJit(ret, jit_cache, input_replace, extra_view_inputs, names, expected_input_info)
-      if self.optimize: self.captured.replan_buffers_memory_layout()
+      ret, self.captured = self._capture(args, kwargs, input_buffers, var_vals, names, expected_input_info)
     elif self.cnt >= 2:
       # jit exec
       assert self.captured is not None
@@ -371,6 +534,7 @@ class TinyJit(Generic[ReturnType]):
       if self.captured.expected_input_info != expected_input_info:
         raise JitError(f"args mismatch in JIT: {self.captured.expected_input_info=} != {expected_input_info=}")
       ret = self.captured(input_buffers, var_vals)
+      self.stats.hits += 1
 
     self.cnt += 1
     return ret
@@ -9,7 +9,21 @@ from tinygrad.runtime.support.memory import TLSFAllocator
 
 # **************** memory planning ****************
 
-def _internal_memory_planner(buffers:list[list[Buffer]], noopt_buffers=None, ignore_checks=False, debug_prefix="") -> dict[Buffer, Buffer]:
+def _greedy_by_size(intervals:dict[Buffer, tuple[int, int, int]]) -> tuple[dict[Buffer, int], int]:
+  # offline offset assignment: biggest (then longest lived) buffer first, at the lowest offset free for its whole live range [start, end)
+  offsets:dict[Buffer, int] = {}
+  live_at:defaultdict[int, list[tuple[int, int]]] = defaultdict(list)  # step -> (offset, size) of the placed buffers live then
+  for buf, (start, end, size) in sorted(intervals.items(), key=lambda x: (-x[1][2], x[1][0]-x[1][1])):
+    off = 0
+    for poff, psize in sorted(set(p for t in range(start, end) for p in live_at[t])):
+      if poff - off >= size: break
+      off = max(off, poff + psize)
+    offsets[buf] = off
+    for t in range(start, end): live_at[t].append((off, size))
+  return offsets, max((off+intervals[buf][2] for buf,off in offsets.items()), default=0)
+
+def _internal_memory_planner(buffers:list[list[Buffer]], noopt_buffers=None, ignore_checks=False, debug_prefix="",
+                             offline=False) -> dict[Buffer, Buffer]:
   if NO_MEMORY_PLANNER: return {}
   first_appearance, last_appearance, buf_to_opt = {}, {}, set()
   for i,u in enumerate(buffers):
@@ -41,6 +55,23 @@ def _internal_memory_planner(buffers:list[list[Buffer]], noopt_buffers=None, ign
       if is_open_ev: buffer_replace[buf] = (reuse_buffers[key].pop(), None) if key in reuse_buffers and len(reuse_buffers[key]) > 0 else (buf, None)
       else: reuse_buffers[key].append(cast(Buffer, buffer_replace[buf][0]))
 
+  # Try the offline planner on the known live ranges and keep it where it beats the TLSF one. Only plans that are reused (JIT) are worth its cost.
+  # The TLSF offsets are aligned to the block size, the peaks are compared with the last buffer rounded up like the greedy one.
+  for dev, (tlsf_sz, _) in (global_planner.items() if offline else []):
+    tlsf_sz = round_up(tlsf_sz, 0x1000)
+    intervals = {buf:(first_appearance[buf], last_appearance[buf]+1, round_up(buf.nbytes, 0x1000)) for buf in first_appearance
+                 if buf.device == dev and buffer_replace[buf][1] is not None}
+    offsets, greedy_sz = _greedy_by_size(intervals)
+    if greedy_sz < tlsf_sz:
+      for buf,goff in offsets.items(): buffer_replace[buf] = (None, goff)
+      global_planner[dev] = (greedy_sz, global_planner[dev][1])
+    if DEBUG >= 1:
+      live = [0] * (max(e for _,e,_ in intervals.values()) + 1 if intervals else 1)
+      for st,en,sz in intervals.values():
+        for i in range(st, en): live[i] += sz
+      print(f"{debug_prefix}memory planned {global_planner[dev][0]/1e6:.2f} MB on {dev}, lower bound {max(live)/1e6:.2f} MB",
+            f"(tlsf {tlsf_sz/1e6:.2f} MB, greedy by size {greedy_sz/1e6:.2f} MB)")
+
   # Allocate global buffers based on the memory planner.
   global_buffers = {dev: Buffer(dev, round_up(sz, 0x1000), dtypes.int8) for dev, (sz, _) in global_planner.items()}
   buffer_resolve:dict[Buffer, tuple[Buffer, int|None]] = {buf: (base or global_buffers[buf.device], off) for buf,(base,off) in buffer_replace.items()}
@@ -1,11 +1,16 @@
-from typing import cast, Callable
-import time, pprint, random, itertools, math
+from typing import cast, Callable, Any, Generator
+import time, pprint, random, itertools, math, hashlib, multiprocessing, atexit, signal, copy
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.pool import AsyncResult
 from dataclasses import dataclass, replace, field
+from tinygrad import helpers
 from tinygrad.helpers import all_same, colored, DEBUG, GlobalCounters, ansilen, BEAM, NOOPT, all_int, CAPTURING, Metadata, TRACEMETA, TracingKey
 from tinygrad.helpers import DEVECTORIZE, time_to_str, VALIDATE_WITH_CPU, cpu_profile, PROFILE, ProfilePointEvent, cpu_events, prod, Context, unwrap
+from tinygrad.helpers import PRECOMPILE, PIPELINE_LOWER, PROGRAM_CACHE, LOCAL_SIZE_CACHE, CPU_COUNT, ContextVar, getenv, diskcache_get, diskcache_put
+from tinygrad.helpers import COMPILE_BATCH, BEAM_DB, BEAM_BUDGET, CACHELEVEL, PIPELINE_LOWER_MIN, ceildiv
 from tinygrad.uop.ops import Ops, PatternMatcher, UOp, UPat, sym_infer
 from tinygrad.device import Device, Buffer
-from tinygrad.renderer import ProgramSpec, Estimates
+from tinygrad.renderer import Renderer, ProgramSpec, Estimates
 from tinygrad.codegen import get_program
 
 # **************** Runners ****************
@@ -34,6 +39,12 @@ def optimize_local_size(_prg:Callable, global_size:list[int], rawbufs:list[Buffe
   assert not math.isinf(ret[0]), "all optimize_local_size exec failed"
   return ret[1]
 
+def _local_size_device(device:str) -> str:
+  # the renderer args carry the arch, the runtimes that expose them add the device name and driver version
+  dev = Device[device]
+  renderer = f"{type(dev.renderer).__name__}{dev.renderer.__reduce__()[1]}"
+  return f"{device.split(':')[0]} {renderer} {getattr(dev, 'device_name', '')} {getattr(dev, 'driver_version', '')}"
+
 class CompiledRunner(Runner):
   def __init__(self, p:ProgramSpec, prg=None):
     if DEBUG >= 3: print(p.applied_opts)
@@ -53,7 +64,12 @@ class CompiledRunner(Runner):
     if var_vals is None: var_vals = {}
     global_size, local_size = self.p.launch_dims(var_vals)
     if Device[self.p.device].renderer.has_local and local_size is None and all_int(self.p.global_size):
-      local_size = optimize_local_size(self._prg, global_size, rawbufs)
+      if LOCAL_SIZE_CACHE:
+        # the sweep is done once per program and launch size for a device and driver, other runners and processes get it from the diskcache
+        key = {"src": hashlib.sha256(self.p.src.encode()).hexdigest(), "global_size": str(global_size), "device": _local_size_device(self.p.device)}
+        if (local_size:=diskcache_get("local_size", key)) is None:
+          local_size = diskcache_put("local_size", key, optimize_local_size(self._prg, global_size, rawbufs))
+      else: local_size = optimize_local_size(self._prg, global_size, rawbufs)
       global_size = [g//l if g%l == 0 else g/l for g,l in zip(global_size, local_size)]
       self.p = replace(self.p, global_size=global_size, local_size=local_size)
     return self._prg(*[x._buf for x in rawbufs], global_size=tuple(global_size), local_size=tuple(local_size) if local_size else None,
@@ -106,17 +122,46 @@ class EncDec(Runner):
 
 # **************** method cache ****************
 
-method_cache: dict[tuple[str, type, bytes, tuple[int, ...], bool], CompiledRunner] = {}
-def get_runner(device:str, ast:UOp) -> CompiledRunner:
+MethodCacheKey = tuple[str, type, bytes, tuple[int, ...], bool]
+method_cache: dict[MethodCacheKey, CompiledRunner] = {}
+def method_cache_keys(device:str, ast:UOp) -> tuple[MethodCacheKey, MethodCacheKey]:
   # TODO: this should be all context relevant to rendering
-  context = (BEAM.value, NOOPT.value, DEVECTORIZE.value)
-  ckey = (device, type(Device[device].compiler), ast.key, context, False)
+  context = (BEAM.value, NOOPT.value, DEVECTORIZE.value, BEAM_DB.value)
+  return (device, type(Device[device].compiler), ast.key, context, False), \
+         (device.split(":")[0], type(Device[device].compiler), ast.key, context, True)
+
+# the ContextVars that don't change the program get_program makes (debug, caches, runtime, scheduling), the rest are in the PROGRAM_CACHE key
+PROGRAM_CACHE_SKIP = {"DEBUG", "VIZ", "PROFILE", "TRACEMETA", "ALLOW_DEVICE_USAGE", "CAPTURING", "CACHELEVEL", "PROGRAM_CACHE", "PRECOMPILE",
+                      "PIPELINE_LOWER", "PIPELINE_LOWER_MIN", "REWRITE_MEMO", "SCHEDULE_DISKCACHE", "CCACHE", "CCACHE_DIR", "CACHE_MAX_BYTES",
+                      "JIT", "JIT_BATCH_SIZE", "LRU", "LRU_BUDGET", "LRU_SIZE_CLASSES", "NO_MEMORY_PLANNER", "RING", "ALL2ALL", "CPU_ARENA",
+                      "CPU_ARENA_POPULATE", "CPU_GRAPH", "CPU_PIN", "LOCAL_SIZE_CACHE", "BEAM_COST_LOG"}
+
+def _program_cache_key(ast:UOp, renderer:Renderer) -> dict:
+  # the renderer is identified by its class and constructor args (arch/target)
+  # the codegen ContextVars are the ones in helpers, the ones of the runtimes are only in a process that opened the device
+  ctx = sorted((v.key, v.value) for v in vars(helpers).values() if isinstance(v, ContextVar) and v.key not in PROGRAM_CACHE_SKIP)
+  return {"ast": ast.key, "renderer": f"{type(renderer).__name__}{renderer.__reduce__()[1]}", "device": renderer.device, "context": str(ctx)}
+
+def program_cache_get(ast:UOp, renderer:Renderer) -> ProgramSpec|None:
+  """The ProgramSpec of the AST in the PROGRAM_CACHE, if it's on and has it."""
+  if not PROGRAM_CACHE or (ret:=diskcache_get("program_cache", _program_cache_key(ast, renderer))) is None: return None
+  GlobalCounters.program_cache_hits += 1
+  return ret
+
+def get_program_cached(ast:UOp, renderer:Renderer) -> ProgramSpec:
+  """Like get_program, but with PROGRAM_CACHE the ProgramSpec is stored on disk, so a warm start skips codegen."""
+  if not PROGRAM_CACHE: return get_program(ast, renderer)
+  if (ret:=program_cache_get(ast, renderer)) is not None: return ret
+  GlobalCounters.program_cache_misses += 1
+  return diskcache_put("program_cache", _program_cache_key(ast, renderer), get_program(ast, renderer))
+
+def get_runner(device:str, ast:UOp) -> CompiledRunner:
+  ckey, bkey = method_cache_keys(device, ast)
   if cret:=method_cache.get(ckey): return cret
-  bkey = (device.split(":")[0], type(Device[device].compiler), ast.key, context, True)
   if bret:=method_cache.get(bkey):
     method_cache[ckey] = ret = CompiledRunner(replace(bret.p, device=device))
   else:
-    prg: ProgramSpec = get_program(ast, Device[device].renderer)
+    prg: ProgramSpec = get_program_cached(ast, Device[device].renderer)
     method_cache[ckey] = method_cache[bkey] = ret = CompiledRunner(replace(prg, device=device))
   return ret
 
@@ -185,28 +230,154 @@ class ExecItem:
       self.prg.first_run = False
     return et
 
+# **************** parallel precompile ****************
+
+# workers should not open devices, should ignore ctrl c and should not launch VIZ
+def _init_precompile_worker():
+  Context(ALLOW_DEVICE_USAGE=0, VIZ=0, TRACK_MATCH_STATS=0).__enter__()
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def render_only(ren:Renderer) -> Renderer:
+  # a copy of the renderer that leaves the compile to the caller, so it can compile many kernels at once
+  (ret:=copy.copy(ren)).compiler = None
+  return ret
+
+def _precompile_program(x:tuple[UOp, Renderer, dict[str, Any], bool]) -> ProgramSpec:
+  # spawned workers don't see the Context of the parent, so it's passed with the job
+  with Context(**{k:v for k,v in x[2].items() if k in ContextVar._cache}): return get_program_cached(x[0], render_only(x[1]) if x[3] else x[1])
+
+def _precompile_program_timed(x:tuple[UOp, Renderer, dict[str, Any], bool]) -> tuple[ProgramSpec, float]:
+  st = time.perf_counter()
+  return _precompile_program(x), time.perf_counter() - st
+
+def _precompile_ctx() -> dict[str, Any]:
+  return {k:v.value for k,v in ContextVar._cache.items() if k not in {"ALLOW_DEVICE_USAGE", "VIZ", "PROFILE", "TRACK_MATCH_STATS", "DEBUG"}}
+
+precompile_pool = None
+def _precompile_pool(workers:int):
+  global precompile_pool
+  if precompile_pool is None:
+    precompile_pool = multiprocessing.get_context("spawn").Pool(workers, _init_precompile_worker)
+    @atexit.register
+    def close_pool(): unwrap(precompile_pool).close()
+  return precompile_pool
+
+def precompile_schedule(schedule:list[ExecItem], workers:int|None=None) -> int:
+  """
+  Lower all the kernels in the schedule that are not in the method_cache, in parallel.
+
+  Codegen (get_program) runs in a process pool, compiles that happen outside the renderer run in a thread pool.
+  Identical ASTs are only lowered once. Returns the number of kernels that were compiled.
+  """
+  # BEAM needs the device to time kernels, so it can't run in the workers
+  if BEAM >= 1: return 0
+  todo: dict[MethodCacheKey, tuple[str, UOp]] = {}
+  for ei in schedule:
+    if ei.prg is not None or ei.ast.op is not Ops.SINK or not len(ei.bufs) or ei.bufs[0] is None: continue
+    ckey, bkey = method_cache_keys(device:=ei.bufs[0].device, ei.ast)
+    if ckey in method_cache or bkey in method_cache or bkey in todo: continue
+    todo[bkey] = (device, ei.ast)
+  if len(todo) < 2: return 0
+
+  st = time.perf_counter()
+  if workers is None: workers = getenv("PRECOMPILE_WORKERS", CPU_COUNT.value)
+  ctx = _precompile_ctx()
+  batch = {device:COMPILE_BATCH.value > 1 and Device[device].compiler.supports_batch for device,_ in todo.values()}
+  jobs = [(ast, Device[device].renderer, ctx, batch[device]) for device,ast in todo.values()]
+  if workers <= 1: progs = list(map(_precompile_program, jobs))
+  else: progs = _precompile_pool(workers).map(_precompile_program, jobs, chunksize=1)
+
+  # compiles that happen outside the renderer run in threads, most of them release the GIL (subprocess or ctypes)
+  # compilers that support it get the kernels in chunks, but still enough chunks to keep all the threads busy
+  chunks: list[tuple[str, list[int]]] = []
+  for device in batch:
+    idxs = [i for i,(d,_) in enumerate(todo.values()) if d == device and progs[i].lib is None]
+    sz = min(COMPILE_BATCH.value, ceildiv(len(idxs), max(1, workers))) if batch[device] else 1
+    chunks += [(device, idxs[i:i+sz]) for i in range(0, len(idxs), sz)]
+  def _compile(x:tuple[str, list[int]]) -> list[bytes]: return Device[x[0]].compiler.compile_cached_batch([progs[i].src for i in x[1]])
+  with ThreadPoolExecutor(max(1, workers)) as ex:
+    for (_, idxs), libs in zip(chunks, ex.map(_compile, chunks)):
+      for i,lib in zip(idxs, libs): progs[i] = replace(progs[i], lib=lib)
+
+  for (bkey, (device, ast)), p in zip(todo.items(), progs):
+    method_cache[method_cache_keys(device, ast)[0]] = method_cache[bkey] = CompiledRunner(replace(p, device=device))
+  if DEBUG >= 1: print(f"precompiled {len(progs):4d} kernels in {(time.perf_counter()-st)*1000:8.2f} ms with {workers} workers")
+  return len(progs)
+
 # **************** main run function ****************
 
 capturing: list = []  # put classes with an add method in here
 
-def run_schedule(schedule:list[ExecItem], var_vals:dict[str, int]|None=None, do_update_stats=True):
+def _validation_item(ei:ExecItem) -> ExecItem|None:
+  if not VALIDATE_WITH_CPU or ei.ast.op is not Ops.SINK: return None
+  with Context(BEAM=0): return ExecItem(ei.ast, [Buffer("CPU", b.size, b.dtype) for b in ei.bufs if b is not None], ei.metadata, ei.fixedvars).lower()
+
+def _lower_schedule(schedule:list[ExecItem]) -> Generator[tuple[ExecItem, ExecItem|None], None, None]:
   while len(schedule):
     ei = schedule.pop(0).lower()
-    if len(capturing) and CAPTURING: capturing[0].add(ei)
-    if VALIDATE_WITH_CPU and ei.ast.op is Ops.SINK:
-      # copy in allocated buffers from the GPU
-      bufs = [b for b in ei.bufs if b is not None]
-      nb: list[Buffer|None] = [Buffer("CPU", b.size, b.dtype) for b in bufs]
-      for cpu_b, gpu_b in zip(nb, bufs):
-        if cpu_b is not None and gpu_b.is_allocated(): cpu_b.ensure_allocated().copyin(gpu_b.as_buffer())
-
-      # run on GPU
-      ei.run(var_vals, do_update_stats=do_update_stats)
-
-      # validate the output buffers match (NOTE: this is assuming the output is buffer 0)
-      with Context(BEAM=0): ExecItem(ei.ast, nb, ei.metadata, ei.fixedvars).run(var_vals, do_update_stats=do_update_stats)
-      import numpy as np
-      assert nb[0] is not None
-      np.testing.assert_allclose(bufs[0].numpy(), nb[0].numpy(), rtol=1e-3, atol=1e-3)
-    else:
-      ei.run(var_vals, do_update_stats=do_update_stats)
+    yield ei, _validation_item(ei)
+
+def _lower_schedule_pipelined(schedule:list[ExecItem], ahead:int) -> Generator[tuple[ExecItem, ExecItem|None], None, None]:
+  # the precompile workers run get_program for the kernels of the next `ahead` items while the yielded ones are run. order is preserved
+  # NOTE: Context is global to the process, so the lowering can't be on a thread of this one. get_program turns off ALLOW_DEVICE_USAGE
+  def bkey(ei:ExecItem) -> MethodCacheKey|None:
+    if ei.prg is not None or ei.ast.op is not Ops.SINK or not len(ei.bufs) or ei.bufs[0] is None: return None
+    return None if (keys:=method_cache_keys(ei.bufs[0].device, ei.ast))[0] in method_cache or keys[1] in method_cache else keys[1]
+  if len({k for ei in schedule if (k:=bkey(ei)) is not None}) < PIPELINE_LOWER_MIN:
+    yield from _lower_schedule(schedule)
+    return
+  workers, ctx, lower_tm, wait_tm = getenv("PRECOMPILE_WORKERS", CPU_COUNT.value), _precompile_ctx(), 0.0, 0.0
+  pending: dict[MethodCacheKey, tuple[str, UOp, AsyncResult]] = {}
+  while len(schedule):
+    for ei in schedule[:ahead+1]:
+      if (k:=bkey(ei)) is not None and k not in pending:
+        ren = Device[device:=unwrap(ei.bufs[0]).device].renderer
+        # a program on disk is read here, that's cheaper than the round trip to a worker
+        if (p:=program_cache_get(ei.ast, ren)) is not None:
+          method_cache[method_cache_keys(device, ei.ast)[0]] = method_cache[k] = CompiledRunner(replace(p, device=device))
+        else: pending[k] = (device, ei.ast, _precompile_pool(workers).apply_async(_precompile_program_timed, ((ei.ast, ren, ctx, False),)))
+    if (k:=bkey(schedule[0])) is not None:
+      device, ast, res = pending.pop(k)
+      st = time.perf_counter()
+      p, tm = res.get()
+      wait_tm, lower_tm = wait_tm + time.perf_counter() - st, lower_tm + tm
+      method_cache[method_cache_keys(device, ast)[0]] = method_cache[k] = CompiledRunner(replace(p, device=device))
+    # the item stays in the schedule if lowering it fails
+    ei = schedule[0].lower()
+    yield schedule.pop(0), _validation_item(ei)
+  # the share of the lowering time that was hidden behind the runs, the wait includes the round trip to the workers
+  if DEBUG >= 2 and lower_tm > 0:
+    print(f"pipelined lowering: {lower_tm*1e3:8.2f} ms lowering, {wait_tm*1e3:8.2f} ms waiting, {max(0, 1-wait_tm/lower_tm)*100:5.1f}% overlapped")
+
+def _run_lowered(ei:ExecItem, vei:ExecItem|None, var_vals:dict[str, int]|None, do_update_stats:bool):
+  if len(capturing) and CAPTURING: capturing[0].add(ei)
+  if vei is not None:
+    # copy in allocated buffers from the GPU
+    bufs = [b for b in ei.bufs if b is not None]
+    for cpu_b, gpu_b in zip(vei.bufs, bufs):
+      if cpu_b is not None and gpu_b.is_allocated(): cpu_b.ensure_allocated().copyin(gpu_b.as_buffer())
+
+    # run on GPU
+    ei.run(var_vals, do_update_stats=do_update_stats)
+
+    # validate the output buffers match (NOTE: this is assuming the output is buffer 0)
+    vei.run(var_vals, do_update_stats=do_update_stats)
+    import numpy as np
+    assert vei.bufs[0] is not None
+    np.testing.assert_allclose(bufs[0].numpy(), vei.bufs[0].numpy(), rtol=1e-3, atol=1e-3)
+  else:
+    ei.run(var_vals, do_update_stats=do_update_stats)
+
+def run_schedule(schedule:list[ExecItem], var_vals:dict[str, int]|None=None, do_update_stats=True):
+  if BEAM_BUDGET and BEAM >= 1:
+    from tinygrad.codegen.opt import search
+    # the searched opts only reach the kernels through the tuning DB
+    if CACHELEVEL < 1: raise RuntimeError("BEAM_BUDGET needs CACHELEVEL >= 1, the searched opts are kept in the tuning DB")
+    # the kernels that take most of the time are searched in the budget, all of them are lowered with what the tuning DB has
+    if (left:=BEAM_BUDGET.value - search.beam_budget_used) > 0: search.beam_schedule(schedule, left, BEAM.value)
+    with Context(BEAM=0, BEAM_DB=1, BEAM_BUDGET=0): return run_schedule(schedule, var_vals, do_update_stats)
+  if PRECOMPILE: precompile_schedule(schedule)
+  # BEAM needs the device to time kernels, so it can't run in the workers
+  pipelined = PIPELINE_LOWER and BEAM < 1 and len(schedule) > 1
+  lowered = _lower_schedule_pipelined(schedule, PIPELINE_LOWER.value) if pipelined else _lower_schedule(schedule)
+  for ei, vei in lowered: _run_lowered(ei, vei, var_vals, do_update_stats)
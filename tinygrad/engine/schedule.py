@@ -1,10 +1,10 @@
 import time
 from typing import cast
 from collections import deque
-from tinygrad.uop.ops import UOp, Ops, buffers, UOpMetaClass, track_rewrites, PatternMatcher, UPat, graph_rewrite, graph_rewrite_map
+from tinygrad.uop.ops import UOp, Ops, buffers, UOpMetaClass, track_rewrites, PatternMatcher, UPat, graph_rewrite_map, CustomKernel
 from tinygrad.uop.spec import type_verify, tensor_spec
 from tinygrad.device import Buffer, MultiBuffer
-from tinygrad.helpers import DEBUG, cpu_profile, TracingKey, SPEC, flatten, pluralize
+from tinygrad.helpers import DEBUG, cpu_profile, TracingKey, SPEC, flatten, pluralize, SCHEDULE_DISKCACHE, diskcache_get, diskcache_put
 from tinygrad.engine.realize import ExecItem
 
 # **** schedule linearizer
@@ -132,6 +132,17 @@ pm_post_sched_cache = PatternMatcher([
   (UPat(Ops.BIND, src=(UPat(Ops.DEFINE_VAR),), name="b"), lambda ctx,b: ctx.get(b)),
 ])
 
+def rewrite_leaves(sink:UOp, pm:PatternMatcher, ctx, cache:dict[UOp, UOp]) -> dict[UOp, UOp]:
+  """
+  graph_rewrite for a pm that only rewrites leaves to UOps it doesn't match, in one pass over the toposort without the stack of the rewrite engine.
+  The cache has the results of the UOps that are known already, they aren't looked into. Returns the result of every UOp.
+  """
+  def visit(u:UOp) -> UOp:
+    if (new_src:=tuple([cache[s] for s in u.src])) != u.src: u = UOp(u.op, u.dtype, new_src, u.arg, u.tag)
+    return u if (ret:=pm.rewrite(u, ctx)) is None else ret
+  sink.topovisit(visit, cache)
+  return cache
+
 schedule_cache: dict[bytes, tuple[list[ExecItem], UOp]] = {}
 @track_rewrites(lambda _,ret: f"Schedule {pluralize('Kernel', len(ret[1]))}")
 def complete_create_schedule_with_vars(big_sink:UOp) -> tuple[dict[UOp, UOp], list[ExecItem], dict[str, int]]:
@@ -141,10 +152,16 @@ def complete_create_schedule_with_vars(big_sink:UOp) -> tuple[dict[UOp, UOp], li
   # replace all UNIQUE buffers with LUNIQUE, strip BIND values for cache key, extract var_vals
   input_buffers: dict[UOp, UOp] = {}
   var_vals: dict[str, int] = {}
-  big_sink_cache = graph_rewrite(big_sink, pm_pre_sched_cache, ctx=(input_buffers, var_vals), name="rewrite for sched cache")
+  with cpu_profile(TracingKey("rewrite for sched cache")):
+    normalized = rewrite_leaves(big_sink, pm_pre_sched_cache, (input_buffers, var_vals), {})
+  big_sink_cache = normalized[big_sink]
   sched_cache_key = big_sink_cache.key
 
-  if (sc_ret:=schedule_cache.get(sched_cache_key, None)) is None:
+  # the disk tier is shared by all processes (versioned by the diskcache VERSION), the memory tier is in front of it
+  if (sc_ret:=schedule_cache.get(sched_cache_key, None)) is None and SCHEDULE_DISKCACHE:
+    if (sc_ret:=diskcache_get("schedule_cache", sched_cache_key.hex())) is not None: schedule_cache[sched_cache_key] = sc_ret
+
+  if sc_ret is None:
     # verify Tensors match the spec (on big_sink, we only need to do this if cache misses)
     if SPEC: type_verify(big_sink, tensor_spec)
 
@@ -169,14 +186,20 @@ def complete_create_schedule_with_vars(big_sink:UOp) -> tuple[dict[UOp, UOp], li
     tensor_map_sink = UOp.sink(*flatten([(k,v) for k,v in tensor_map.items()]), *flatten(after_map))
     combined_sink = UOp.sink(tensor_map_sink, buf_uops_sink)
     schedule_cache[sched_cache_key] = (pre_schedule, combined_sink)
+    # CustomKernels can't be pickled
+    if SCHEDULE_DISKCACHE and not any(isinstance(u.arg, CustomKernel) for u in combined_sink.toposort()):
+      diskcache_put("schedule_cache", sched_cache_key.hex(), (pre_schedule, combined_sink))
   else:
     # schedule cache hit
     del big_sink_cache
     pre_schedule, combined_sink = sc_ret
 
-  # replace all the LUNIQUEs with UNIQUEs (single graph_rewrite for everything)
+  # replace all the LUNIQUEs with UNIQUEs (single pass for everything). the normalized UOps of big_sink unrewrite to the ones in it, only the rest
+  # of the schedule is rebuilt
   input_buffers_reverse = {v:k for k,v in input_buffers.items()}
-  combined = graph_rewrite(combined_sink, pm_post_sched_cache, ctx=input_buffers_reverse, name="unrewrite combined")
+  with cpu_profile(TracingKey("unrewrite combined")):
+    combined = rewrite_leaves(combined_sink, pm_post_sched_cache, input_buffers_reverse, {v:k for k,v in normalized.items()})[combined_sink]
+  del normalized
   tensor_map_sink, buf_uops_sink = combined.src
   tm_src = tensor_map_sink.src
   tensor_map = {tm_src[i]:tm_src[i+1] for i in range(0, len(tm_src), 2)}
@@ -198,7 +221,7 @@ def complete_create_schedule_with_vars(big_sink:UOp) -> tuple[dict[UOp, UOp], li
         schedule.append(ExecItem(si.ast, list(bufs), si.metadata, si.fixedvars | ({dnums[0].expr:j} if len(dnums) else {})))
     else:
       # ONE -> ONE
-      schedule.append(ExecItem(si.ast, list(ubufs), si.metadata, si.fixedvars))
+      schedule.append(ExecItem(si.ast, list(cast(tuple[Buffer, ...], ubufs)), si.metadata, si.fixedvars))
   with cpu_profile(TracingKey("memory planner")): schedule = memory_planner(schedule)
 
   if (DEBUG >= 1 and len(schedule) > 1) or DEBUG >= 3:
@@ -1,6 +1,6 @@
 from __future__ import annotations
 import os, functools, platform, time, re, contextlib, operator, hashlib, pickle, sqlite3, tempfile, pathlib, string, ctypes, sys, gzip, getpass, gc
-import subprocess, shutil, math, types, copyreg, inspect, importlib, decimal, itertools
+import subprocess, shutil, math, types, copyreg, inspect, importlib, decimal, itertools, threading, collections, multiprocessing.util
 from dataclasses import dataclass, field
 from typing import ClassVar, Iterable, Any, TypeVar, Callable, Sequence, TypeGuard, Iterator, Generic, Generator, cast, overload
 
@@ -197,6 +197,45 @@ DEBUG_RANGEIFY = ContextVar("DEBUG_RANGEIFY", 0)
 TUPLE_ORDER = ContextVar("TUPLE_ORDER", 1)
 # set to 0 to disable the compiler cache
 CCACHE = ContextVar("CCACHE", 1)
+# set to a directory to store compiled programs there as one file per source hash instead of in the sqlite cache, no lock is shared
+CCACHE_DIR = ContextVar("CCACHE_DIR", "")
+# set to N to compile up to N kernels together in one call with compilers that support it (clang), 1 compiles them one by one
+COMPILE_BATCH = ContextVar("COMPILE_BATCH", 1)
+# set to 1 to lower and compile all kernels of a schedule in parallel before running it
+PRECOMPILE = ContextVar("PRECOMPILE", 0)
+# set to N to lower up to N schedule items ahead in the precompile workers while the previous ones run
+PIPELINE_LOWER = ContextVar("PIPELINE_LOWER", 0)
+# schedules with fewer kernels to lower than this don't pipeline, the round trip to the workers costs more than it hides
+PIPELINE_LOWER_MIN = ContextVar("PIPELINE_LOWER_MIN", 8)
+# set to 1 to cache the lowered ProgramSpec on disk by the AST, skipping codegen on warm starts
+PROGRAM_CACHE = ContextVar("PROGRAM_CACHE", 0)
+# set to 1 to keep the optimize_local_size sweep result in the diskcache, keyed by the program, launch size, device and driver
+LOCAL_SIZE_CACHE = ContextVar("LOCAL_SIZE_CACHE", 0)
+# set to 1 to remember the results of graph_rewrite on memoized (pure) matchers across calls, for as long as the UOps live
+# ctx has to be None or a str
+REWRITE_MEMO = ContextVar("REWRITE_MEMO", 0)
+# set to 1 to also store the schedule cache on disk, so processes with the same graph only schedule it once
+SCHEDULE_DISKCACHE = ContextVar("SCHEDULE_DISKCACHE", 0)
+# byte budget of the LRU buffer cache of each device, past it the least recently freed buffers are released. 0 is unbounded
+LRU_BUDGET = ContextVar("LRU_BUDGET", 0)
+# set to N to round allocations up to N size classes per power of two (<1/N waste), so the LRU cache reuses close sizes
+LRU_SIZE_CLASSES = ContextVar("LRU_SIZE_CLASSES", 0)
+# set to N to carve small CPU buffers out of N MB arenas with TLSF instead of one mmap per buffer. CPU_ARENA_POPULATE=1 prefaults them
+CPU_ARENA, CPU_ARENA_POPULATE = ContextVar("CPU_ARENA", 0), ContextVar("CPU_ARENA_POPULATE", 0)
+# pin the CPU worker threads to the cores the process can run on
+CPU_PIN = ContextVar("CPU_PIN", 1)
+# replay CPU JIT batches with one generated C dispatcher call instead of a command per kernel
+CPU_GRAPH = ContextVar("CPU_GRAPH", 0)
+# size budget of the disk cache in bytes, past it the least recently accessed entries are evicted. 0 is unbounded
+CACHE_MAX_BYTES = ContextVar("CACHE_MAX_BYTES", 0)
+# set to N seconds with BEAM to only search the kernels that take most of the time: the schedule is timed with hand-coded opts first and
+# the kernels get a share of the N seconds (for the whole process) in proportion to their share of the runtime, see beam_schedule
+BEAM_BUDGET = ContextVar("BEAM_BUDGET", 0)
+# set to 1 to apply the fastest opts of the BEAM tuning DB to kernels when BEAM=0, see export_beam_db/import_beam_db in codegen/opt/search.py
+BEAM_DB = ContextVar("BEAM_DB", 0)
+# module:name of a CostModel or a json file of a trained LinearCostModel, to rank the BEAM candidates before they are compiled
+# with BEAM_COST_TOPK=N only the N best ranked of each step are compiled and timed. BEAM_COST_LOG=1 keeps the timings to train on
+BEAM_COST_MODEL, BEAM_COST_TOPK, BEAM_COST_LOG = ContextVar("BEAM_COST_MODEL", ""), ContextVar("BEAM_COST_TOPK", 0), ContextVar("BEAM_COST_LOG", 0)
 # allow tf32 to be used on NVIDIA GPUs
 ALLOW_TF32 = ContextVar("ALLOW_TF32", 0)
 
@@ -216,6 +255,14 @@ class GlobalCounters:
   time_sum_s: ClassVar[float] = 0.0
   kernel_count: ClassVar[int] = 0
   mem_used: ClassVar[int] = 0   # NOTE: this is not reset
+  program_cache_hits: ClassVar[int] = 0   # NOTE: this is not reset
+  program_cache_misses: ClassVar[int] = 0   # NOTE: this is not reset
+  lru_hits: ClassVar[int] = 0   # NOTE: this is not reset
+  lru_misses: ClassVar[int] = 0   # NOTE: this is not reset
+  lru_evictions: ClassVar[int] = 0   # NOTE: this is not reset
+  lru_cached_bytes: ClassVar[int] = 0   # NOTE: this is not reset
+  beam_db_hits: ClassVar[int] = 0   # NOTE: this is not reset
+  beam_db_misses: ClassVar[int] = 0   # NOTE: this is not reset
   @staticmethod
   def reset(): GlobalCounters.global_ops, GlobalCounters.global_mem, GlobalCounters.time_sum_s, GlobalCounters.kernel_count = 0,0,0.0,0
 
@@ -311,50 +358,220 @@ if getenv("DEBUG_GC"):
 cache_dir: str = os.path.join(getenv("XDG_CACHE_HOME", os.path.expanduser("~/Library/Caches" if OSX else "~/.cache")), "tinygrad")
 CACHEDB: str = getenv("CACHEDB", os.path.abspath(os.path.join(cache_dir, "cache.db")))
 
-VERSION = 22
+VERSION = 23
+# recently used entries are kept pickled in memory in front of the database
+CACHE_MEM_ENTRIES: int = getenv("CACHE_MEM_ENTRIES", 4096)
+# puts are written by a background thread in one transaction every CACHE_FLUSH_INTERVAL seconds, and when the process exits
+CACHE_FLUSH_INTERVAL: float = float(getenv("CACHE_FLUSH_INTERVAL", "0.5"))
+# a hit only writes its access time (for the eviction order) when the stored one is CACHE_TOUCH_INTERVAL seconds old, so reads stay reads
+CACHE_TOUCH_INTERVAL: float = float(getenv("CACHE_TOUCH_INTERVAL", "3600"))
+
 _db_connection = None
 def db_connection():
   global _db_connection
   if _db_connection is None:
     os.makedirs(CACHEDB.rsplit(os.sep, 1)[0], exist_ok=True)
-    _db_connection = sqlite3.connect(CACHEDB, timeout=60, isolation_level="IMMEDIATE")
+    # the flush thread writes with the connection too, _db_lock serializes all the uses
+    _db_connection = sqlite3.connect(CACHEDB, timeout=60, isolation_level="IMMEDIATE", check_same_thread=False)
     # another connection has set it already or is in the process of setting it
     # that connection will lock the database
     with contextlib.suppress(sqlite3.OperationalError): _db_connection.execute("PRAGMA journal_mode=WAL").fetchone()
     if DEBUG >= 8: _db_connection.set_trace_callback(print)
   return _db_connection
 
+_db_lock = threading.RLock()
+# (table, key) -> pickled value and access time (ns) in the database
+_db_mem: collections.OrderedDict[tuple, tuple[bytes, int]] = collections.OrderedDict()
+# (table, key) -> pickled value of the puts and -> access time (ns) of the hits that are not in the database yet
+_db_pending: dict[tuple, tuple[str, dict, bytes]] = {}
+_db_touched: dict[tuple, tuple[str, dict, int]] = {}
+_db_wake = threading.Event()
+_db_flush_pid, _db_closing = 0, False
+
+def _db_key(table:str, key:dict) -> tuple:
+  # sqlite compares an integer column with '4' and 4 the same, so does the memory cache
+  return (table,) + tuple((k, str(int(v)) if isinstance(v, int) else v) for k,v in key.items())
+
+def _db_mem_put(mkey:tuple, val:bytes, accessed_at:int):
+  _db_mem[mkey] = (val, accessed_at)
+  _db_mem.move_to_end(mkey)
+  while len(_db_mem) > CACHE_MEM_ENTRIES: _db_mem.popitem(last=False)
+
+def _db_reset_after_fork():
+  # the parent flushes its own pending writes, the connection and the flush thread don't survive the fork
+  global _db_connection, _db_lock, _db_wake, _db_flush_pid, _db_closing
+  _db_connection, _db_lock, _db_wake, _db_flush_pid, _db_closing = None, threading.RLock(), threading.Event(), 0, False
+  _db_pending.clear()
+  _db_touched.clear()
+if hasattr(os, "register_at_fork"): os.register_at_fork(after_in_child=_db_reset_after_fork)
+
+def _db_flush_loop(pid:int):
+  while _db_flush_pid == pid:
+    _db_wake.wait()
+    time.sleep(CACHE_FLUSH_INTERVAL)
+    _db_wake.clear()
+    diskcache_flush()
+
+def _db_close():
+  global _db_closing
+  # entries put while exiting are written through
+  _db_closing = True
+  diskcache_flush()
+
+def diskcache_flush():
+  """Write the pending puts and access times to the database in one transaction, then evict down to CACHE_MAX_BYTES."""
+  with _db_lock:
+    if not _db_pending and not _db_touched: return
+    pending, touched = list(_db_pending.values()), list(_db_touched.values())
+    _db_pending.clear()
+    _db_touched.clear()
+    conn = db_connection()
+    cur = conn.cursor()
+    for table, key, val in pending:
+      if table not in _db_tables:
+        TYPES = {str: "text", bool: "integer", int: "integer", float: "numeric", bytes: "blob"}
+        ltypes = ', '.join(f"{k} {TYPES[type(key[k])]}" for k in key.keys())
+        cur.execute(f"CREATE TABLE IF NOT EXISTS '{table}_{VERSION}' ({ltypes}, val blob, accessed_at integer, "
+                    f"PRIMARY KEY ({', '.join(key.keys())}))")
+        _db_tables.add(table)
+      cur.execute(f"REPLACE INTO '{table}_{VERSION}' ({', '.join(key.keys())}, val, accessed_at) VALUES ({', '.join(['?']*len(key))}, ?, ?)",
+                  tuple(key.values()) + (val, time.time_ns()))
+    for table, key, accessed_at in touched:
+      with contextlib.suppress(sqlite3.OperationalError):
+        cur.execute(f"UPDATE '{table}_{VERSION}' SET accessed_at=? WHERE {' AND '.join([f'{x}=?' for x in key.keys()])}",
+                    (accessed_at,) + tuple(key.values()))
+    conn.commit()
+    if CACHE_MAX_BYTES.value > 0 and diskcache_evict(CACHE_MAX_BYTES.value): conn.commit()
+    cur.close()
+
+def diskcache_size() -> int:
+  """Bytes used by the database, the pages freed by evictions are reused before the file grows."""
+  conn = db_connection()
+  page_count, free_count, page_size = [conn.execute(f"PRAGMA {x}").fetchone()[0] for x in ("page_count", "freelist_count", "page_size")]
+  return (page_count - free_count) * page_size
+
+def diskcache_evict(max_bytes:int) -> int:
+  """Delete the least recently accessed entries of this VERSION until the database is under 3/4 of max_bytes. Returns the entries deleted."""
+  with _db_lock:
+    if (size:=diskcache_size()) <= max_bytes: return 0
+    cur = db_connection().cursor()
+    tables = [t for t, in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall() if t.endswith(f"_{VERSION}")]
+    if not tables: return 0
+    rows = cur.execute(" UNION ALL ".join(f"SELECT {i}, rowid, accessed_at, length(val) FROM '{t}'" for i,t in enumerate(tables)) +
+                       " ORDER BY 3").fetchall()
+    evict: dict[int, list[int]] = {}
+    for i, rowid, _, sz in rows:
+      if size <= max_bytes * 3 // 4: break
+      evict.setdefault(i, []).append(rowid)
+      size -= sz or 0
+    for i, rowids in evict.items(): cur.executemany(f"DELETE FROM '{tables[i]}' WHERE rowid = ?", [(r,) for r in rowids])
+    cur.close()
+    # entries that are only in memory now would be served without bumping their access time, drop them too
+    _db_mem.clear()
+    return sum(len(x) for x in evict.values())
+
 def diskcache_clear():
-  cur = db_connection().cursor()
-  drop_tables = cur.execute("SELECT 'DROP TABLE IF EXISTS ' || quote(name) || ';' FROM sqlite_master WHERE type = 'table';").fetchall()
-  cur.executescript("\n".join([s[0] for s in drop_tables] + ["VACUUM;"]))
+  with _db_lock:
+    _db_mem.clear()
+    _db_pending.clear()
+    _db_touched.clear()
+    _db_tables.clear()
+    cur = db_connection().cursor()
+    drop_tables = cur.execute("SELECT 'DROP TABLE IF EXISTS ' || quote(name) || ';' FROM sqlite_master WHERE type = 'table';").fetchall()
+    cur.executescript("\n".join([s[0] for s in drop_tables] + ["VACUUM;"]))
 
 def diskcache_get(table:str, key:dict|str|int) -> Any:
   if CACHELEVEL < 1: return None
   if isinstance(key, (str,int)): key = {"key": key}
-  cur = db_connection().cursor()
-  try:
-    res = cur.execute(f"SELECT val FROM '{table}_{VERSION}' WHERE {' AND '.join([f'{x}=?' for x in key.keys()])}", tuple(key.values()))
-  except sqlite3.OperationalError:
-    return None  # table doesn't exist
-  if (val:=res.fetchone()) is not None: return pickle.loads(val[0])
-  return None
-
-_db_tables = set()
+  mkey = _db_key(table, key)
+  with _db_lock:
+    if (ent:=_db_mem.get(mkey)) is None and (p:=_db_pending.get(mkey)) is not None: ent = (p[2], time.time_ns())
+    if ent is None:
+      cur = db_connection().cursor()
+      try:
+        res = cur.execute(f"SELECT val, accessed_at FROM '{table}_{VERSION}' WHERE {' AND '.join([f'{x}=?' for x in key.keys()])}",
+                          tuple(key.values()))
+      except sqlite3.OperationalError:
+        return None  # table doesn't exist
+      if (row:=res.fetchone()) is None: return None
+      ent = (row[0], row[1] or 0)
+    if (now:=time.time_ns()) - ent[1] >= CACHE_TOUCH_INTERVAL * 1e9 and mkey not in _db_pending:
+      _db_touched[mkey] = (table, key, now)
+      ent = (ent[0], now)
+    _db_mem_put(mkey, *ent)
+  return pickle.loads(ent[0])
+
+_db_tables: set[str] = set()
 def diskcache_put(table:str, key:dict|str|int, val:Any, prepickled=False):
+  global _db_flush_pid
   if CACHELEVEL < 1: return val
   if isinstance(key, (str,int)): key = {"key": key}
-  conn = db_connection()
-  cur = conn.cursor()
-  if table not in _db_tables:
-    TYPES = {str: "text", bool: "integer", int: "integer", float: "numeric", bytes: "blob"}
-    ltypes = ', '.join(f"{k} {TYPES[type(key[k])]}" for k in key.keys())
-    cur.execute(f"CREATE TABLE IF NOT EXISTS '{table}_{VERSION}' ({ltypes}, val blob, PRIMARY KEY ({', '.join(key.keys())}))")
-    _db_tables.add(table)
-  cur.execute(f"REPLACE INTO '{table}_{VERSION}' ({', '.join(key.keys())}, val) VALUES ({', '.join(['?']*len(key))}, ?)",
-              tuple(key.values()) + (val if prepickled else pickle.dumps(val),))
-  conn.commit()
-  cur.close()
+  mkey = _db_key(table, key)
+  with _db_lock:
+    _db_pending[mkey] = (table, key, val if prepickled else pickle.dumps(val))
+    _db_mem_put(mkey, _db_pending[mkey][2], time.time_ns())
+    _db_touched.pop(mkey, None)
+    if _db_closing or CACHE_FLUSH_INTERVAL <= 0: diskcache_flush()
+    elif _db_flush_pid != (pid:=os.getpid()):
+      # the first put of each process starts its flush thread, multiprocessing runs the finalizer on exit of the children too
+      _db_flush_pid = pid
+      threading.Thread(target=_db_flush_loop, args=(pid,), daemon=True).start()
+      multiprocessing.util.Finalize(None, _db_close, exitpriority=0)
+  _db_wake.set()
+  return val
+
+def diskcache_items(table:str) -> list[tuple[dict, Any]]:
+  """All the (key, value) entries of a table."""
+  diskcache_flush()
+  with _db_lock:
+    try: cur = db_connection().execute(f"SELECT * FROM '{table}_{VERSION}'")
+    except sqlite3.OperationalError: return []  # table doesn't exist
+    cols = [d[0] for d in cur.description]
+    return [({c:v for c,v in zip(cols, row) if c not in {"val", "accessed_at"}}, pickle.loads(row[cols.index("val")])) for row in cur.fetchall()]
+
+def diskcache_stats() -> dict[str, tuple[int, int, int]]:
+  """Entries, bytes of the values and oldest access time of each table in the database, tables of older VERSIONs have no access time (0)."""
+  diskcache_flush()
+  with _db_lock:
+    cur = db_connection().cursor()
+    ret = {}
+    for t, in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+      acc = "min(accessed_at)" if t.endswith(f"_{VERSION}") else "0"
+      ret[t] = cast(tuple[int, int, int], tuple(x or 0 for x in cur.execute(f"SELECT count(*), sum(length(val)), {acc} FROM '{t}'").fetchone()))
+    cur.close()
+  return ret
+
+def diskcache_prune(max_bytes:int) -> int:
+  """Drop the tables of older VERSIONs, evict down to max_bytes (if set) and give the space back to the filesystem. Returns the bytes freed."""
+  diskcache_flush()
+  with _db_lock:
+    st, conn = os.path.getsize(CACHEDB), db_connection()
+    for t, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+      if not t.endswith(f"_{VERSION}"): conn.execute(f"DROP TABLE IF EXISTS '{t}'")
+    if max_bytes > 0: diskcache_evict(max_bytes)
+    conn.commit()
+    conn.execute("VACUUM")
+    with contextlib.suppress(sqlite3.OperationalError): conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return st - os.path.getsize(CACHEDB)
+
+# *** content addressed file store ***
+
+def filecache_path(table:str, key:str) -> pathlib.Path:
+  h = hashlib.sha256(key.encode()).hexdigest()
+  return pathlib.Path(CCACHE_DIR.value) / f"{table}_{VERSION}" / h[:2] / h[2:]
+
+def filecache_get(table:str, key:str) -> bytes|None:
+  if CACHELEVEL < 1: return None
+  try: return filecache_path(table, key).read_bytes()
+  except FileNotFoundError: return None
+
+def filecache_put(table:str, key:str, val:bytes) -> bytes:
+  if CACHELEVEL < 1: return val
+  (fn:=filecache_path(table, key)).parent.mkdir(parents=True, exist_ok=True)
+  # the rename is atomic, a reader sees either no file or the whole one, and writers of the same key write the same bytes
+  fd, tmp = tempfile.mkstemp(dir=fn.parent, prefix=".tmp")
+  with os.fdopen(fd, "wb") as f: f.write(val)
+  os.replace(tmp, fn)
   return val
 
 def diskcache(func:Callable[..., T]):
@@ -0,0 +1,81 @@
+import ctypes, platform, sys, time, os
+from typing import cast
+from tinygrad.helpers import PROFILE, suppress_finalizing
+from tinygrad.device import Buffer, Device
+from tinygrad.engine.realize import ExecItem, CompiledRunner
+from tinygrad.engine.jit import MultiGraphRunner
+from tinygrad.renderer.cstyle import ClangJITRenderer
+from tinygrad.runtime.graph.hcq import HCQGraph
+from tinygrad.runtime.ops_cpu import CPUProgram
+
+class CPUGraph(HCQGraph):
+  """
+  Compiles a batch of CPU kernels into one C dispatcher that calls the kernel entry points with the buffer pointers baked in, so a replay is a
+  single command on the CPU queue. Every pool thread runs the dispatcher with its core_id and the threads meet at a spinning barrier around
+  threaded kernels. Batches the dispatcher can't take (LLVM/LVP kernels, several devices, PROFILE) fall back to HCQGraph, and so do batches
+  with more threads than the process has cores, where the spinning threads would take the cores of the ones they wait for.
+  """
+  def __init__(self, jit_cache: list[ExecItem], input_buffers: list[Buffer], var_vals: dict[str, int],
+               orig_valid_positions: dict[int, set[int]]|None = None):
+    dev = cast(CompiledRunner, jit_cache[0].prg).dev
+    self.native = not PROFILE and isinstance(dev.renderer, ClangJITRenderer) and all(isinstance(ji.prg, CompiledRunner) and ji.prg.dev is dev and
+      all(isinstance(g, int) for g in ji.prg.p.global_size) and all(Device[b.device] is dev for b in ji.bufs if b is not None) for ji in jit_cache)
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    self.native = self.native and max(cast(CompiledRunner, ji.prg).p.global_size[0] for ji in jit_cache) <= cores
+    if not self.native: return super().__init__(jit_cache, input_buffers, var_vals, orig_valid_positions)
+    MultiGraphRunner.__init__(self, jit_cache, input_buffers, var_vals, orig_valid_positions)
+
+    vt = "long long" if platform.machine() == "arm64" else "int"
+    abi = "__attribute__((ms_abi)) " if sys.platform == "win32" else ""
+    self.threads = max(cast(CompiledRunner, ji.prg).p.global_size[0] for ji in jit_cache)
+    # count and generation of the barrier, the dispatcher only touches them when the batch is threaded
+    self.barrier = (ctypes.c_uint32 * 2)()
+
+    body: list[str] = []
+    for j,ji in enumerate(jit_cache):
+      prg = cast(CompiledRunner, ji.prg)
+      bufs = [f"in[{self.input_replace[(j,i)]}]" if (j,i) in self.input_replace else f"{cast(Buffer, b)._buf.va_addr:#x}ull"
+              for i,b in enumerate(ji.bufs)]
+      var_idx = dict(self.var_vals_replace.get(j, []))
+      vals = ["tid" if v.expr in prg.p.runtimevars else f"v[{var_idx[i]}]" if i in var_idx else str(ji.fixedvars[v.expr])
+              for i,v in enumerate(prg.p.vars)]
+      fxn = f"(({abi}void(*)({', '.join(['u64']*len(bufs) + [vt]*len(vals))}))" + f"{ctypes.cast(prg._prg.fxn, ctypes.c_void_p).value:#x}ull)"
+      call = f"{fxn}({', '.join(bufs + vals)});"
+      threads = prg.p.global_size[0]
+      # a single threaded kernel runs on core 0, the others wait at the barrier when the kernel before or after is threaded
+      if self.threads > 1 and j > 0 and (threads > 1 or cast(CompiledRunner, jit_cache[j-1].prg).p.global_size[0] > 1): body.append("barrier();")
+      body.append(call if threads == self.threads else f"if (tid < {threads}) {call}")
+
+    src = f"""typedef unsigned long long u64;
+static inline __attribute__((always_inline)) void barrier_wait(unsigned *b, unsigned n) {{
+  unsigned gen = __atomic_load_n(&b[1], __ATOMIC_ACQUIRE);
+  if (__atomic_add_fetch(&b[0], 1, __ATOMIC_ACQ_REL) == n) {{
+    __atomic_store_n(&b[0], 0, __ATOMIC_RELAXED);
+    __atomic_add_fetch(&b[1], 1, __ATOMIC_RELEASE);
+  }} else while (__atomic_load_n(&b[1], __ATOMIC_ACQUIRE) == gen);
+}}
+#define barrier() barrier_wait((unsigned *){ctypes.addressof(self.barrier):#x}ull, {self.threads})
+{abi}void batch(u64 tid, u64 *in, {vt} *v) {{
+  {(chr(10)+'  ').join(body)}
+}}"""
+    self.prg = CPUProgram(dev, "batch", dev.renderer.compiler.compile(src))
+    self.n_in, self.in_t = len(input_buffers), ctypes.c_uint64 * len(input_buffers)
+    self.vals_t = (ctypes.c_int64 if platform.machine() == "arm64" else ctypes.c_int32) * len(self.vars)
+
+  def _dispatch(self, tid:int, *args:int):
+    self.prg.fxn(ctypes.c_uint64(tid), self.in_t(*args[:self.n_in]), self.vals_t(*args[self.n_in:]))
+
+  def __call__(self, input_buffers: list[Buffer], var_vals: dict[str, int], wait=False) -> float|None:
+    if not self.native: return super().__call__(input_buffers, var_vals, wait)
+    st = time.perf_counter()
+    args = [b._buf.va_addr for b in input_buffers] + [var_vals[v] for v in self.vars]
+    self.dev.hw_compute_queue_t().wait(self.dev.timeline_signal, self.dev.timeline_value - 1).cmd(self._dispatch, *args, threads=self.threads) \
+                                 .signal(self.dev.timeline_signal, self.dev.next_timeline()).submit(self.dev)
+    if wait:
+      self.dev.synchronize()
+      return time.perf_counter() - st
+    return None
+
+  @suppress_finalizing
+  def __del__(self):
+    if not self.native: super().__del__()
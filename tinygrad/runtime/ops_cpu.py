@@ -1,7 +1,8 @@
 from __future__ import annotations
-import platform, sys, ctypes, functools, time, mmap, threading, queue
-from tinygrad.helpers import to_mv, OSX, WIN, mv_address, wait_cond, suppress_finalizing, unwrap, data64_le
-from tinygrad.helpers import CPU_CC, CPU_LVP, CPU_LLVM
+import platform, sys, ctypes, functools, time, mmap, threading, queue, os, itertools, contextlib
+from typing import Iterator
+from tinygrad.helpers import to_mv, OSX, WIN, mv_address, wait_cond, suppress_finalizing, unwrap, data64_le, round_up
+from tinygrad.helpers import CPU_CC, CPU_LVP, CPU_LLVM, CPU_ARENA, CPU_ARENA_POPULATE, CPU_COUNT, CPU_PIN, CPU_GRAPH
 from tinygrad.device import BufferSpec, DMACPURef, CompilerSet, CompilerPair
 from tinygrad.runtime.support.hcq import HCQCompiled, HCQAllocator, HCQBuffer, HWQueue, HCQArgsState, HCQSignal, HCQProgram, MMIOInterface
 from tinygrad.runtime.support.hcq import CLikeArgsState
@@ -10,6 +11,7 @@ from tinygrad.renderer.llvmir import CPULLVMRenderer
 from tinygrad.renderer.nir import LVPRenderer
 from tinygrad.runtime.support.compiler_cpu import CPULLVMCompiler
 from tinygrad.runtime.support.elf import jit_loader
+from tinygrad.runtime.support.memory import TLSFAllocator
 from tinygrad.uop.ops import sint
 
 class CPUSignal(HCQSignal):
@@ -17,16 +19,50 @@ class CPUSignal(HCQSignal):
     if self.is_timeline and self.owner is not None: self.owner.tasks.join()
     return False
 
+class CPUWorkerPool:
+  """
+  Persistent threads that run the core_ids of a threaded kernel. The chunks are handed out with an atomic counter, so a slow core doesn't
+  hold back the others, and the caller runs chunks too. Workers are pinned to the cores of the process affinity when CPU_PIN is set.
+  """
+  def __init__(self, workers:int):
+    self.cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    self.job: tuple|None = None
+    self.wake, self.workers = threading.Semaphore(0), 0
+    self.grow(workers)
+
+  def grow(self, workers:int):
+    for wid in range(self.workers, workers): threading.Thread(target=self._worker, args=(wid+1,), daemon=True).start()
+    self.workers = max(self.workers, workers)
+
+  def _worker(self, wid:int):
+    if CPU_PIN and len(self.cores) > 1:
+      with contextlib.suppress(OSError): os.sched_setaffinity(0, {self.cores[wid % len(self.cores)]})
+    while True:
+      self.wake.acquire()
+      # NOTE: a late worker can pick up a newer job or a finished one, both are fine
+      if self.job is not None: self._work(*self.job)
+
+  def _work(self, cmd, args, n:int, chunks:Iterator[int], finished:Iterator[int], done:threading.Event, errors:list[Exception]):
+    # next() on itertools.count is atomic under the GIL, the kernel itself runs without it
+    while (tid:=next(chunks)) < n:
+      # an error is raised in the caller, the worker stays alive for the next job
+      try: cmd(tid, *args)
+      except Exception as e: errors.append(e)
+      finally:
+        if next(finished) == n: done.set()
+
+  def run(self, cmd, args, n:int):
+    done, errors = threading.Event(), list[Exception]()
+    self.job = job = (cmd, args, n, itertools.count(), itertools.count(1), done, errors)
+    for _ in range(n - 1): self.wake.release()
+    self._work(*job)
+    done.wait()
+    if errors: raise errors[0]
+
 class CPUWorker(threading.Thread):
   def __init__(self, dev, tasks, thread_id):
     super().__init__()
-    self.dev, self.tasks, self.thread_id, self.pool, self.daemon = dev, tasks, thread_id, [], True
-
-  def push_task(self, tid, cmd, args):
-    if len(self.pool) <= tid:
-      self.pool.append(queue.Queue())
-      CPUWorker(self, self.pool[tid], thread_id=tid+1).start()
-    self.pool[tid].put([cmd, 1, len(args)] + args)
+    self.dev, self.tasks, self.thread_id, self.pool, self.daemon = dev, tasks, thread_id, None, True
 
   def run(self):
     while True:
@@ -34,9 +70,12 @@ class CPUWorker(threading.Thread):
       for cmd in cmd_iter:
         threads, args_cnt = next(cmd_iter), next(cmd_iter)
         args = [next(cmd_iter) for _ in range(args_cnt)]
-        for th in range(threads - 1): self.push_task(th, cmd, args)
-        cmd(self.thread_id, *args)
-        for th in range(threads - 1): self.pool[th].join()
+        if threads > 1:
+          if self.pool is None: self.pool = CPUWorkerPool(max(CPU_COUNT.value, threads) - 1)
+          # the CPUGraph dispatcher waits at barriers, every chunk needs its own thread
+          self.pool.grow(threads - 1)
+          self.pool.run(cmd, args, threads)
+        else: cmd(self.thread_id, *args)
       self.tasks.task_done()
 
 class CPUComputeQueue(HWQueue):
@@ -116,12 +155,35 @@ class CPUProgram(HCQProgram):
     if sys.platform == 'win32': ctypes.windll.kernel32.VirtualFree(ctypes.c_void_p(self.mem), ctypes.c_size_t(0), 0x8000) #0x8000 - MEM_RELEASE
 
 class CPUAllocator(HCQAllocator):
-  def __init__(self, dev:CPUDevice): super().__init__(dev, supports_copy_from_disk=False, supports_transfer=False)
+  def __init__(self, dev:CPUDevice):
+    # small buffers are carved out of big arenas, an mmap syscall per buffer is slow and wastes a page on each small one
+    self.arena_size = CPU_ARENA.value << 20
+    self.arenas: list[tuple[HCQBuffer, TLSFAllocator]] = []
+    super().__init__(dev, supports_copy_from_disk=False, supports_transfer=False)
+  def _new_arena(self) -> tuple[HCQBuffer, TLSFAllocator]:
+    flags = mmap.MAP_ANON | mmap.MAP_SHARED | (getattr(mmap, "MAP_POPULATE", 0) if CPU_ARENA_POPULATE else 0)
+    addr = mv_address(buf:=mmap.mmap(-1, self.arena_size, flags, mmap.PROT_READ | mmap.PROT_WRITE))
+    if (hp:=getattr(mmap, "MADV_HUGEPAGE", None)) is not None:
+      try: buf.madvise(hp)
+      except OSError: pass # some systems have transparent_hugepage disabled
+    self.arenas.append(arena:=(HCQBuffer(addr, self.arena_size, meta=buf, view=MMIOInterface(addr, self.arena_size, fmt='B'), owner=self.dev),
+                               TLSFAllocator(self.arena_size, block_size=64)))
+    return arena
   def _alloc(self, size:int, options:BufferSpec) -> HCQBuffer:
+    if options.external_ptr is None and not options.host and not WIN and 0 < size <= self.arena_size // 16:
+      # 64 byte aligned blocks, the arena itself is page aligned. the newest arena is the most likely to have room
+      for arena_buf, tlsf in reversed(self.arenas):
+        try: return arena_buf.offset(tlsf.alloc(round_up(size, 64)), size)
+        except MemoryError: pass
+      arena_buf, tlsf = self._new_arena()
+      return arena_buf.offset(tlsf.alloc(round_up(size, 64)), size)
     if options.external_ptr is not None: addr, buf = options.external_ptr, None
     elif WIN: addr = mv_address(buf:=mmap.mmap(-1, size, access=mmap.ACCESS_WRITE))
     else: addr = mv_address(buf:=mmap.mmap(-1, size, mmap.MAP_ANON | mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE))
     return HCQBuffer(va:=addr, sz:=size, meta=buf, view=MMIOInterface(va, sz, fmt='B'), owner=self.dev)
+  def _do_free(self, buf:HCQBuffer, options:BufferSpec):
+    for arena_buf, tlsf in self.arenas:
+      if buf._base is arena_buf: return tlsf.free(buf.va_addr - arena_buf.va_addr)
   def _as_buffer(self, src) -> memoryview:
     self.dev.synchronize()
     return to_mv(src.va_addr, src.size)
@@ -138,3 +200,6 @@ class CPUDevice(HCQCompiled):
     compilers = CompilerSet([CompilerPair(ClangJITRenderer, None), CompilerPair(CPULLVMRenderer, CPULLVMCompiler, ctrl_var=CPU_LLVM),
                              CompilerPair(LVPRenderer, None, ctrl_var=CPU_LVP)], ctrl_var=CPU_CC)
     super().__init__(device, CPUAllocator(self), compilers, functools.partial(CPUProgram, self), CPUSignal, CPUComputeQueue)
+    if CPU_GRAPH:
+      from tinygrad.runtime.graph.cpu import CPUGraph
+      self.graph = CPUGraph
@@ -1,13 +1,18 @@
-import ctypes, platform, sys, subprocess
+import ctypes, platform, sys, subprocess, re, threading, weakref
 from tinygrad.device import Compiler
 from tinygrad.helpers import OSX, getenv, capstone_flatdump, DEBUG, unwrap
 from tinygrad.runtime.support.elf import jit_loader
 from tinygrad.runtime.autogen import llvm
 
+# top level function definitions of a rendered kernel: the kernel itself and static helpers like the AMX wmma
+c_function_def = re.compile(r"^(static )?(?!typedef)[^\s#][^\n;{}=]*?\b(\w+)\((?:[^()\n]|\([^()\n]*\))*\)\s*\{", re.M)
+
+# NOTE: this runs the clang binary for every compile. libclang only parses C, in-process compiles on the CPU go through CPULLVMCompiler (CPU_LLVM=1)
 class ClangJITCompiler(Compiler):
+  supports_batch = True
   def __init__(self, cachekey="compile_clang_jit"): super().__init__(cachekey)
 
-  def compile_to_obj(self, src:str) -> bytes:
+  def compile_to_obj(self, src:str, extra_args:tuple[str, ...]=()) -> bytes:
     """Compile C source to ELF object file (before linking)."""
     # -fno-math-errno is required for __builtin_sqrt to become an instruction instead of a function call
     # x18 is a reserved platform register. It is clobbered on context switch in macos and is used to store TEB pointer in windows on arm, don't use it
@@ -16,10 +21,27 @@ class ClangJITCompiler(Compiler):
     arch = {'x86_64': '-march=native', 'AMD64': '-march=native', 'riscv64': '-march=rv64g'}.get(platform.machine(), "-mcpu=native")
     args = [arch, f'--target={target}-none-unknown-elf', '-O2', '-fPIC', '-ffreestanding', '-fno-math-errno', '-nostdlib', '-fno-ident']
     arch_args = ['-ffixed-x18'] if target == 'arm64' else []
-    return subprocess.check_output([getenv("CC", 'clang'), '-c', '-x', 'c', *args, *arch_args, '-', '-o', '-'], input=src.encode('utf-8'))
+    return subprocess.check_output([getenv("CC", 'clang'), '-c', '-x', 'c', *args, *arch_args, *extra_args, '-', '-o', '-'],
+                                   input=src.encode('utf-8'))
 
   def compile(self, src:str) -> bytes: return jit_loader(self.compile_to_obj(src))
 
+  def compile_batch(self, srcs:list[str]) -> list[bytes]:
+    """
+    Compile the kernels in one clang call, the process spawn and frontend startup dominate the compile time of small kernels.
+    Each function is renamed with a per source prefix and gets its own section, then every kernel is loaded with only the sections it reaches.
+    """
+    if len(srcs) <= 1: return [self.compile(src) for src in srcs]
+    tu, entries = [], []
+    for i,src in enumerate(srcs):
+      fxns = [(m.group(2), m.group(1) is not None) for m in c_function_def.finditer(src)]
+      entries.append(f"_k{i}_" + next(name for name,static in fxns if not static))
+      tu += [f"#define {name} _k{i}_{name}" for name,_ in fxns] + [src] + [f"#undef {name}" for name,_ in fxns]
+    # one bad kernel fails the whole unit, compiling them one by one raises on the one that is broken
+    try: obj = self.compile_to_obj("\n".join(tu), ('-ffunction-sections', '-fdata-sections'))
+    except subprocess.CalledProcessError: return [self.compile(src) for src in srcs]
+    return [jit_loader(obj, entry=entry) for entry in entries]
+
   def disassemble(self, lib:bytes): return capstone_flatdump(lib)
 
 def cerr(): return ctypes.pointer(ctypes.pointer(ctypes.c_char()))
@@ -28,6 +50,29 @@ def expect(x, err, ret=None):
   if x: raise RuntimeError(unwrap(ctypes.cast(err.contents, ctypes.c_char_p).value).decode() if not isinstance(err, str) else err)
   return ret
 
+class LLVMThreadState:
+  """The LLVM context, target machine and diagnostics of one thread. They are disposed when the thread or the compiler goes away."""
+  def __init__(self, target, triple:bytes, processor:bytes, feats:bytes):
+    self.target_machine = llvm.LLVMCreateTargetMachine(target, triple, processor, feats,
+                                                       llvm.LLVMCodeGenLevelDefault, llvm.LLVMRelocPIC, llvm.LLVMCodeModelDefault)
+    # the handler doesn't reference self, so the state is freed as soon as the thread drops it
+    diag_msgs: list[str] = []
+    self.context, self.diag_msgs = llvm.LLVMContextCreate(), diag_msgs
+    @llvm.LLVMDiagnosticHandler
+    def handle_diag(diag_ref, _arg):
+      severity = llvm.LLVMGetDiagInfoSeverity(diag_ref)
+      msg = ctypes.string_at(llvm.LLVMGetDiagInfoDescription(diag_ref)).decode()
+      if severity == llvm.LLVMDSError:
+        diag_msgs.append(msg)
+    self.handle_diag = handle_diag
+    llvm.LLVMContextSetDiagnosticHandler(self.context, handle_diag, None)
+    weakref.finalize(self, LLVMThreadState.dispose, self.target_machine, self.context)
+
+  @staticmethod
+  def dispose(target_machine, context):
+    llvm.LLVMContextDispose(context)
+    llvm.LLVMDisposeTargetMachine(target_machine)
+
 class LLVMCompiler(Compiler):
   jit = True
   target_arch = {'arm64': 'AArch64', 'aarch64': 'AArch64', 'x86_64': 'X86', 'AMD64': 'X86', 'riscv64': 'riscv64'}[platform.machine()]
@@ -35,10 +80,9 @@ class LLVMCompiler(Compiler):
     for component in ['Target', 'TargetInfo', 'TargetMC', 'AsmParser', 'AsmPrinter']: getattr(llvm, f'LLVMInitialize{self.target_arch}{component}')()
 
     triple = {'AArch64': b'aarch64-none-unknown-elf', 'X86': b'x86_64-none-unknown-elf', 'AMDGPU': b'amdgcn-amd-amdhsa'}[self.target_arch]
-    target = expect(llvm.LLVMGetTargetFromTriple(triple, ctypes.pointer(tgt:=llvm.LLVMTargetRef()), err:=cerr()), err, tgt)
+    self.target = expect(llvm.LLVMGetTargetFromTriple(triple, ctypes.pointer(tgt:=llvm.LLVMTargetRef()), err:=cerr()), err, tgt)
     if DEBUG >= 3: print(f"LLVM init for {processor!r} with {feats!r}")
-    self.target_machine = llvm.LLVMCreateTargetMachine(target, triple, processor.encode(), feats.encode(),
-                                                       llvm.LLVMCodeGenLevelDefault, llvm.LLVMRelocPIC, llvm.LLVMCodeModelDefault)
+    self.triple, self.processor, self.feats = triple, processor.encode(), feats.encode()
 
     self.pbo = llvm.LLVMCreatePassBuilderOptions()
     if (opt:=bool(getenv("LLVMOPT", "1"))):
@@ -51,35 +95,39 @@ class LLVMCompiler(Compiler):
       self.passes = b'default<O0>'
 
     # Create a per-instance context instead of using the global context to avoid shared state between parallel test processes
-    self.context = llvm.LLVMContextCreate()
-    self.diag_msgs: list[str] = []
-    @llvm.LLVMDiagnosticHandler
-    def handle_diag(diag_ref, _arg):
-      severity = llvm.LLVMGetDiagInfoSeverity(diag_ref)
-      msg = ctypes.string_at(llvm.LLVMGetDiagInfoDescription(diag_ref)).decode()
-      if severity == llvm.LLVMDSError:
-        self.diag_msgs.append(msg)
-    self.handle_diag = handle_diag
-    llvm.LLVMContextSetDiagnosticHandler(self.context, handle_diag, None)
+    # LLVM contexts and target machines can't be used from two threads at once, every thread compiling with this instance gets its own
+    self.tls, self.thread_states = threading.local(), weakref.WeakSet[LLVMThreadState]()
     super().__init__(cache_key or f"compile_llvm_{processor}_{feats}{'_jit' if self.jit else ''}{'_opt' if opt else ''}")
 
-  def __del__(self):
-    llvm.LLVMDisposePassBuilderOptions(self.pbo)
-    llvm.LLVMContextDispose(self.context)
+  def _thread_state(self) -> LLVMThreadState:
+    # the thread-local holds the only reference, the state is freed when the thread exits
+    if (st:=getattr(self.tls, "state", None)) is None:
+      self.tls.state = st = LLVMThreadState(self.target, self.triple, self.processor, self.feats)
+      self.thread_states.add(st)
+    return st
+
+  @property
+  def target_machine(self): return self._thread_state().target_machine
+  @property
+  def context(self): return self._thread_state().context
+  @property
+  def diag_msgs(self) -> list[str]: return self._thread_state().diag_msgs
+
+  def __del__(self): llvm.LLVMDisposePassBuilderOptions(self.pbo)
 
   def compile_to_obj(self, src:str) -> bytes:
-    self.diag_msgs.clear()
+    (st:=self._thread_state()).diag_msgs.clear()
     src_buf = llvm.LLVMCreateMemoryBufferWithMemoryRangeCopy(ctypes.create_string_buffer(src_bytes:=src.encode()), len(src_bytes), b'src')
-    mod = expect(llvm.LLVMParseIRInContext(self.context, src_buf, ctypes.pointer(m:=llvm.LLVMModuleRef()), err:=cerr()), err, m)
+    mod = expect(llvm.LLVMParseIRInContext(st.context, src_buf, ctypes.pointer(m:=llvm.LLVMModuleRef()), err:=cerr()), err, m)
     expect(llvm.LLVMVerifyModule(mod, llvm.LLVMReturnStatusAction, err:=cerr()), err)
-    expect(llvm.LLVMRunPasses(mod, self.passes, self.target_machine, self.pbo), 'failed to run passes')
+    expect(llvm.LLVMRunPasses(mod, self.passes, st.target_machine, self.pbo), 'failed to run passes')
     if DEBUG >= 7: print(ctypes.string_at(llvm.LLVMPrintModuleToString(mod)).decode())
-    obj_buf = expect(llvm.LLVMTargetMachineEmitToMemoryBuffer(self.target_machine, mod, llvm.LLVMObjectFile, err:=cerr(),
+    obj_buf = expect(llvm.LLVMTargetMachineEmitToMemoryBuffer(st.target_machine, mod, llvm.LLVMObjectFile, err:=cerr(),
                                                               buf:=llvm.LLVMMemoryBufferRef()), err, buf)
     llvm.LLVMDisposeModule(mod)
     obj = ctypes.string_at(llvm.LLVMGetBufferStart(obj_buf), llvm.LLVMGetBufferSize(obj_buf))
     llvm.LLVMDisposeMemoryBuffer(obj_buf)
-    if self.diag_msgs: raise RuntimeError("llvm diagnostic: " + "\n".join(self.diag_msgs))
+    if st.diag_msgs: raise RuntimeError("llvm diagnostic: " + "\n".join(st.diag_msgs))
     return obj
 
   def compile(self, src:str) -> bytes: return jit_loader(self.compile_to_obj(src)) if self.jit else self.compile_to_obj(src)
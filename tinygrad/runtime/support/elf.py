@@ -12,7 +12,8 @@ def link_sym(sym:str, libs:list[str]) -> int:
     except (OSError, AttributeError): pass
   raise RuntimeError(f'Attempting to relocate against an undefined symbol {sym}')
 
-def elf_loader(blob:bytes, force_section_align:int=1, link_libs:list[str]|None=None) -> tuple[memoryview, list[ElfSection], list[tuple]]:
+def elf_loader(blob:bytes, force_section_align:int=1, link_libs:list[str]|None=None,
+               entry:str|None=None) -> tuple[memoryview, list[ElfSection], list[tuple]]:
   def _strtab(blob: bytes, idx: int) -> str: return blob[idx:blob.find(b'\x00', idx)].decode('utf-8')
 
   header = libc.Elf64_Ehdr.from_buffer_copy(blob)
@@ -26,6 +27,22 @@ def elf_loader(blob:bytes, force_section_align:int=1, link_libs:list[str]|None=N
   symtab = [_to_carray(sh, libc.Elf64_Sym) for sh in sections if sh.header.sh_type == libc.SHT_SYMTAB][0]
   progbits = [sh for sh in sections if sh.header.sh_type == libc.SHT_PROGBITS]
 
+  # with an entry symbol (from an object built with -ffunction-sections), only the sections it reaches are loaded and its section goes first
+  if entry is not None:
+    strtab = sections[next(sh for sh in sections if sh.header.sh_type == libc.SHT_SYMTAB).header.sh_link].content
+    start = next(sym.st_shndx for sym in symtab if sym.st_shndx != 0 and _strtab(strtab, sym.st_name) == entry)
+    keep, todo = {start}, [start]
+    while todo:
+      idx = todo.pop()
+      for sh, _, c_rels in rel + rela:
+        if sh.header.sh_info != idx: continue
+        for r in c_rels:
+          if 0 < (shndx:=symtab[libc.ELF64_R_SYM(r.r_info)].st_shndx) < len(sections) and shndx not in keep:
+            keep.add(shndx)
+            todo.append(shndx)
+    progbits = [sections[start]] + [sh for i,sh in enumerate(sections) if i in keep and i != start and sh.header.sh_type == libc.SHT_PROGBITS]
+    rel, rela = [x for x in rel if x[0].header.sh_info in keep], [x for x in rela if x[0].header.sh_info in keep]
+
   # Prealloc image for all fixed addresses.
   image = bytearray(max([sh.header.sh_addr + sh.header.sh_size for sh in progbits if sh.header.sh_addr != 0] + [0]))
   for sh in progbits:
@@ -45,8 +62,8 @@ def elf_loader(blob:bytes, force_section_align:int=1, link_libs:list[str]|None=N
 
   return memoryview(image), sections, relocs
 
-def jit_loader(obj: bytes, base:int=0, link_libs:list[str]|None=None) -> bytes:
-  image_, _, relocs = elf_loader(obj, link_libs=link_libs)
+def jit_loader(obj: bytes, base:int=0, link_libs:list[str]|None=None, entry:str|None=None) -> bytes:
+  image_, _, relocs = elf_loader(obj, link_libs=link_libs, entry=entry)
   image = bytearray(image_)
 
   def relocate(instr: int, base: int, ploc: int, tgt: int, r_type: int):
@@ -12,7 +12,8 @@ from tinygrad.helpers import suppress_finalizing, disable_gc
 from tinygrad.gradient import compute_gradient
 from tinygrad.mixin import OpMixin
 from tinygrad.mixin.movement import _align_left
-from tinygrad.uop.ops import smax, smin, resolve, UOp, Ops, sint, identity_element, all_metadata, _index_to_concrete_int, sint_to_uop, Variable
+from tinygrad.uop.ops import smax, smin, resolve, UOp, Ops, GroupOp, sint, identity_element, all_metadata, _index_to_concrete_int, sint_to_uop
+from tinygrad.uop.ops import Variable
 from tinygrad.engine.schedule import ExecItem, complete_create_schedule_with_vars
 from tinygrad.device import Device, Buffer
 from tinygrad.engine.realize import run_schedule
@@ -24,12 +25,28 @@ def canonicalize_device(device:str|tuple|list|None) -> str|tuple[str, ...]:
 # *** all in scope Tensors are here. this gets relevant UOps ***
 
 all_tensors: dict[weakref.ref[Tensor], None] = {}
+# the Tensors a schedule might still change, the others are only buffers (and views of them) or consts. replace adds a Tensor back
+lazy_tensors: dict[weakref.ref[Tensor], None] = {}
+
+# the ops the rangeify doesn't tag, so they are never in the map of a schedule. on multiple devices the multi map can change them
+_settled_ops = {Ops.BUFFER, Ops.UNIQUE, Ops.DEVICE, Ops.CONST, Ops.DEFINE_VAR, Ops.BIND, *GroupOp.Movement}
+def _is_settled(u:UOp) -> bool:
+  stack = [u]
+  while stack:
+    if (x:=stack.pop()).op not in _settled_ops or (x.op is Ops.DEVICE and not isinstance(x.arg, str)): return False
+    # the other srcs of a movement op are its shape
+    stack.extend(x.src[:1] if x.op in GroupOp.Movement else x.src)
+  return True
+
 def _apply_map_to_tensors(applied_map:dict[UOp, UOp], name:str) -> None:
   with cpu_profile(TracingKey(name), "TINY"):
-    # get tensors in scope
+    # get tensors in scope, only the lazy ones can be. the ones that settled since the last schedule aren't visited again
     in_scope: dict[UOp, bool] = {}
     def visitor(node: UOp) -> bool: return True if node in applied_map else any(in_scope.get(s, False) for s in node.src)
-    scope_tensors: list[Tensor] = [t for tref in list(all_tensors) if (t:=tref()) is not None and t.uop.topovisit(visitor, in_scope)]
+    scope_tensors: list[Tensor] = []
+    for tref in list(lazy_tensors):
+      if (t:=tref()) is None or _is_settled(t.uop): lazy_tensors.pop(tref, None)
+      elif t.uop.topovisit(visitor, in_scope): scope_tensors.append(t)
 
     # get all Tensors and apply the map
     sink = UOp.sink(*[t.uop for t in scope_tensors])
@@ -170,10 +187,13 @@ class Tensor(OpMixin):
       self.uop = data
 
     # add to all_tensors after construction succeeds
-    all_tensors[weakref.ref(self)] = None
+    ref = weakref.ref(self)
+    all_tensors[ref] = lazy_tensors[ref] = None
 
   @suppress_finalizing
-  def __del__(self): all_tensors.pop(weakref.ref(self), None)
+  def __del__(self):
+    all_tensors.pop(ref:=weakref.ref(self), None)
+    lazy_tensors.pop(ref, None)
 
   def _apply_uop(self, fxn:Callable[..., UOp], *x:Tensor, extra_args=(), **kwargs) -> Tensor:
     srcs = (self,)+x
@@ -185,7 +205,8 @@ class Tensor(OpMixin):
     ret.uop, ret.grad = new_uop, None
     ret.requires_grad = True if any(needs_input_grad) else None if None in needs_input_grad else False
     # add to all_tensors after construction succeeds
-    all_tensors[weakref.ref(ret)] = None
+    ref = weakref.ref(ret)
+    all_tensors[ref] = lazy_tensors[ref] = None
     return ret
 
   def _apply_broadcasted_uop(self, fxn:Callable, x:Tensor|ConstType, reverse=False) -> Tensor:
@@ -273,6 +294,7 @@ class Tensor(OpMixin):
     # used for replacing a Tensor with a new version of it (potentially with a different device and dtype)
     assert self.shape == x.shape or allow_shape_mismatch, f"replace shape mismatch {self.shape} != {x.shape}"
     self.uop = x.uop
+    lazy_tensors[weakref.ref(self)] = None
     return self
 
   def assign(self, x) -> Tensor:
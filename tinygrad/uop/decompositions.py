@@ -317,6 +317,7 @@ def threefry2x32(x: UOp, key: UOp):
 # ***** decomposition patterns *****
 
 powers_of_two = {2**i:i for i in range(64)}
+# cached, the memoized matcher is part of the memo key, so the same args have to give the same matcher
 @functools.cache
 def get_late_rewrite_patterns(ops:tuple[Ops, ...], force_transcendental):
   pat: list[tuple[UPat, Callable]] = []
@@ -364,4 +365,4 @@ def get_late_rewrite_patterns(ops:tuple[Ops, ...], force_transcendental):
   if Ops.FDIV in ops:
     pat += [(UPat.var("x").reciprocal(), lambda x: x.const_like(1).alu(Ops.FDIV, x))]
     pat += [(UPat.var("a", dtypes.floats) * UPat.const(dtypes.floats, 1).alu(Ops.FDIV, UPat.var("b")), lambda a,b: a.alu(Ops.FDIV, b))]
-  return PatternMatcher(pat)
+  return PatternMatcher(pat).memoize()
@@ -7,7 +7,7 @@ from tinygrad.uop import Ops, GroupOp
 from tinygrad.dtype import ConstType, ImageDType, dtypes, DType, truncate, PtrDType, least_upper_dtype, Invalid, InvalidType, AddrSpace, ConstFloat
 from tinygrad.helpers import ContextVar, all_int, prod, getenv, all_same, Context, partition, temp, unwrap, T, argfix, Metadata, flatten, TRACEMETA
 from tinygrad.helpers import PROFILE, dedup, cdiv, cmod, diskcache_put, to_function_name, cpu_profile, TracingKey, VIZ, SPEC
-from tinygrad.helpers import strip_parens, colored, ansilen, printable, panic
+from tinygrad.helpers import strip_parens, colored, ansilen, printable, panic, REWRITE_MEMO
 if TYPE_CHECKING:
   from tinygrad.device import Buffer, MultiBuffer
   from tinygrad.renderer import Estimates
@@ -1013,6 +1013,12 @@ def upat_interpret(p:UPat, fxn:Callable) -> Callable:
       return None
   return universal_match
 
+def upat_may_match(p:UPat, dtype:DType, src_ops:tuple[Ops, ...]) -> bool:
+  # the part of UPat.match that only looks at the dtype and the ops of the sources, and the early reject
+  if p.dtype is not None and dtype not in p.dtype and dtype.scalar() not in p.dtype: return False
+  if len(src_ops) < p.required_len or (p.strict_length and len(src_ops) != p.required_len) or not p.early_reject.issubset(src_ops): return False
+  return p.src is None or any(all(vv.op is None or o in vv.op for o,vv in zip(src_ops, vp)) for vp in p.src)
+
 def upat_deferred_compile(p:UPat, fxn:Callable, entry:list) -> Callable:
   def lazy_compile(uop, ctx):
     from tinygrad.uop.upat import upat_compile
@@ -1020,8 +1026,34 @@ def upat_deferred_compile(p:UPat, fxn:Callable, entry:list) -> Callable:
     return entry[1](uop, ctx)
   return lazy_compile
 
+def contextvar_refs(fxns:list) -> list[ContextVar]:
+  """
+  The ContextVars the functions read by name, following the global functions and matchers they use and the UOp methods they call.
+  Attribute reads like helpers.X aren't seen, memoize takes those.
+  """
+  ret, seen, todo = [], set(), list(fxns)
+  while todo:
+    if isinstance(f:=todo.pop(), PatternMatcher): todo += [fxn for _,fxn in f.patterns]
+    # properties, cached functions and partials hold the function
+    while (inner:=getattr(f, "fget", None) or getattr(f, "func", None) or getattr(f, "__wrapped__", None)) is not None: f = inner
+    if not isinstance(f, types.FunctionType) or f in seen: continue
+    seen.add(f)
+    codes, names = [f.__code__], set[str]()
+    while codes:
+      names.update((c:=codes.pop()).co_names)
+      codes += [x for x in c.co_consts if isinstance(x, types.CodeType)]
+    for n in names:
+      if isinstance(v:=f.__globals__.get(n), ContextVar): ret.append(v)
+      elif v is not None: todo.append(v)
+      if (m:=UOp.__dict__.get(n)) is not None: todo.append(m)
+    for cell in f.__closure__ or ():
+      try: todo.append(cell.cell_contents)
+      except ValueError: pass  # not assigned yet
+  return ret
+
 class PatternMatcher:
-  def __init__(self, patterns:Sequence[tuple[UPat, Callable|tuple]], compiled=bool(getenv("UPAT_COMPILE", 1))):
+  def __init__(self, patterns:Sequence[tuple[UPat, Callable|tuple]], compiled=bool(getenv("UPAT_COMPILE", 1)),
+               dispatch=bool(getenv("UPAT_DISPATCH", 1))):
     # if this comes from a pickle, we reconstruct the lambda functions here
     self.patterns:list[tuple[UPat, Callable]] = [(p,types.FunctionType(*fxn) if isinstance(fxn, tuple) else fxn) for p,fxn in patterns]
     # NOTE: use of DefaultDict here is very dangerous! all keys will live for the lifetime of the PatternMatcher!
@@ -1032,14 +1064,52 @@ class PatternMatcher:
       entry: list = [p, None, p.early_reject]
       entry[1] = upat_deferred_compile(p, fxn, entry) if compiled else upat_interpret(p, fxn)
       for uop in p.op: self.pdict.setdefault(uop, []).append(entry)
+    # the entries that can match a UOp with this (op, dtype, src ops), filled on first use. the keys are few, unlike the UOps
+    self.dispatch: dict[tuple[Ops, DType|type, tuple[Ops, ...]], list[list]]|None = {} if dispatch else None
+    # with no pattern on a pointer dtype every pointer matches the same patterns, so they share one key whatever their size or addrspace
+    self.ptr_key = not any(isinstance(dt, PtrDType) for p,_ in self.patterns if p.dtype is not None for dt in p.dtype)
+    # set by memoize, a pure matcher and the ContextVars its rewrites depend on that can't be found from the functions
+    self.pure, self.extra_deps = False, tuple[ContextVar, ...]()
+
+  def memoize(self, *deps:ContextVar) -> PatternMatcher:
+    """
+    Mark the matcher pure: with no ctx (or a str ctx like a device) the rewrite of a UOp only depends on the UOp and ContextVars.
+    With REWRITE_MEMO the results are kept across graph_rewrite calls. The sum of pure matchers is pure.
+    Only memoize matchers that are built once, the matcher is part of the memo key.
+    """
+    self.pure, self.extra_deps = True, deps
+    return self
+
+  @functools.cached_property
+  def memo_deps(self) -> tuple[ContextVar, ...]|None:
+    """The ContextVars the rewrites of a pure matcher depend on: the ones passed to memoize and the ones the rewrite functions read."""
+    if not self.pure: return None
+    return tuple({v.key:v for v in (*self.extra_deps, *contextvar_refs([fxn for _,fxn in self.patterns]))}.values())
 
   def __reduce__(self): return PatternMatcher, ([(x,deconstruct_function(fxn) if fxn.__name__ == "<lambda>" else fxn) for x,fxn in self.patterns],)
 
   @functools.cache  # pylint: disable=method-cache-max-size-none
-  def __add__(self, more:PatternMatcher) -> PatternMatcher: return PatternMatcher(self.patterns+more.patterns)
+  def __add__(self, more:PatternMatcher) -> PatternMatcher:
+    ret = PatternMatcher(self.patterns+more.patterns)
+    return ret.memoize(*self.extra_deps, *more.extra_deps) if self.pure and more.pure else ret
+
+  def candidates(self, uop:UOp) -> list[list]:
+    """The [UPat, match, early_reject] entries that can match uop from its op, dtype and the ops of its sources, in order."""
+    if self.dispatch is None: return self.pdict.get(uop.op, [])
+    if (ret:=self.dispatch.get(key:=self.dispatch_key(uop))) is None:
+      ret = self.dispatch[key] = [e for e in self.pdict.get(uop.op, []) if upat_may_match(e[0], uop.dtype, key[2])]
+    return ret
+
+  def dispatch_key(self, uop:UOp) -> tuple[Ops, DType|type, tuple[Ops, ...]]:
+    return (uop.op, PtrDType if self.ptr_key and isinstance(uop.dtype, PtrDType) else uop.dtype, tuple([u.op for u in uop.src]))
 
   def rewrite(self, uop:UOp, ctx=None):
-    if len(pats:=self.pdict.get(uop.op, [])):
+    if self.dispatch is not None:
+      if uop.op not in self.pdict: return None
+      if (pats:=self.dispatch.get(self.dispatch_key(uop))) is None: pats = self.candidates(uop)
+      for _,match,_ in pats:
+        if (ret:=match(uop, ctx)) is not None and ret is not uop: return ret
+    elif len(pats:=self.pdict.get(uop.op, [])):
       ler = {u.op for u in uop.src}
       for _,match,early_reject in pats:
         if not early_reject.issubset(ler): continue
@@ -1126,7 +1196,7 @@ def profile_matches(fxn:Callable):
 
 class TrackedPatternMatcher(PatternMatcher):
   def rewrite(self, uop:UOp, ctx=None):
-    if len(pats:=self.pdict.get(uop.op, [])):
+    if len(pats:=self.candidates(uop)):
       ret = None
       ler = {u.op for u in uop.src}
       for p,match,early_reject in pats:
@@ -1194,6 +1264,15 @@ class RewriteContext:
     self.bpm_cache: dict[UOp, UOp|None] = {}
     self.ctx = ctx
     self.replace: dict[UOp, UOp] = {}
+    # with REWRITE_MEMO a pure matcher keeps the results in the UOps, so they go away with them. None is for a UOp that doesn't change
+    self.memo_key: tuple|None = None
+    if REWRITE_MEMO and not TRACK_MATCH_STATS and (ctx is None or isinstance(ctx, str)) and (pm is None) != (bpm is None) and \
+       (p:=pm or bpm).memo_deps is not None:
+      self.memo_key = (p, pm is None, ctx, *[v.value for v in p.memo_deps])
+
+  def save_memo(self):
+    if self.memo_key is None: return
+    for k,v in self.replace.items(): k.__dict__.setdefault("_rewrite_memo", {})[self.memo_key] = None if v is k else v
 
   # no cache needed: pm_rewrite is called at most once per UOp due to the replace dict check in unified_rewrite
   def pm_rewrite(self, x:UOp) -> UOp|None: return unwrap(self.pm).rewrite(x, self.ctx)
@@ -1211,6 +1290,10 @@ class RewriteContext:
       n, stage, new_n = stack.pop()
       if n in self.replace: continue  # skip any nodes we have seen
       if stage == 0:
+        if self.memo_key is not None and (memo:=n.__dict__.get("_rewrite_memo")) is not None and \
+           (memo_n:=memo.get(self.memo_key, SENTINEL)) is not SENTINEL:
+          self.replace[n] = n if memo_n is None else memo_n
+          continue
         # if bottom up, we rewrite this node early. in both cases, we add its srcs to the stack
         if self.bpm is not None:
           # apply rewrite rules until a fixed point is reached. may return `uop` itself if PatternMatcher doesn't match
@@ -1264,7 +1347,9 @@ class RewriteContext:
 @profile_matches
 def graph_rewrite(sink:UOp, pm:PatternMatcher, ctx=None, bottom_up=False, name=None, bpm=None) -> UOp:
   rewrite_ctx = RewriteContext(pm if not bottom_up else None, pm if bottom_up else bpm, ctx)
-  return rewrite_ctx.unified_rewrite(sink)
+  ret = rewrite_ctx.unified_rewrite(sink)
+  rewrite_ctx.save_memo()
+  return ret
 
 @profile_matches
 def graph_rewrite_map(sink:UOp, pm:PatternMatcher, ctx=None, bottom_up=False, name=None, bpm=None,
@@ -1274,6 +1359,7 @@ def graph_rewrite_map(sink:UOp, pm:PatternMatcher, ctx=None, bottom_up=False, na
   for k in (list(sink.toposort())[::-1] if bottom_up else sink.toposort()):
     new_map[k] = v = rewrite_ctx.unified_rewrite(k)
     if k is not v and k.metadata is not None: all_metadata[v] = tuple(dedup(all_metadata.get(v, ())))+k.metadata
+  rewrite_ctx.save_memo()
   if input_map is not None:
     for k,v in input_map.items(): new_map[k] = new_map.get(v,v)
   return new_map
@@ -1303,7 +1389,7 @@ pm_lower_index_dtype = PatternMatcher([
    lambda buf,idx,valid: buf.index(idx, valid, ptr=True)),
   (UPat((Ops.SINK, Ops.NOOP, Ops.END), name="n"),
    lambda n: n.replace(src=tuple(s.src[0] if s.op is Ops.CAST and s.dtype == dtypes.index else s for s in n.src))),
-])
+]).memoize()
 def _index_to_concrete_int(u:UOp) -> UOp: return graph_rewrite(u.sink(), pm_lower_index_dtype).src[0]
 
 _substitute = PatternMatcher([(UPat(tuple(Ops), name="x"), lambda ctx,x: ctx.get(x,None))])